@@ -1,9 +1,93 @@
 import math
 import time
 import logging
+from pid import PidController
 
 logger = logging.getLogger(__name__)
 
+"""Prefixes of properties the device changes itself, whose writes are never dropped.
+
+Writing an encoder resets it, so a write equal to the last one is still needed once it has counted.
+"""
+VOLATILE_PROPERTY_PREFIXES = ("enc_",)
+
+
+class CommandBuffer:
+    """A Robot-like object that batches property writes and drops redundant ones.
+
+    Between begin and flush, writes are held in the buffer, later writes to a property replacing
+    earlier ones, and reads of a property with a held write return the held value. flush then sends
+    each held write to the robot unless it equals the value last sent for that property. Outside a
+    batch, writes are sent immediately but still dropped if redundant. Attributes other than
+    get_value and set_value are the robot's own.
+
+    Since writes are sent late, errors the robot raises for them (such as for a value of the wrong
+    type) are raised from flush rather than from set_value.
+    """
+
+    def __init__(self, robot):
+        """Creates a CommandBuffer writing to robot, outside a batch.
+
+        Positional arguments:
+        robot -- the Robot or Robot-like object to write properties to
+        """
+        self._robot = robot
+        self._pending = None # maps (device id, property) pairs to values written this batch
+        self._sent = {} # maps (device id, property) pairs to the values last sent to the robot
+        self.write_count = 0
+        self.sent_count = 0
+
+    def __getattr__(self, name):
+        return getattr(self._robot, name)
+
+    def invalidate(self):
+        """Forgets the values last sent, so the next write to each property is sent.
+
+        Call this whenever the robot's properties may have changed other than by writes through
+        the buffer, such as after a mode change or a device reset.
+        """
+        self._sent = {}
+
+    def begin(self):
+        """Starts holding writes until flush is called."""
+        self._pending = {}
+
+    def flush(self):
+        """Sends the held writes to the robot and stops holding writes."""
+        pending = self._pending
+        self._pending = None
+        for (device_id, value_name), value in pending.items():
+            self._send(device_id, value_name, value)
+
+    def get_value(self, device_id, value_name):
+        if self._pending and (device_id, value_name) in self._pending:
+            return self._pending[(device_id, value_name)]
+        return self._robot.get_value(device_id, value_name)
+
+    def set_value(self, device_id, value_name, value):
+        self.write_count += 1
+        if self._pending is None:
+            self._send(device_id, value_name, value)
+        else:
+            self._pending[(device_id, value_name)] = value
+
+    def _send(self, device_id, value_name, value):
+        key = (device_id, value_name)
+        # Compare types too, since 1 == 1.0 == True but the robot may treat them differently:
+        if (key in self._sent and type(self._sent[key]) is type(value) and self._sent[key] == value
+                and not value_name.startswith(VOLATILE_PROPERTY_PREFIXES)):
+            return
+        self._robot.set_value(device_id, value_name, value)
+        self._sent[key] = value
+        self.sent_count += 1
+
+    def __str__(self):
+        # Writes still held haven't been sent or dropped yet:
+        held_count = len(self._pending) if self._pending else 0
+        dropped_count = self.write_count - held_count - self.sent_count
+        return (f"{self.write_count} writes, {self.sent_count} sent to the robot "
+            f"({dropped_count / self.write_count * 100 if self.write_count else 0:.1f}% dropped)")
+
 
 class Motor:
     """Wraps a PiE KoalaBear-controlled motor."""
@@ -46,87 +130,107 @@ class Motor:
 
 class PidMotor(Motor):
     """Adds custom PID control to a Motor since PiE's implementation is weird."""
-    def __init__(self, robot, controller_id, motor):
+    def __init__(self, robot, controller_id, motor, clock=time.monotonic):
         super().__init__(robot, controller_id, motor)
         super().set_pid(None, None, None)
-        self._clear_samples()
-        self._max_samples = 200
-        self._derivative_samples = 20
+        self._clock = clock
         self._held_position = None
-        self._last_timestamp = None
-        self._coeffs = None
+        self._pid = None
     def set_velocity(self, velocity):
-        self._held_position = None # force clear on next hold_position call
+        self._held_position = None # hold the current position on next hold_position call
         super().set_velocity(velocity)
         return self
     def set_pid(self, p, i, d):
         if not (p and i and d):
-            self._coeffs = None # unspecified or incomplete set
+            self._pid = None # unspecified or incomplete set
         else:
-            self._coeffs = (p, i, d)
+            self._pid = PidController(p, i, d, clock=self._clock)
         return self
     def set_position(self, pos):
-        self._clear_samples()
+        if self._pid and self._held_position is None:
+            # Only start afresh when starting to hold, so a moving target is followed smoothly:
+            self._pid.reset()
         self._held_position = pos
         return self
-    def hold_position(self):
-        if not self._coeffs:
+    def hold_position(self, feedforward=0.0):
+        """Steps the PID towards the held position, adding feedforward to the velocity."""
+        if not self._pid:
             raise Exception("PID coefficients not set.")
-        self._record_sample()
-        super().set_velocity(self._calc_proportional(self._held_position)
-            + self._calc_integral(self._held_position) + self._calc_derivative())
+        if self._held_position is None:
+            self.set_position(self.get_encoder())
+        velocity = feedforward + self._pid.step(self._held_position, self.get_encoder())
+        super().set_velocity(min(max(velocity, -1), 1))
         return self
-    def _record_sample(self):
-        self._enc_samples[self._cur_sample] = self.get_encoder()
-        timestamp = time.time()
-        self._time_samples[self._cur_sample] = timestamp - (self._last_timestamp or 0)
-        self._last_timestamp = timestamp
-        self._cur_sample += 1
-        if self._cur_sample == self._max_samples:
-            self._cur_sample = 0
-    def _clear_samples(self):
-        self._enc_samples = []
-        self._time_samples = []
-        self._cur_sample = 0
-    def _calc_proportional(self):
-        return self._coeffs[0] * (self.get_encoder() - self._held_position)
-    def _calc_integral(self):
-        return self._coeffs[1] * sum((enc - self._held_position) * time for (enc, time)
-            in zip(self._enc_samples, self._time_samples))
-    def _calc_derviative(self):
-        avg_deriv = sum(
-            ((self._enc_samples[self._cur_sample] - self._enc_samples[self._cur_sample - i])
-            / (self._time_samples[self._cur_sample] - self._time_samples[self._cur_sample - i]))
-            for i in range(self._deriv_samples)) / self._deriv_samples
-        return self._coeffs[2] * avg_deriv
-
-
-class MotorPair(Motor):
-    """Drives a pair of Motors together as if they were one."""
-    def __init__(self, robot, controller_id, motor_suffix, paired_controller_id,
-        paired_motor_suffix, paired_motor_inverted):
-        super().__init__(robot, controller_id, motor_suffix)
-        self._paired_motor = Motor(robot, paired_controller_id,
-            paired_motor_suffix).set_invert(paired_motor_inverted)
+
+
+class MotorGroup:
+    """Drives any number of Motors together as if they were one.
+
+    Members can be on different controllers, and each can be inverted or scaled relative to the
+    group. Velocities are set through each member's own set_velocity, clamped to [-1, 1], so
+    members such as PidMotors react to them as usual; when written through a CommandBuffer, the
+    writes of all members are sent together at the end of the update.
+    """
+    def __init__(self, motors, inverted=None, scales=None):
+        """Creates a MotorGroup, setting the inversion of each member.
+
+        Positional arguments:
+        motors -- the Motors of the group
+        inverted -- a list of whether each member is inverted relative to the group, or None for
+            none inverted
+        scales -- a list of the nonzero factors each member's velocity is multiplied by, or None
+            for all 1
+        """
+        self._motors = motors
+        self._member_inverted = inverted or [False] * len(motors)
+        self._scales = scales or [1] * len(motors)
+        if 0 in self._scales:
+            raise ValueError("MotorGroup member scales must be nonzero.")
         self._inverted = False
+        for motor, member_inverted in zip(motors, self._member_inverted):
+            motor.set_invert(member_inverted)
     def set_invert(self, invert):
-        if invert != self._inverted:
-            self._inverted = invert
-            super().set_invert(not self._get("invert"))
-            self._paired_motor.set_invert(not self._paired_motor.get("invert"))
+        self._inverted = invert
+        for motor, member_inverted in zip(self._motors, self._member_inverted):
+            motor.set_invert(member_inverted != invert)
         return self
-    def set_deadband(deadband):
-        super().set_deadband(self, deadband)
-        self._paired_motor.set_deadband(deadband)
+    def set_deadband(self, deadband):
+        for motor in self._motors:
+            motor.set_deadband(deadband)
         return self
     def set_pid(self, p, i, d):
-        super().set_pid(p, i, d)
-        self._paired_motor.set_pid(p, i, d)
+        for motor in self._motors:
+            motor.set_pid(p, i, d)
         return self
     def set_velocity(self, velocity):
-        super().set_velocity(velocity)
-        self._paired_motor.set_velocity(velocity)
+        for motor, scale in zip(self._motors, self._scales):
+            motor.set_velocity(min(max(velocity * scale, -1), 1))
         return self
+    def get_velocity(self):
+        """Returns the mean velocity of the members, undoing their scales."""
+        return sum(motor.get_velocity() / scale
+            for motor, scale in zip(self._motors, self._scales)) / len(self._motors)
+    def get_encoder(self):
+        """Returns the mean encoder reading of the members."""
+        return sum(motor.get_encoder() for motor in self._motors) / len(self._motors)
+    def get_min_encoder(self):
+        return min(motor.get_encoder() for motor in self._motors)
+    def get_max_encoder(self):
+        return max(motor.get_encoder() for motor in self._motors)
+    def get_angle(self, ticks_per_rot):
+        return self.get_encoder() / ticks_per_rot * 2 * math.pi
+    def reset_encoder(self):
+        for motor in self._motors:
+            motor.reset_encoder()
+
+
+class MotorPair(MotorGroup):
+    """Drives a pair of Motors together as if they were one."""
+    def __init__(self, robot, controller_id, motor_suffix, paired_controller_id,
+        paired_motor_suffix, paired_motor_inverted):
+        super().__init__([Motor(robot, controller_id, motor_suffix),
+            Motor(robot, paired_controller_id, paired_motor_suffix)],
+            [False, paired_motor_inverted])
 
 
 class Servo:
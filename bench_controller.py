@@ -0,0 +1,97 @@
+"""Times RobotController.update on layer stacks of different depths.
+
+Usage: python bench_controller.py [depth ...]
+
+Three steady states are timed for each depth:
+  busy -- the bottom layer is working on a long task, so the layers above it are waiting
+  finished -- every layer has run out of tasks, as after the end of an autonomous strategy
+  relay -- the top layer emits a new task every update, which the layers below finish in one update
+The relay state has to hand a task down through every layer each update, so it's expected to grow
+with depth; the other two should take the same time per update at any depth.
+"""
+import sys
+import time
+from layer import Layer
+from controller import RobotController
+
+DEFAULT_DEPTHS = [3, 10, 25, 50]
+TICKS = 20000
+REPEATS = 5
+
+
+class BusyLayer(Layer):
+    """Bottom layer that never finishes its task."""
+
+    def __init__(self, init_info):
+        pass
+
+    def is_task_done(self):
+        return False
+
+    def update(self):
+        return None
+
+    def accept_task(self, task):
+        pass
+
+
+class RelayLayer(Layer):
+    """Layer that finishes each task it accepts in a single update."""
+
+    def __init__(self, init_info):
+        self._task_done = True
+
+    def is_task_done(self):
+        return self._task_done
+
+    def update(self):
+        self._task_done = True
+        return None
+
+    def accept_task(self, task):
+        self._task_done = False
+
+
+class SourceLayer(Layer):
+    """Top layer that always has another task."""
+
+    def __init__(self, init_info):
+        pass
+
+    def is_task_done(self):
+        return False
+
+    def update(self):
+        return None
+
+    def accept_task(self, task):
+        pass
+
+
+"""Layer classes of each state's stack, bottommost first, given the depth of the stack."""
+STACKS = {
+    "busy": lambda depth: [BusyLayer] + [RelayLayer] * (depth - 2) + [SourceLayer],
+    "finished": lambda depth: [RelayLayer] * depth,
+    "relay": lambda depth: [RelayLayer] * (depth - 1) + [SourceLayer],
+}
+
+
+def time_ticks(layer_classes):
+    """Returns the fastest time per update, in seconds, of a controller running layer_classes."""
+    robot_controller = RobotController(None)
+    robot_controller.setup(layer_classes)
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for _ in range(TICKS):
+            robot_controller.update()
+        best = min(best, (time.perf_counter() - start) / TICKS)
+    return best
+
+
+if __name__ == "__main__":
+    depths = [int(arg) for arg in sys.argv[1:]] or DEFAULT_DEPTHS
+    print(f"{'layers':>8} " + " ".join(f"{state:>14}" for state in STACKS))
+    for depth in depths:
+        print(f"{depth:>8} " + " ".join(f"{time_ticks(stack(depth)) * 1e9:>11.0f} ns"
+            for stack in STACKS.values()))
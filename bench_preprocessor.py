@@ -0,0 +1,259 @@
+"""Times the preprocessor on synthetic module trees of different shapes and sizes.
+
+Usage: python bench_preprocessor.py [module_count ...] [--shapes=shape,...] [--output=resultfile]
+    [--compare=baselinefile] [--tolerance=ratio]
+
+For each shape and module count a tree is generated in a temporary directory, and the fastest of
+several runs is recorded for each stage of a build:
+  preprocess -- process_file without a build cache
+  preprocess_cached -- process_file with a build cache filled by an earlier run
+  depfile -- what preprocessor.py --dependency-file does: build the import graph and write rules
+  compile -- compiling the text of the build
+  import -- running the compiled build, which runs every module's body
+
+The shapes are:
+  random -- each module imports the next one plus a few random later modules
+  wide -- the entry file imports every module, which import nothing
+  deep -- each module imports the next, in one long chain
+  diamond -- modules in rows, each importing two modules of the next row
+  package -- packages whose __init__.py imports their submodules, which import submodules of the
+    next package
+
+Results are printed as a table and, with --output, written as JSON. With --compare, results are
+checked against those in an earlier JSON file, and the script exits with status 1 if any stage got
+slower by more than the tolerance ratio (default 1.25).
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import platform
+import tempfile
+import preprocessor
+
+DEFAULT_SIZES = [10, 100, 500, 2000]
+SHAPES = ["random", "wide", "deep", "diamond", "package"]
+STAGES = ["preprocess", "preprocess_cached", "depfile", "compile", "import"]
+OPTIONS = ["shapes", "output", "compare", "tolerance"]
+IMPORTS_PER_MODULE = 3
+MODULES_PER_PACKAGE = 10
+REPEATS = 3
+DEFAULT_TOLERANCE = 1.25
+"""Differences smaller than this many seconds are never reported as regressions."""
+MIN_REGRESSION = 5e-4
+
+
+def plan_random(module_count, rng):
+    """Returns the names of a random tree's modules, what each imports and the modules main imports.
+
+    Every plan_* function returns this; imports are given as a dict mapping module names to lists of
+    imported module names.
+    """
+    names = [f"mod{i}" for i in range(module_count)]
+    imports = {}
+    for i, name in enumerate(names):
+        later = range(i + 2, module_count)
+        imported = ([i + 1] if i + 1 < module_count else []) + rng.sample(later,
+            min(IMPORTS_PER_MODULE - 1, len(later)))
+        imports[name] = [names[j] for j in imported]
+    return names, imports, names[:1]
+
+
+def plan_wide(module_count, rng):
+    names = [f"mod{i}" for i in range(module_count)]
+    return names, {name: [] for name in names}, names
+
+
+def plan_deep(module_count, rng):
+    names = [f"mod{i}" for i in range(module_count)]
+    return names, {name: names[i + 1:i + 2] for i, name in enumerate(names)}, names[:1]
+
+
+def plan_diamond(module_count, rng):
+    width = max(1, math.isqrt(module_count))
+    names = [f"mod{i}" for i in range(module_count)]
+    imports = {}
+    for i, name in enumerate(names):
+        next_row = i - i % width + width
+        imports[name] = [names[j] for j in {next_row + i % width, next_row + (i + 1) % width}
+            if j < module_count]
+    return names, imports, names[:width]
+
+
+def plan_package(module_count, rng):
+    package_count = max(1, module_count // (MODULES_PER_PACKAGE + 1))
+    packages = [f"pkg{j}" for j in range(package_count)]
+    names = list(packages)
+    imports = {package: [] for package in packages}
+    for i in range(module_count - package_count):
+        j = i % package_count
+        name = f"{packages[j]}.mod{i}"
+        names.append(name)
+        imports[packages[j]].append(name)
+    for name in names[package_count:]:
+        # Import a submodule of the next package, if it has one:
+        j = int(name.split(".")[0][len("pkg"):]) + 1
+        imports[name] = imports[packages[j]][:1] if j < package_count else []
+    return names, imports, packages
+
+
+def write_module(directory, name, index, imported, indices, is_package):
+    """Writes a synthetic module that imports a value from each imported module."""
+    lines = ["import math"]
+    lines.extend(f"from {imported_name} import value{indices[imported_name]}"
+        for imported_name in imported)
+    lines.append(f"value{index} = {index}")
+    lines.append("")
+    lines.append(f"class Thing{index}:")
+    lines.append(f'    """Synthetic class {index}."""')
+    lines.append("    def __init__(self, x):")
+    lines.append("        self._x = x")
+    lines.append("    def get(self):")
+    lines.append(f"        return math.sqrt(self._x) + "
+        f"{' + '.join(f'value{indices[imported_name]}' for imported_name in imported) or 0}")
+    path = os.path.join(directory, *name.split("."))
+    if is_package:
+        os.makedirs(path, exist_ok=True)
+        path = os.path.join(path, "__init__.py")
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        path += ".py"
+    with open(path, "w") as file:
+        file.write("\n".join(lines) + "\n")
+
+
+def generate_tree(directory, module_count, seed=0, shape="random"):
+    """Writes a synthetic module tree of the given shape and an entry file named main.py."""
+    names, imports, roots = globals()[f"plan_{shape}"](module_count, random.Random(seed))
+    indices = {name: i for i, name in enumerate(names)}
+    packages = {name.rsplit(".", 1)[0] for name in names if "." in name}
+    for name in names:
+        write_module(directory, name, indices[name], imports[name], indices, name in packages)
+    with open(os.path.join(directory, "main.py"), "w") as file:
+        file.writelines(f"from {name} import Thing{indices[name]}\n" for name in roots)
+        file.write(f"\n@_PREP_ENTRY_POINT\ndef autonomous_main():\n"
+            f"    return {' + '.join(f'Thing{indices[name]}(4).get()' for name in roots)}\n")
+
+
+def time_best(func):
+    """Returns the fastest of several runs of func, in seconds, and its last return value."""
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run_build(code, module_count):
+    """Runs a compiled build in a fresh namespace."""
+    # Chains of imports run module bodies inside each other, one stack frame per module:
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 2 * module_count + 1000))
+    try:
+        exec(code, {"__name__": "bench_build"})
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+def time_build(directory, module_count):
+    """Returns a dict mapping each stage of a build of directory's main.py to its best time."""
+    prev_cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        times = {}
+        times["preprocess"], (build_text, _, _) = time_best(
+            lambda: preprocessor.process_file("main.py", auto_detect_entry_points=False))
+        cache = preprocessor.BuildCache(".preprocessor-cache.json")
+        preprocessor.process_file("main.py", auto_detect_entry_points=False, cache=cache)
+        times["preprocess_cached"], _ = time_best(
+            lambda: preprocessor.process_file("main.py", auto_detect_entry_points=False,
+                cache=cache))
+        times["depfile"], _ = time_best(lambda: preprocessor.write_dependency_file(
+            "Makefile.depends", "mainbuild.py", preprocessor.build_import_graph("main.py",
+                auto_detect_entry_points=False), "preprocessor.py"))
+        times["compile"], code = time_best(lambda: compile(build_text, "mainbuild.py", "exec"))
+        times["import"], _ = time_best(lambda: run_build(code, module_count))
+        return times
+    finally:
+        os.chdir(prev_cwd)
+
+
+def compare_results(results, baseline, tolerance):
+    """Prints the stages slower than in baseline by more than tolerance and returns their count."""
+    baseline_times = {(result["shape"], result["modules"], stage): seconds
+        for result in baseline["results"] for stage, seconds in result["times"].items()}
+    regressions = 0
+    for result in results:
+        for stage, seconds in result["times"].items():
+            old_seconds = baseline_times.get((result["shape"], result["modules"], stage))
+            if (old_seconds and seconds > old_seconds * tolerance
+                    and seconds - old_seconds > MIN_REGRESSION):
+                regressions += 1
+                print(f"Regression: {result['shape']} tree of {result['modules']} modules, "
+                    f"{stage} took {seconds * 1e3:.2f} ms (was {old_seconds * 1e3:.2f} ms, "
+                    f"{seconds / old_seconds:.2f}x)")
+    return regressions
+
+
+def get_option(name, default=None):
+    """Returns the value of the last --name=value argument, or default if there is none."""
+    prefix = f"--{name}="
+    return next((arg[len(prefix):] for arg in reversed(sys.argv) if arg.startswith(prefix)),
+        default)
+
+
+def usage_error(message):
+    """Prints message and a pointer to --help, then exits with status 1."""
+    print(f"{message} Run {sys.argv[0]} --help for usage.", file=sys.stderr)
+    exit(1)
+
+
+if __name__ == "__main__":
+    if "--help" in sys.argv:
+        bd = "\u001b[1m" if sys.stdout.isatty() else ""
+        es = "\u001b[0m" if sys.stdout.isatty() else ""
+        print(f"{bd}{sys.argv[0]}{es}: {__doc__}", file=sys.stderr)
+        exit(0)
+    for arg in sys.argv[1:]:
+        if arg.startswith("--"):
+            if not arg.startswith(tuple(f"--{name}=" for name in OPTIONS)):
+                usage_error(f"Unknown option {arg}.")
+        elif not arg.isdigit() or not int(arg):
+            usage_error(f"Module count {arg} is not a positive integer.")
+    sizes = [int(arg) for arg in sys.argv[1:] if not arg.startswith("--")] or DEFAULT_SIZES
+    shapes = get_option("shapes", ",".join(SHAPES)).split(",")
+    for shape in shapes:
+        if shape not in SHAPES:
+            usage_error(f"Unknown shape {shape}.")
+    try:
+        tolerance = float(get_option("tolerance", DEFAULT_TOLERANCE))
+    except ValueError:
+        usage_error(f"Tolerance {get_option('tolerance')} is not a number.")
+    print(f"{'shape':>8} {'modules':>8} " + " ".join(f"{stage:>17}" for stage in STAGES)
+        + f" {'us/module':>10}")
+    results = []
+    for shape in shapes:
+        for size in sizes:
+            with tempfile.TemporaryDirectory() as directory:
+                generate_tree(directory, size, shape=shape)
+                times = time_build(directory, size)
+            results.append({"shape": shape, "modules": size, "times": times})
+            print(f"{shape:>8} {size:>8} "
+                + " ".join(f"{times[stage] * 1e3:>14.2f} ms" for stage in STAGES)
+                + f" {times['preprocess'] / size * 1e6:>10.1f}")
+    output_fn = get_option("output")
+    if output_fn:
+        with open(output_fn, "w") as file:
+            json.dump({"python": platform.python_version(),
+                "preprocessor_version": preprocessor.PREPROCESSOR_VERSION,
+                "results": results}, file, indent=2)
+    baseline_fn = get_option("compare")
+    if baseline_fn:
+        with open(baseline_fn) as file:
+            baseline = json.load(file)
+        if compare_results(results, baseline, tolerance):
+            exit(1)
+        print(f"No regressions against {baseline_fn}.")
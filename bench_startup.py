@@ -0,0 +1,56 @@
+"""Compares the startup time of builds of main.py made with different preprocessor options.
+
+Usage: python bench_startup.py [runs]
+
+Each build is loaded by simulate_auto.py --startup-time in a fresh interpreter, which reports the
+time taken to import the build and run autonomous_setup, up to the first autonomous_main tick. The
+interpreter is run with -B so cached bytecode for the builds is neither written nor read.
+"""
+import os
+import sys
+import tempfile
+import statistics
+import subprocess
+import preprocessor
+
+DEFAULT_RUNS = 20
+ENTRY_FILE = "main.py"
+"""Options passed to process_file for each build compared, the first being the baseline."""
+BUILD_OPTIONS = {
+    "source": {},
+    "bytecode": {"bytecode": True},
+    "lazy": {"lazy_imports": True},
+    "lazy+bc": {"lazy_imports": True, "bytecode": True},
+}
+
+
+def write_build(directory, module_name, **options):
+    """Preprocesses the entry file into directory, returning the size of the build in bytes."""
+    output, _, _ = preprocessor.process_file(ENTRY_FILE, auto_detect_entry_points=False,
+        tree_shake=True, **options)
+    with open(os.path.join(directory, module_name + ".py"), "w") as file:
+        print(output, file=file)
+    return len(output.encode("utf-8"))
+
+
+def time_startup(directory, module_name):
+    """Returns the startup time reported by simulate_auto.py for a build, in seconds."""
+    env = dict(os.environ, PYTHONPATH=directory)
+    result = subprocess.run([sys.executable, "-B", "simulate_auto.py", module_name,
+        "--startup-time"], env=env, capture_output=True, text=True, check=True)
+    return float(result.stdout.split()[-1])
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RUNS
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'build':>9} {'bytes':>8} {'median ms':>10} {'best ms':>8} {'speedup':>8}")
+        baseline = None
+        for i, (kind, options) in enumerate(BUILD_OPTIONS.items()):
+            module_name = f"startup_{i}"
+            size = write_build(directory, module_name, **options)
+            times = [time_startup(directory, module_name) for _ in range(runs)]
+            median = statistics.median(times)
+            baseline = baseline or median
+            print(f"{kind:>9} {size:>8} {median * 1e3:>10.2f} {min(times) * 1e3:>8.2f} "
+                f"{baseline / median:>7.2f}x")
@@ -0,0 +1,23 @@
+class SimulatedClock:
+    """A clock whose time only moves when told to, for running simulations faster than real time.
+
+    Called like time.monotonic, it returns the simulated time in seconds. sleep advances the time
+    instead of waiting, so a TickScheduler given the clock and its sleep runs ticks back to back,
+    each a fixed step of simulated time after the last. Since the time never depends on how long
+    anything really takes, simulations using the clock give the same results on every run.
+    """
+
+    def __init__(self, start=0.0):
+        """Creates a SimulatedClock.
+
+        Positional arguments:
+        start -- the initial time in seconds
+        """
+        self._time = start
+
+    def __call__(self):
+        return self._time
+
+    def sleep(self, seconds):
+        """Advances the time by a number of seconds, immediately."""
+        self._time += seconds
@@ -1,55 +1,233 @@
+import time
 from layer import LayerSetupInfo
+from layer import NO_TASK
+from layer.coroutine import EventLoop
+from sensors import SensorSubscriptions
+from sensors import SensorFrame
+from actuators import CommandBuffer
+
+"""Name of the layer stack created when RobotController.setup is given a single list of layers."""
+DEFAULT_STACK_NAME = "main"
+
+"""Names of the layer methods RobotController.enable_profiling times."""
+PROFILED_LAYER_METHODS = ("is_task_done", "update", "accept_task")
+
+class LayerStack:
+    """A named stack of layers, each breaking down the tasks of the layer above it."""
+
+    def __init__(self, name, layers):
+        """Creates a LayerStack.
+
+        Positional arguments:
+        name -- the name of the stack, used to tell it apart from others in the same controller
+        layers -- the layers of the stack, bottommost layer first
+        """
+        self.name = name
+        self.layers = layers
+        self._layer_indices = {id(layer): i for i, layer in enumerate(layers)}
+        self._active_index = 0 # index of the lowest layer that may be incomplete
+
+    def __contains__(self, layer):
+        return id(layer) in self._layer_indices
+
+    def update(self):
+        """Performs incremental work on the stack and returns whether its layers are all done.
+
+        Performs incremental work on the bottommost incomplete layer, invoking upper layers as
+        necessary when lower layers complete their current tasks.
+        """
+        # Do work on the lowest incomplete layer. Layers below the active index are done and stay
+        # done until they're given a task or report a change, so they needn't be checked again:
+        layers = self.layers
+        i = self._active_index
+        while i < len(layers) and layers[i].is_task_done():
+            i += 1
+        self._active_index = i
+        if i == len(layers):
+            # No tasks left in any layer
+            return True
+        task = layers[i].update()
+        if task is NO_TASK:
+            # The layers below are still done:
+            return False
+        # Start at layer below first incomplete one and continue backwards to lowest layer
+        for j in range(i - 1, -1, -1):
+            layers[j].accept_task(task)
+            task = layers[j].update()
+            if task is NO_TASK:
+                break
+        # The layers below were given tasks, so the lowest incomplete layer is found again:
+        self._active_index = 0
+        return False
+
+    def notify_task_state_changed(self, layer):
+        """Makes the next update() check whether a layer of the stack is done again."""
+        self._active_index = min(self._active_index, self._layer_indices[id(layer)])
+
 
 class RobotController:
-    """Manages robot state between setup and the main loops."""
+    """Manages robot state between setup and the main loops.
+
+    The controller runs one or more independent stacks of layers, such as one for the drivetrain
+    and one for the arm, updating every stack on each update so that they all make progress at the
+    same time.
+    """
 
-    def __init__(self, robot):
+    def __init__(self, robot, clock=time.monotonic):
         """Creates a RobotController.
 
         Positional arguments:
         robot -- the Robot or Robot-like object used to communicate with hardware
+        clock -- the function returning the time in seconds that layers and coroutines use
         """
-        self._layer_setup_info = LayerSetupInfo(robot, self)
+        self._clock = clock
+        # Layers and subscriptions read the robot through the frame, so repeated reads in an
+        # update are served from it, and layers write through the command buffer, so writes in an
+        # update are sent together at its end:
+        self._sensor_frame = SensorFrame(robot)
+        self._command_buffer = CommandBuffer(self._sensor_frame)
+        self._layer_setup_info = LayerSetupInfo(self._command_buffer, self)
         self._update_listeners = []
+        self._stacks = []
+        self._priorities = None
+        self._first_stack_index = 0 # index of the stack updated first when taking turns
+        self._event_loop = EventLoop(clock)
+        self._sensor_subscriptions = SensorSubscriptions(self._sensor_frame)
+        self._services = {}
+        self._profiler = None
 
-    def setup(self, layer_classes):
+    def setup(self, layer_classes, priorities=None):
         """Initializes the controller with instances of the given layer classes.
 
+        All stacks share the controller's LayerSetupInfo. The update listeners, sensor
+        subscriptions, coroutines and services of the layers of any previous setup are dropped.
+
         Positional arguments:
-        layer_classes -- the list of layer classes, bottommost layer first
+        layer_classes -- the list of layer classes, bottommost layer first, or a dict mapping the
+            names of independent layer stacks to such lists
+        priorities -- a dict mapping stack names to numbers. Stacks are updated in order of
+            decreasing priority, those missing from the dict having priority 0. If None, the
+            stacks take turns being updated first.
         """
-        self._layers = [Class(self._layer_setup_info) for Class in layer_classes]
+        if not isinstance(layer_classes, dict):
+            layer_classes = {DEFAULT_STACK_NAME: layer_classes}
+        # Services, update listeners, sensor subscriptions and coroutines belong to the layers that
+        # added them, so drop those of the previous layers:
+        self._services = {}
+        self._update_listeners = []
+        self._sensor_subscriptions = SensorSubscriptions(self._sensor_frame)
+        self._event_loop = EventLoop(self._clock)
+        # The robot may have reset its devices between modes, so don't drop writes of values sent
+        # before:
+        self._command_buffer.invalidate()
+        self._stacks = [LayerStack(name, [Class(self._layer_setup_info) for Class in classes])
+            for name, classes in layer_classes.items()]
+        self._priorities = priorities
+        if priorities is not None:
+            # sort is stable, so stacks of equal priority keep the order they were given in:
+            self._stacks.sort(key=lambda stack: -priorities.get(stack.name, 0))
+        self._first_stack_index = 0
+        if self._profiler:
+            self._profile_layers()
+
+    def get_stack(self, name):
+        """Returns the LayerStack with the given name."""
+        return next(stack for stack in self._stacks if stack.name == name)
 
     def update(self):
         """Performs incremental work and returns whether layers have completed all tasks.
 
-        Performs incremental work on the bottommost layer, invoking upper layers as necessary when
-        lower layers complete their current tasks. Returns whether the topmost layer (and by
-        extension, every layer) are exhausted of tasks. When this happens, update listeners are
-        notified and then unregistered.
+        Performs incremental work on the bottommost incomplete layer of each stack, invoking upper
+        layers as necessary when lower layers complete their current tasks. Returns whether the
+        topmost layer of every stack (and by extension, every layer) is exhausted of tasks. When
+        this happens, update listeners are notified and then unregistered. Properties the layers
+        set are written to the robot at the end of the update.
         """
+        self._sensor_frame.begin()
+        self._command_buffer.begin()
+        try:
+            return self._update_stacks()
+        finally:
+            self._command_buffer.flush()
+            self._sensor_frame.end()
+
+    def _update_stacks(self):
+        # Read subscribed sensors first, so everything below sees this update's values:
+        self._sensor_subscriptions.poll()
+
         # Call all update listeners
         for listener in self._update_listeners:
             listener(False)
 
-        # Do work on layers
-        i = 0 # Fallback in case of 0 layers which shouldn't happen anyways
-        task = self # Use self as sentinel
-        for i, layer in enumerate(self._layers):
-            if not layer.is_task_done():
-                task = layer.update()
-                break
-        if task is self:
+        # Resume coroutines that are ready before updating the layers that may be waiting on them:
+        self._event_loop.step()
+
+        is_done = True
+        stacks = self._stacks
+        if self._priorities is None and len(stacks) > 1:
+            stacks = stacks[self._first_stack_index:] + stacks[:self._first_stack_index]
+            self._first_stack_index = (self._first_stack_index + 1) % len(stacks)
+        for stack in stacks:
+            if not stack.update():
+                is_done = False
+        if is_done:
             # No tasks left in any layer
             for listener in self._update_listeners:
                 listener(True)
             self._update_listeners = []
-            return True
-        # Start at layer below first incomplete one and continue backwards to lowest layer
-        for j in range(i - 1, -1, -1):
-            self._layers[j].accept_task(task)
-            task = self._layers[j].update()
-        return False
+        return is_done
+
+    def get_sensor_frame(self):
+        """Returns the SensorFrame that properties read during update() are served from."""
+        return self._sensor_frame
+
+    def get_command_buffer(self):
+        """Returns the CommandBuffer that properties set during update() are written through."""
+        return self._command_buffer
+
+    def get_sensor_subscriptions(self):
+        """Returns the SensorSubscriptions polled at the start of every update()."""
+        return self._sensor_subscriptions
+
+    def get_clock(self):
+        """Returns the function returning the time in seconds that layers should use."""
+        return self._clock
+
+    def get_event_loop(self):
+        """Returns the EventLoop stepped at the start of every update(), which runs coroutines."""
+        return self._event_loop
+
+    def add_service(self, name, service):
+        """Makes an object available to every layer set up after this is called.
+
+        Layers are set up bottommost first, so layers can use the services of the layers below
+        them, such as a drive layer's Odometry.
+
+        Positional arguments:
+        name -- the name other layers get the service by
+        service -- the object to share
+        """
+        self._services[name] = service
+
+    def get_service(self, name):
+        """Returns the object added by add_service under a name, raising KeyError if none was."""
+        return self._services[name]
+
+    def notify_task_state_changed(self, layer):
+        """Makes the next update() check whether a layer is done again.
+
+        Layers that become done or incomplete other than by being updated or accepting a task, such
+        as in response to an update listener, must call this (through
+        LayerSetupInfo.notify_task_state_changed), since update() skips checking layers it last
+        found done.
+
+        Positional arguments:
+        layer -- the layer whose is_task_done() result may have changed
+        """
+        # Layers notifying during setup aren't in a stack yet, and will be checked anyway:
+        for stack in self._stacks:
+            if layer in stack:
+                stack.notify_task_state_changed(layer)
 
     def add_update_listener(self, listener):
         """Registers a function to be called on every update().
@@ -62,4 +240,44 @@ class RobotController:
         Positional arguments:
         listener -- the function to be registered as an update listener
         """
+        if self._profiler:
+            listener = self._profile_listener(listener)
         self._update_listeners.append(listener)
+
+    def enable_profiling(self, profiler):
+        """Times the work done on every update from now on.
+
+        The is_task_done, update and accept_task methods of each layer, the update listeners and
+        update itself are replaced with wrappers recording the time each call takes. Layers created
+        by later calls to setup are timed too. Nothing is timed before this is called, so profiling
+        costs nothing unless enabled.
+
+        Positional arguments:
+        profiler -- the LayerProfiler to record timings in
+        """
+        if self._profiler:
+            # Stop timing with the previous profiler:
+            del self.update
+            self._update_listeners = [listener.__wrapped__ for listener in self._update_listeners]
+            for stack in self._stacks:
+                for stack_layer in stack.layers:
+                    for method_name in PROFILED_LAYER_METHODS:
+                        setattr(stack_layer, method_name,
+                            getattr(stack_layer, method_name).__wrapped__)
+        self._profiler = profiler
+        self.update = profiler.wrap("RobotController.update", self.update)
+        self._update_listeners = [self._profile_listener(listener)
+            for listener in self._update_listeners]
+        self._profile_layers()
+
+    def _profile_layers(self):
+        for stack in self._stacks:
+            for i, stack_layer in enumerate(stack.layers):
+                for method_name in PROFILED_LAYER_METHODS:
+                    setattr(stack_layer, method_name, self._profiler.wrap(
+                        f"{stack.name}/{i}:{type(stack_layer).__name__}.{method_name}",
+                        getattr(stack_layer, method_name)))
+
+    def _profile_listener(self, listener):
+        name = getattr(listener, "__qualname__", type(listener).__name__)
+        return self._profiler.wrap(f"listener:{name}", listener)
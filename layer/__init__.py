@@ -1,6 +1,12 @@
 from abc import ABCMeta, abstractmethod
 from task import UnsupportedTaskError
 
+"""Value a layer's update function can return to give the layers below it no task this update.
+
+The layers below are left as they are, so if they're done they stay done.
+"""
+NO_TASK = object()
+
 
 class Layer(metaclass=ABCMeta):
     """The base class of all layers.
@@ -69,7 +75,7 @@ class QueuedLayer(Layer):
     _consumed_subtask = object()
 
     def __init__(self, init_info):
-        self._next_subtask = _no_subtask
+        self._next_subtask = self._no_subtask
         self._subtask_iter = iter([])
 
     def is_task_done(self):
@@ -92,7 +98,7 @@ class QueuedLayer(Layer):
         queue -- the iterable of subtasks to gradually emit after every update
         """
         self._subtask_iter = iter(queue)
-        self._next_subtask = _consumed_subtask
+        self._next_subtask = self._consumed_subtask
 
 
 class LayerSetupInfo:
@@ -112,6 +118,45 @@ class LayerSetupInfo:
         """Returns the Robot or Robot-like object used to communicate with hardware."""
         return self._robot
 
-    def add_update_listener(listener):
-        """Registers a function to be called on every update of the owning RobotController."""
+    def add_update_listener(self, listener):
+        """Registers a function to be called on every update of the owning RobotController.
+
+        To react to changes in sensor readings, subscribe to them with get_sensor_subscriptions
+        instead, which avoids reading them on every update.
+        """
         self._robot_controller.add_update_listener(listener)
+
+    def get_sensor_subscriptions(self):
+        """Returns the SensorSubscriptions the owning RobotController polls on every update."""
+        return self._robot_controller.get_sensor_subscriptions()
+
+    def get_clock(self):
+        """Returns the function returning the time in seconds, such as time.monotonic.
+
+        Layers should measure time with this rather than the time module, so simulations can run
+        them on a SimulatedClock.
+        """
+        return self._robot_controller.get_clock()
+
+    def get_event_loop(self):
+        """Returns the EventLoop the owning RobotController steps on every update."""
+        return self._robot_controller.get_event_loop()
+
+    def add_service(self, name, service):
+        """Makes an object available to the layers set up after this one by name."""
+        self._robot_controller.add_service(name, service)
+
+    def get_service(self, name):
+        """Returns an object a layer set up before this one made available by name.
+
+        Raises KeyError if no layer did.
+        """
+        return self._robot_controller.get_service(name)
+
+    def notify_task_state_changed(self, layer):
+        """Tells the owning RobotController that a layer's is_task_done() result may have changed.
+
+        Layers must call this when they become done or incomplete other than in update() or
+        accept_task(), since the controller doesn't check layers it last found done every update.
+        """
+        self._robot_controller.notify_task_state_changed(layer)
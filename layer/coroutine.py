@@ -0,0 +1,207 @@
+import time
+import heapq
+import itertools
+from abc import abstractmethod
+from layer import Layer
+from layer import NO_TASK
+
+
+class _Sleep:
+    __slots__ = ("seconds",)
+    def __init__(self, seconds):
+        self.seconds = seconds
+    def __await__(self):
+        yield self
+
+
+class _WaitUntil:
+    __slots__ = ("predicate",)
+    def __init__(self, predicate):
+        self.predicate = predicate
+    def __await__(self):
+        yield self
+
+
+class _NextTick:
+    __slots__ = ()
+    def __await__(self):
+        yield self
+
+
+class _Suspend:
+    __slots__ = ()
+    def __await__(self):
+        yield self
+
+
+def sleep(seconds):
+    """Returns an awaitable that resumes the awaiting coroutine after a number of seconds."""
+    return _Sleep(seconds)
+
+
+def wait_until(predicate):
+    """Returns an awaitable that resumes the awaiting coroutine once predicate() returns True.
+
+    The predicate is checked when awaited and then once per step of the event loop.
+    """
+    return _WaitUntil(predicate)
+
+
+def next_tick():
+    """Returns an awaitable that resumes the awaiting coroutine on the event loop's next step."""
+    return _NextTick()
+
+
+class CoroutineTask:
+    """A coroutine run by an EventLoop."""
+    __slots__ = ("coroutine", "is_done", "result")
+    def __init__(self, coroutine):
+        self.coroutine = coroutine
+        self.is_done = False
+        self.result = None
+
+
+class EventLoop:
+    """Runs coroutines that await the awaitables returned by sleep, wait_until and next_tick.
+
+    Unlike an asyncio event loop, this loop never blocks: it's stepped once per tick, for instance
+    by RobotController.update, and each step resumes the coroutines that are ready. Sleeping
+    coroutines are kept in a heap ordered by wake time, so they cost nothing until they wake up.
+    Coroutines waiting on a predicate have it called once per step.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        """Creates an EventLoop with no coroutines.
+
+        Positional arguments:
+        clock -- the function returning the time in seconds that sleeps are measured with
+        """
+        self._clock = clock
+        self._ready = [] # tasks to resume on the next step
+        self._sleepers = [] # heap of (wake time, sequence number, task)
+        self._waiters = [] # (predicate, task) pairs
+        self._sequence = itertools.count() # breaks ties between sleepers waking at the same time
+
+    def create_task(self, coroutine):
+        """Returns a CoroutineTask running coroutine, which doesn't start until resumed."""
+        return CoroutineTask(coroutine)
+
+    def spawn(self, coroutine):
+        """Returns a CoroutineTask running coroutine, which starts on the next step."""
+        task = self.create_task(coroutine)
+        self._ready.append(task)
+        return task
+
+    def step(self):
+        """Resumes every coroutine that has woken up, finished waiting or awaited next_tick."""
+        ready = self._ready
+        self._ready = []
+        if self._sleepers:
+            now = self._clock()
+            while self._sleepers and self._sleepers[0][0] <= now:
+                ready.append(heapq.heappop(self._sleepers)[2])
+        if self._waiters:
+            waiters = self._waiters
+            self._waiters = []
+            for predicate, task in waiters:
+                if task.is_done:
+                    continue
+                if predicate():
+                    ready.append(task)
+                else:
+                    self._waiters.append((predicate, task))
+        for task in ready:
+            if not task.is_done:
+                self.resume(task)
+
+    def resume(self, task, value=None):
+        """Runs a task's coroutine now, until it awaits something that isn't ready or finishes.
+
+        Exceptions raised by the coroutine finish the task and propagate to the caller.
+        """
+        while True:
+            try:
+                awaited = task.coroutine.send(value)
+            except StopIteration as e:
+                task.is_done = True
+                task.result = e.value
+                return
+            except BaseException:
+                task.is_done = True
+                raise
+            value = None
+            if type(awaited) is _Sleep:
+                heapq.heappush(self._sleepers, (self._clock() + awaited.seconds,
+                    next(self._sequence), task))
+            elif type(awaited) is _WaitUntil:
+                if awaited.predicate():
+                    continue
+                self._waiters.append((awaited.predicate, task))
+            elif type(awaited) is _NextTick:
+                self._ready.append(task)
+            elif type(awaited) is not _Suspend:
+                self.cancel(task)
+                raise TypeError(f"Coroutines run by an EventLoop can't await "
+                    f"'{type(awaited).__name__}' objects.")
+            return
+
+    def cancel(self, task):
+        """Stops a task's coroutine, raising GeneratorExit in it, and marks the task done."""
+        task.coroutine.close()
+        task.is_done = True
+
+
+class CoroutineLayer(Layer):
+    """The base class of layers written as a coroutine run for each accepted task.
+
+    Subclasses implement run, an async function that breaks a task down by awaiting
+    submit_subtask for each subtask, and can await sleep, wait_until and next_tick in between.
+    While the coroutine waits, update returns NO_TASK so the layers below are left alone, and the
+    coroutine is only resumed when what it's waiting for happens. Coroutines are run by the event
+    loop of the layer's RobotController.
+    """
+
+    def __init__(self, init_info):
+        self._event_loop = init_info.get_event_loop()
+        self._run_task = None
+        self._subtask = NO_TASK
+        self._is_submitting = False # whether run is waiting for a subtask to be done
+
+    @abstractmethod
+    async def run(self, task):
+        """Breaks down an accepted task, awaiting submit_subtask for each subtask.
+
+        The layer is done once this returns.
+        """
+        raise NotImplemented
+
+    async def submit_subtask(self, subtask):
+        """Emits a subtask from the next call to update and waits until the layer below is done."""
+        self._subtask = subtask
+        self._is_submitting = True
+        await _Suspend()
+
+    def is_task_done(self):
+        return self._run_task is None or self._run_task.is_done
+
+    def update(self):
+        if self._subtask is NO_TASK and self._is_submitting:
+            # The last subtask is done, since the controller only updates this layer once the
+            # layers below are done:
+            self._is_submitting = False
+            self._event_loop.resume(self._run_task)
+        subtask = self._subtask
+        self._subtask = NO_TASK
+        return subtask
+
+    def accept_task(self, task):
+        self._start(task)
+
+    def _start(self, task):
+        """Starts running a task, which top layers (never given tasks) can call from __init__."""
+        if self._run_task and not self._run_task.is_done:
+            self._event_loop.cancel(self._run_task)
+        self._subtask = NO_TASK
+        # Start the coroutine on the next call to update, as if a subtask had just been done:
+        self._run_task = self._event_loop.create_task(self.run(task))
+        self._is_submitting = True
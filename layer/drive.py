@@ -0,0 +1,115 @@
+import math
+from layer import Layer
+from actuators import Motor
+from mechanisms import Wheel
+from odometry import Odometry
+from motion_profile import TrapezoidalProfile
+from units import convert
+from task import UnsupportedTaskError
+from task import AxialMovementTask
+from task import TurnTask
+
+"""Device id of the KoalaBear driving the wheels, and the motors of each wheel on it."""
+DRIVE_CONTROLLER_ID = "drive_koalabear"
+LEFT_MOTOR = "a"
+RIGHT_MOTOR = "b"
+
+"""Radius of each wheel, and distance between the two wheels, in meters."""
+WHEEL_RADIUS = convert(2, "in", "m")
+TRACK_WIDTH = convert(14, "in", "m")
+
+"""Encoder ticks per rotation of a wheel, and per second with its motor at full velocity."""
+TICKS_PER_ROTATION = 1440
+MAX_TICKS_PER_SECOND = 2000
+
+"""Speed in meters per second of a wheel with its motor at full velocity."""
+MAX_WHEEL_VELOCITY = MAX_TICKS_PER_SECOND / TICKS_PER_ROTATION * 2 * math.pi * WHEEL_RADIUS
+
+"""Limits of the motion profiles each wheel follows, in meters per second (squared).
+
+The velocity limit is kept below MAX_WHEEL_VELOCITY, so the motors have headroom left to correct
+for lagging behind the profile.
+"""
+MAX_VELOCITY = 0.9 * MAX_WHEEL_VELOCITY
+MAX_ACCELERATION = 1.0
+
+"""Speed in meters per second added to a wheel's velocity per meter it lags behind its profile."""
+POSITION_GAIN = 10
+
+"""Distance in meters a movement may end from its target, and the time in seconds a movement may
+keep correcting after its profile ends before being given up as done."""
+POSITION_TOLERANCE = 0.005
+SETTLE_TIME = 0.5
+
+
+class TwoWheelDrive(Layer):
+    """Bottom layer driving a robot with one wheel on each side.
+
+    Accepts AxialMovementTask and TurnTask. Each movement follows a trapezoidal motion profile, the
+    fastest under MAX_VELOCITY and MAX_ACCELERATION, with the wheels' encoders used to correct for
+    lagging behind or running ahead of it. The robot's forward movement and turning are each
+    profiled and corrected, so the robot also keeps its heading while moving and its position while
+    turning.
+
+    The layer also tracks the robot's pose with an Odometry updated at the start of every update of
+    the controller, which layers above can get with init_info.get_service("odometry").
+    """
+
+    def __init__(self, init_info):
+        robot = init_info.get_robot()
+        self._left_wheel = Wheel(Motor(robot, DRIVE_CONTROLLER_ID, LEFT_MOTOR), WHEEL_RADIUS,
+            TICKS_PER_ROTATION)
+        self._right_wheel = Wheel(Motor(robot, DRIVE_CONTROLLER_ID, RIGHT_MOTOR).set_invert(True),
+            WHEEL_RADIUS, TICKS_PER_ROTATION)
+        self._odometry = Odometry(self._left_wheel, self._right_wheel, TRACK_WIDTH)
+        init_info.add_service("odometry", self._odometry)
+        init_info.add_update_listener(lambda is_done: self._odometry.update())
+        self._clock = init_info.get_clock()
+        self._is_done = True
+        self._axial_profile = None # profile of the distance the robot moves forward
+        self._arc_profile = None # profile of the distance each wheel moves turning counterclockwise
+        self._start_time = None
+        self._start_left_distance = None
+        self._start_right_distance = None
+
+    def is_task_done(self):
+        return self._is_done
+
+    def update(self):
+        t = self._clock() - self._start_time
+        left_distance = self._left_wheel.get_distance() - self._start_left_distance
+        right_distance = self._right_wheel.get_distance() - self._start_right_distance
+        axial_error = self._axial_profile.get_position(t) - (left_distance + right_distance) / 2
+        arc_error = self._arc_profile.get_position(t) - (right_distance - left_distance) / 2
+        duration = max(self._axial_profile.duration, self._arc_profile.duration)
+        if t >= duration and (t >= duration + SETTLE_TIME
+                or max(abs(axial_error), abs(arc_error)) < POSITION_TOLERANCE):
+            self._left_wheel.set_velocity(0)
+            self._right_wheel.set_velocity(0)
+            self._is_done = True
+            return None
+        axial_velocity = self._axial_profile.get_velocity(t) + POSITION_GAIN * axial_error
+        arc_velocity = self._arc_profile.get_velocity(t) + POSITION_GAIN * arc_error
+        self._left_wheel.set_velocity(self._get_motor_velocity(axial_velocity - arc_velocity))
+        self._right_wheel.set_velocity(self._get_motor_velocity(axial_velocity + arc_velocity))
+        return None
+
+    def accept_task(self, task):
+        if isinstance(task, AxialMovementTask):
+            axial_distance = task.distance
+            arc_distance = 0
+        elif isinstance(task, TurnTask):
+            axial_distance = 0
+            arc_distance = task.angle * TRACK_WIDTH / 2
+        else:
+            raise UnsupportedTaskError(self, task)
+        self._axial_profile = TrapezoidalProfile(axial_distance, MAX_VELOCITY, MAX_ACCELERATION)
+        self._arc_profile = TrapezoidalProfile(arc_distance, MAX_VELOCITY, MAX_ACCELERATION)
+        self._start_time = self._clock()
+        self._start_left_distance = self._left_wheel.get_distance()
+        self._start_right_distance = self._right_wheel.get_distance()
+        self._is_done = False
+
+    def _get_motor_velocity(self, wheel_velocity):
+        """Converts a wheel velocity in meters per second to a motor velocity in [-1, 1]."""
+        return min(max(wheel_velocity / MAX_WHEEL_VELOCITY, -1), 1)
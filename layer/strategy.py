@@ -3,6 +3,7 @@ from layer import QueuedLayer
 from units import convert
 from task import UnsupportedTaskError
 from task import AxialMovementTask
+from task import TurnTask
 
 class CubeDropStrategy(QueuedLayer):
     """Ambitious autonomous strategy for maximum points.
@@ -13,8 +14,8 @@ class CubeDropStrategy(QueuedLayer):
     """
 
     def __init__(self, init_info):
-        super().__init__(self, init_info)
-        self._submit_subtask_queue([
+        super().__init__(init_info)
+        self._submit_subtask_queue(([
             # Forward to left pressure plate:
             AxialMovementTask(convert(34, "in", "m")),
         ] if init_info.get_robot().start_pos == "left" else [
@@ -24,7 +25,7 @@ class CubeDropStrategy(QueuedLayer):
             TurnTask(convert(0.25, "rev", "rad")),
             AxialMovementTask(convert(18 + 6, "in", "m")),
             TurnTask(convert(-0.25, "rev", "rad")),
-        ] + [
+        ]) + [
             # Forward up ramp, pushing cube over:
             AxialMovementTask(convert(12 + 30, "in", "m")),
             # Reverse down ramp and end on left plate:
@@ -44,8 +45,8 @@ class CubePlateStrategy(QueuedLayer):
     """
 
     def __init__(self, init_info):
-        super().__init__(self, init_info)
-        self._submit_subtask_queue([
+        super().__init__(init_info)
+        self._submit_subtask_queue(([
             # Forward to left pressure plate:
             AxialMovementTask(convert(34, "in", "m")),
         ] if init_info.get_robot().start_pos == "left" else [
@@ -55,7 +56,7 @@ class CubePlateStrategy(QueuedLayer):
             TurnTask(convert(0.25, "rev", "rad")),
             AxialMovementTask(convert(18 + 6, "in", "m")),
             TurnTask(convert(-0.25, "rev", "rad")),
-        ] + [
+        ]) + [
             # Forward up ramp:
             AxialMovementTask(convert(12 + 13, "in", "m")),
             # Grab cube,
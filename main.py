@@ -1,44 +1,78 @@
-#from layer.drive import TwoWheelDrive
+from layer.drive import TwoWheelDrive
+from layer.strategy import CubePlateStrategy
 #from layer import SimpleDriveTest
 #from layer.controls import TankDriveControls
 #from layer.controls import GamepadInputGenerator
+import time
 from controller import RobotController
+from scheduler import TickScheduler
+from profiler import LayerProfiler
 from mock_robot import MockRobot
+from clock import SimulatedClock
+
+"""Rate in ticks per second at which layers are updated."""
+TICK_RATE = 200
+
+"""File to write per-layer timings to when the layers run out of tasks, or None not to time them.
+
+Timings are written as CSV if the file name ends in .csv and as JSON otherwise.
+"""
+PROFILE_FILE = None
 
 try:
     robot = Robot
     is_dawn = True
+    clock = time.monotonic
+    sleep = time.sleep
 except NameError:
+    # Off the robot, run on simulated time, so each tick advances the time by exactly one period
+    # without waiting and runs are reproducible:
+    clock = SimulatedClock()
+    sleep = clock.sleep
     robot = MockRobot({
-        "koalabear": 0,
+        "koalabear": 1,
         "servocontroller": 0,
-    })
+    }, clock=clock)
     is_dawn = False
 auto_layer_classes = [
-#    TwoWheelDrive,
-#    SimpleDriveTest,
-    RestaurantPrinter,
-    RestaurantSectionLayer,
-    RestaurantMenuSource,
+    TwoWheelDrive,
+    CubePlateStrategy,
 ]
 teleop_layer_classes = [
 #    TwoWheelDrive,
 #    TankDriveControls,
 #    GamepadInputGenerator,
 ]
-robot_controller = RobotController(robot)
+robot_controller = RobotController(robot, clock)
+tick_scheduler = TickScheduler(TICK_RATE, clock, sleep)
+
+def setup_layers(layer_classes):
+    robot_controller.setup(layer_classes)
+    tick_scheduler.reset()
+    if PROFILE_FILE:
+        layer_profiler = LayerProfiler()
+        robot_controller.enable_profiling(layer_profiler)
+        # Listeners are called with True once, when the layers run out of tasks:
+        robot_controller.add_update_listener(
+            lambda is_done: is_done and layer_profiler.save(PROFILE_FILE))
 
 @_PREP_ENTRY_POINT
 def autonomous_setup():
-    robot_controller.setup(auto_layer_classes)
+    setup_layers(auto_layer_classes)
 @_PREP_ENTRY_POINT
 def autonomous_main():
-    if robot_controller.update() and not is_dawn:
+    if tick_scheduler.run_tick(robot_controller.update) and not is_dawn:
+        print(f"Autonomous: {tick_scheduler.stats}")
+        print(f"Autonomous sensor reads: {robot_controller.get_sensor_frame()}")
+        print(f"Autonomous actuator writes: {robot_controller.get_command_buffer()}")
         exit(0)
 @_PREP_ENTRY_POINT
 def teleop_setup():
-    robot_controller.setup(teleop_layer_classes)
+    setup_layers(teleop_layer_classes)
 @_PREP_ENTRY_POINT
 def teleop_main():
-    if robot_controller.update() and not is_dawn:
+    if tick_scheduler.run_tick(robot_controller.update) and not is_dawn:
+        print(f"Teleop: {tick_scheduler.stats}")
+        print(f"Teleop sensor reads: {robot_controller.get_sensor_frame()}")
+        print(f"Teleop actuator writes: {robot_controller.get_command_buffer()}")
         exit(0)
@@ -1,10 +1,32 @@
 import math
 import time
 import logging
+from ringbuffer import TimeSeriesBuffer
+from motion_profile import TrapezoidalProfile
 
 logger = logging.getLogger(__name__)
 
 
+class LookupTable:
+    """Interpolates a function between values sampled at evenly spaced points.
+
+    Lookups take constant time however many points are sampled, and clamp to the sampled range.
+    """
+    def __init__(self, func, start, stop, size):
+        """Samples func at size evenly spaced points from start to stop."""
+        self._start = start
+        self._step = (stop - start) / (size - 1)
+        self._values = [func(start + i * self._step) for i in range(size)]
+    def get(self, x):
+        position = (x - self._start) / self._step if self._step else 0
+        if position <= 0:
+            return self._values[0]
+        if position >= len(self._values) - 1:
+            return self._values[-1]
+        i = int(position)
+        return self._values[i] + (self._values[i + 1] - self._values[i]) * (position - i)
+
+
 class Wheel:
     """Encapsulates a Motor attached to a wheel that can calculate distance travelled given the
     motor's ticks per rotation and the wheel's radius."""
@@ -25,6 +47,7 @@ class Arm:
     """Encapsulates a Motor attached to an arm that can calculate the height of the arm's end
     relative to the motor and detect out-of-bounds movement given the motor's ticks per rotation,
     the arm's length, and the maximum angle."""
+    _TABLE_SIZE = 65 # heights sampled for the encoder lookup table
     def __init__(self, motor, length, ticks_per_rotation, max_height):
         self._motor = motor
         self._length = length
@@ -32,6 +55,9 @@ class Arm:
         self._max_height = max_height
         self._zero_height = 0 # bootstrap for get_height
         self._zero_height = self.get_height()
+        # Heights between 0 and max_height, mapped to encoder positions ahead of time so targets
+        # needn't be converted with inverse trig:
+        self._encoder_table = LookupTable(self._calc_encoder, 0, max_height, self._TABLE_SIZE)
     def get_height(self):
         """Interpreting the motor as being attached to an arm, converts the encoder readout of the
         motor to the vertical position of the arm's tip relative to the motor."""
@@ -39,13 +65,23 @@ class Arm:
             - self._zero_height)
     def set_velocity(self, velocity):
         """Sets the velocity of the underlying motor."""
-        if not velocity and self._motor.get_velocity():
-            self._motor.set_position(self._motor.get_encoder())
-            pass
-        elif not velocity:
-            #self._motor.hold_position()
-            pass
         self._motor.set_velocity(velocity)
+    def hold_position(self):
+        """Holds the arm where it was when it last stopped being moved by velocity.
+
+        The underlying motor must be a PidMotor with PID coefficients set.
+        """
+        self._motor.hold_position()
+    def get_motor(self):
+        return self._motor
+    def get_encoder_for_height(self, height):
+        """Returns the encoder position at which the arm's tip is at a height, clamped to the range
+        [0, max_height]."""
+        return self._encoder_table.get(height)
+    def get_encoder_for_normalized_position(self, position):
+        """Returns the encoder position corresponding to a number in the range [0, 1] as returned by
+        get_normalized_position."""
+        return self.get_encoder_for_height(position * (self._max_height - self._zero_height))
     def get_normalized_position(self):
         """Returns a number in the range [0, 1] where 0 is linearly mapped to an encoder position of
         0 and 1 is linearly mapped to the encoder position corrosponding to the arm's maximum
@@ -62,21 +98,81 @@ class Arm:
             return velocity > 0
         else:
             return True
+    def _calc_encoder(self, height):
+        ratio = min(max((height + self._zero_height) / self._length, -1), 1)
+        return math.asin(ratio) / 2 / math.pi * self._ticks_per_rot
+
+
+class ArmController:
+    """Moves an Arm to target heights and holds it there.
+
+    Targets are converted to encoder positions through the Arm's lookup table when set, so each
+    tick works in encoder ticks alone. The arm follows a trapezoidal motion profile to the target,
+    its PidMotor tracking the profile's position with the profile's velocity fed forward, and then
+    holds the target with the same PID.
+    """
+    _SETTLED_TICKS = 10 # encoder ticks from the target within which the arm is settled
+    def __init__(self, arm, max_ticks_per_second, max_velocity, max_acceleration,
+            clock=time.monotonic):
+        """Creates an ArmController holding the arm where it is.
+
+        Positional arguments:
+        arm -- the Arm to move, whose motor is a PidMotor with PID coefficients set
+        max_ticks_per_second -- the speed in encoder ticks per second of the motor at full velocity
+        max_velocity, max_acceleration -- the limits of the motion profile, in encoder ticks per
+            second (squared)
+        clock -- the function returning the time in seconds
+        """
+        self._arm = arm
+        self._motor = arm.get_motor()
+        self._max_ticks_per_second = max_ticks_per_second
+        self._max_velocity = max_velocity
+        self._max_acceleration = max_acceleration
+        self._clock = clock
+        self._target = self._motor.get_encoder()
+        self._start = self._target
+        self._profile = TrapezoidalProfile(0, max_velocity, max_acceleration)
+        self._start_time = clock()
+    def set_target_height(self, height):
+        """Starts moving the arm's tip to a height, clamped to the range [0, max_height]."""
+        self._set_target(self._arm.get_encoder_for_height(height))
+    def set_target_position(self, position):
+        """Starts moving the arm to a normalized position in the range [0, 1]."""
+        self._set_target(self._arm.get_encoder_for_normalized_position(position))
+    def is_settled(self):
+        """Returns whether the arm has finished its profile and is at the target."""
+        return (self._clock() - self._start_time >= self._profile.duration
+            and abs(self._motor.get_encoder() - self._target) < self._SETTLED_TICKS)
+    def tick(self):
+        """Moves the arm along its profile, or holds it at the target. Call this every tick."""
+        t = self._clock() - self._start_time
+        self._motor.set_position(self._start + self._profile.get_position(t))
+        self._motor.hold_position(self._profile.get_velocity(t) / self._max_ticks_per_second)
+    def _set_target(self, target):
+        # Start from where the arm is meant to be rather than where it is, so retargeting while
+        # moving doesn't make the profile jump back:
+        t = self._clock() - self._start_time
+        self._start = self._start + self._profile.get_position(t)
+        self._target = target
+        self._profile = TrapezoidalProfile(target - self._start, self._max_velocity,
+            self._max_acceleration)
+        self._start_time = self._clock()
 
 
 class Hand:
     """A Motor connected to a hand that can toggle its open/closed state given the maximum width
     and hand length, optionally stopping when encountering resistance."""
-    _MAX_HISTORY_LENGTH = 40000
+    _HISTORY_RATE = 1000 # Hz. widths are recorded at most this often, so history never wraps.
     _STRUGGLE_THRESHOLD = 0.02 # meters. hand must move this far in struggle_duration seconds.
     def __init__(self, motor, ticks_per_rotation, max_width, hand_offset, hand_length,
-            struggle_duration, start_open):
+            struggle_duration, start_open, clock=time.monotonic):
         # disable struggle checking if struggle_duration == 0
         self._motor = motor
         self._ticks_per_rot = ticks_per_rotation
         self._hand_offset = hand_offset
         self._hand_length = hand_length
         self._struggle_duration = struggle_duration
+        self._clock = clock
         self._init_enc = self._motor.get_encoder()
         max_enc = ((math.asin(max_width / 2 / hand_length) + math.asin(hand_offset / hand_length))
             / 2 / math.pi * ticks_per_rotation)
@@ -87,14 +183,15 @@ class Hand:
             self._open_enc = self._init_enc + max_enc
             self._close_enc = self._init_enc
         self._state = start_open
-        self._width_history = [0, None] * self._MAX_HISTORY_LENGTH
-        self._hist_pos = 0
+        self._width_history = TimeSeriesBuffer(
+            math.ceil(struggle_duration * self._HISTORY_RATE) + 2)
         self._finished = True
         #print(f"Inititlized hand. open_enc = {self._open_enc} close_enc = {self._close_enc} "
         #    + f"init_enc = {self._init_enc}")
     def toggle_state(self):
         """Swaps the hand's state between open and closed and starts moving accordingly."""
         self._state = not self._state
+        self._width_history.clear() # widths from the last movement don't tell if this one stalls
         #print("about to toggle state")
         self._finished = False
         #print(f"Toggled hand state to {self._state} hand velocity {self._motor.get_velocity()}")
@@ -109,9 +206,10 @@ class Hand:
             #    f"{self._open_width} close width {self._close_width}")
             # don't check if struggle duration is 0
             if self._struggle_duration:
-                lookbehind = self._get_hist_lookbehind()
+                lookbehind = self._width_history.get_value_at(self._clock()
+                    - self._struggle_duration)
                 logger.info(f"lookbehind: {lookbehind}")
-                struggling = (bool(lookbehind) and abs(lookbehind - self._get_width())
+                struggling = (lookbehind is not None and abs(lookbehind - self._get_width())
                     < self._STRUGGLE_THRESHOLD)
             else:
                 struggling = False
@@ -136,28 +234,9 @@ class Hand:
         # -1 furthest from goal, 0 at midpoint, 1 closest to goal:
         nearness = 2 * (enc - mid) / mid * (-1 if self._state else 1)
         return (1 - max(nearness, 0)) * 0.125 + 0.375
-    def _get_hist_time(self, i):
-        return self._width_history[i * 2]
-    def _get_hist_width(self, i):
-        return self._width_history[i * 2 + 1]
-    def _set_hist_time(self, i, x):
-        self._width_history[i * 2] = x
-    def _set_hist_width(self, i, x):
-        self._width_history[i * 2 + 1] = x
     def _record_history(self):
-        self._set_hist_time(self._hist_pos, time.time())
-        self._set_hist_width(self._hist_pos, self._get_width())
-        self._hist_pos = (self._hist_pos + 1) % self._MAX_HISTORY_LENGTH
-    def _get_hist_lookbehind(self):
-        min_idx = self._hist_pos
-        max_idx = self._hist_pos + self._MAX_HISTORY_LENGTH - 1
-        goal_time = time.time() - self._struggle_duration
-        while True:
-            mid_idx = math.floor((min_idx + max_idx) / 2)
-            hist_idx = mid_idx % self._MAX_HISTORY_LENGTH
-            if self._get_hist_time(hist_idx) < goal_time:
-                min_idx = mid_idx + 1
-            elif self._get_hist_time(hist_idx) > goal_time:
-                max_idx = mid_idx - 1
-            if min_idx == max_idx:
-                return self._get_hist_width(hist_idx)
+        now = self._clock()
+        if (self._width_history
+                and now - self._width_history.get_time(-1) < 1 / self._HISTORY_RATE):
+            return
+        self._width_history.append(now, self._get_width())
@@ -38,7 +38,8 @@ class MockRobot:
         }
     }
 
-    def __init__(self, max_devices, motor_ticks_per_sec=2000, start_pos="left"):
+    def __init__(self, max_devices, motor_ticks_per_sec=2000, start_pos="left",
+            clock=time.monotonic):
         logger.warn("NOTICE: MockRobot instance constructed.")
         self._devices = {}
         self._device_types = {}
@@ -46,6 +47,7 @@ class MockRobot:
         self._device_counts = {}
         self._motor_ticks_per_sec = motor_ticks_per_sec
         self.start_pos = start_pos
+        self._clock = clock # moves encoders, so a SimulatedClock makes runs reproducible
         for device_type in self._default_device_properties:
             self._device_counts[device_type] = 0
 
@@ -83,7 +85,7 @@ class MockRobot:
             device = {}
             device.update(self._default_device_properties[device_type])
             if device_type == "koalabear":
-                device["_LAST_UPDATED"] = time.time()
+                device["_LAST_UPDATED"] = self._clock()
             self._devices[device_id] = device
             self._device_types[device_id] = device_type
         if not value_name in self._devices[device_id]:
@@ -91,7 +93,7 @@ class MockRobot:
 
     def _update_koalabear(self, device_id):
         device = self._devices[device_id]
-        timestamp = time.time()
+        timestamp = self._clock()
         dt = timestamp - device["_LAST_UPDATED"]
         device["_LAST_UPDATED"] = timestamp
         if abs(device["velocity_a"]) > 1:
@@ -0,0 +1,60 @@
+import math
+
+
+class TrapezoidalProfile:
+    """The fastest way to move a distance under velocity and acceleration limits.
+
+    The profile accelerates at the limit, cruises at the velocity limit and decelerates at the limit
+    to stop exactly at the distance. Distances too short to reach the velocity limit get a
+    triangular profile that starts decelerating as soon as it stops accelerating. Positions and
+    velocities have the sign of the distance.
+    """
+
+    def __init__(self, distance, max_velocity, max_acceleration):
+        """Creates a TrapezoidalProfile starting at rest at position 0.
+
+        Positional arguments:
+        distance -- the position to stop at
+        max_velocity -- the largest speed to move at
+        max_acceleration -- the largest rate to speed up or slow down at
+        """
+        self.distance = distance
+        self._direction = 1 if distance >= 0 else -1
+        self._max_acceleration = max_acceleration
+        distance = abs(distance)
+        if max_velocity ** 2 / max_acceleration > distance:
+            # Too short to reach max_velocity before having to slow down:
+            max_velocity = math.sqrt(distance * max_acceleration)
+        self._peak_velocity = max_velocity
+        self._acceleration_time = max_velocity / max_acceleration
+        acceleration_distance = max_velocity * self._acceleration_time / 2
+        cruise_time = ((distance - 2 * acceleration_distance) / max_velocity
+            if max_velocity else 0)
+        self._deceleration_start = self._acceleration_time + cruise_time
+        self.duration = self._deceleration_start + self._acceleration_time
+
+    def get_velocity(self, t):
+        """Returns the velocity t seconds after the start of the profile."""
+        if t <= 0 or t >= self.duration:
+            return 0.0
+        if t < self._acceleration_time:
+            speed = self._max_acceleration * t
+        elif t < self._deceleration_start:
+            speed = self._peak_velocity
+        else:
+            speed = self._max_acceleration * (self.duration - t)
+        return speed * self._direction
+
+    def get_position(self, t):
+        """Returns the position t seconds after the start of the profile."""
+        if t <= 0:
+            return 0.0
+        if t >= self.duration:
+            return self.distance
+        if t < self._acceleration_time:
+            position = self._max_acceleration * t ** 2 / 2
+        elif t < self._deceleration_start:
+            position = self._peak_velocity * (t - self._acceleration_time / 2)
+        else:
+            position = abs(self.distance) - self._max_acceleration * (self.duration - t) ** 2 / 2
+        return position * self._direction
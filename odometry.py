@@ -0,0 +1,57 @@
+import math
+
+
+class Odometry:
+    """Estimates a two-wheeled robot's pose from the distances its wheels have travelled.
+
+    Each update integrates the distance each wheel moved since the last one, so updates take
+    constant time and no history is kept. The pose is (x, y, heading) in meters and radians, x
+    pointing in the direction the robot faced at the start and headings increasing
+    counterclockwise. Resetting a wheel's encoder makes it look like the wheel jumped, so call
+    reset afterwards.
+    """
+
+    def __init__(self, left_wheel, right_wheel, track_width):
+        """Creates an Odometry starting at the origin, facing along x.
+
+        Positional arguments:
+        left_wheel, right_wheel -- the Wheels on each side of the robot
+        track_width -- the distance in meters between the wheels
+        """
+        self._left_wheel = left_wheel
+        self._right_wheel = right_wheel
+        self._track_width = track_width
+        self.reset()
+
+    def reset(self, x=0.0, y=0.0, heading=0.0):
+        """Sets the pose, measuring wheel movement from where the wheels are now."""
+        self.x = x
+        self.y = y
+        self.heading = heading
+        self._left_distance = self._left_wheel.get_distance()
+        self._right_distance = self._right_wheel.get_distance()
+
+    def update(self):
+        """Moves the pose by how far the wheels have travelled since the last update."""
+        left_distance = self._left_wheel.get_distance()
+        right_distance = self._right_wheel.get_distance()
+        left_delta = left_distance - self._left_distance
+        right_delta = right_distance - self._right_distance
+        self._left_distance = left_distance
+        self._right_distance = right_distance
+        distance = (left_delta + right_delta) / 2
+        heading_delta = (right_delta - left_delta) / self._track_width
+        # Assuming the robot moved along an arc of constant curvature, it moved along the chord of
+        # the arc, which points along the mean heading and is shorter than the arc by a factor of
+        # sin(h / 2) / (h / 2) for a heading change h:
+        half_heading_delta = heading_delta / 2
+        if abs(half_heading_delta) > 1e-9:
+            distance *= math.sin(half_heading_delta) / half_heading_delta
+        mean_heading = self.heading + half_heading_delta
+        self.x += distance * math.cos(mean_heading)
+        self.y += distance * math.sin(mean_heading)
+        self.heading += heading_delta
+
+    def get_pose(self):
+        """Returns the estimated (x, y, heading) of the robot."""
+        return (self.x, self.y, self.heading)
@@ -0,0 +1,66 @@
+import time
+from ringbuffer import TimeSeriesBuffer
+
+"""Number of past measurements the derivative is taken over, filtering out noise."""
+DEFAULT_DERIVATIVE_SAMPLES = 20
+
+
+class PidController:
+    """Computes a PID control output from successive measurements of a process.
+
+    Each step takes constant time and allocates nothing: the integral is kept as a running sum,
+    clamped so that its contribution to the output never exceeds integral_limit (so it can't wind
+    up while the output is saturated), and the derivative is the slope between the newest
+    measurement and the oldest one kept in a TimeSeriesBuffer. The derivative is taken of the
+    measurement rather than the error, so changing the setpoint doesn't cause a spike in the
+    output.
+    """
+
+    def __init__(self, kp, ki, kd, output_limit=1.0, integral_limit=None,
+            derivative_samples=DEFAULT_DERIVATIVE_SAMPLES, clock=time.monotonic):
+        """Creates a PidController with no measurements.
+
+        Positional arguments:
+        kp, ki, kd -- the proportional, integral and derivative coefficients
+        output_limit -- the largest magnitude of the output, or None for no limit
+        integral_limit -- the largest magnitude of the integral term, or None to use output_limit
+        derivative_samples -- the number of past measurements the derivative is taken over
+        clock -- the function returning the time in seconds that steps are measured with
+        """
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self._output_limit = output_limit
+        self._integral_limit = output_limit if integral_limit is None else integral_limit
+        self._clock = clock
+        # The newest measurement is appended after the derivative is taken, so the oldest kept is
+        # derivative_samples steps before it:
+        self._measurements = TimeSeriesBuffer(derivative_samples)
+        self.reset()
+
+    def reset(self):
+        """Forgets the integral and past measurements, as when the setpoint jumps."""
+        self._integral = 0.0
+        self._last_time = None
+        self._measurements.clear()
+
+    def step(self, setpoint, measurement):
+        """Records a measurement and returns the output that moves it towards setpoint."""
+        now = self._clock()
+        error = setpoint - measurement
+        output = self.kp * error
+        if self._last_time is not None and now > self._last_time:
+            if self.ki:
+                self._integral += error * (now - self._last_time)
+                if self._integral_limit is not None:
+                    bound = abs(self._integral_limit / self.ki)
+                    self._integral = min(max(self._integral, -bound), bound)
+                output += self.ki * self._integral
+            if self.kd:
+                output -= (self.kd * (measurement - self._measurements.get_value(0))
+                    / (now - self._measurements.get_time(0)))
+        self._last_time = now
+        self._measurements.append(now, measurement)
+        if self._output_limit is not None:
+            output = min(max(output, -self._output_limit), self._output_limit)
+        return output
@@ -1,14 +1,253 @@
 import sys
 import os
+import io
+import ast
+import zlib
+import base64
+import bisect
+import itertools
+import json
+import math
+import operator
+import re
+import tokenize
+import hashlib
 import textwrap
+import time
+import marshal
+import importlib.util
+
+"""Version of the preprocessor's output format.
+
+Bump this when a change alters the text generated for a module so that stale entries in existing
+build caches are discarded.
+"""
+PREPROCESSOR_VERSION = 3
+
+"""File the build cache is kept in unless overridden with --cache-file."""
+DEFAULT_CACHE_FILE = ".preprocessor-cache.json"
+
+"""File name compiled into the code objects of bytecode builds, shown in untranslated tracebacks."""
+BYTECODE_FILE_NAME = "<bundle>"
+
+"""Seconds between checks for changed files in watch mode."""
+DEFAULT_POLL_INTERVAL = 0.2
+
+"""Functions --fold-constants calls at build time when their arguments are constants.
+
+Maps the dotted names of transcluded modules to the names of functions in them. Calls to these
+functions are replaced with their results, so they must always return the same result for the same
+arguments and have no side effects.
+"""
+FOLDABLE_FUNCTIONS = {"units": {"convert"}}
 
 class ModuleInfo:
-    __slots__ = "name", "func_call", "file_path", "body_text"
+    __slots__ = ("name", "func_call", "file_path", "body_text", "inserted_line_nums", "imports",
+        "importers")
     def __init__(self, name, func_call, file_path, body):
         self.name = name
         self.func_call = func_call
         self.file_path = file_path
         self.body_text = body
+        self.inserted_line_nums = [] # lines of the body inserted by the preprocessor
+        self.imports = [] # names of transcluded modules imported by this one
+        self.importers = set() # names of modules importing this one; None is the entry file
+
+class ImportGraph:
+    """The modules transcluded into a build and the imports between them.
+
+    Modules are indexed by escaped module name. Each module records the modules it imports and the
+    modules importing it, so lookups, cycle checks and finding a module's dependents don't require
+    scanning every module in the build. Iterating over the graph yields its modules in the order
+    they were discovered, which is also the order their bodies appear in the build.
+    """
+
+    def __init__(self, entry_file_path):
+        """Creates an ImportGraph containing only the entry file.
+
+        Positional arguments:
+        entry_file_path -- the path of the script the build starts from
+        """
+        self.entry = ModuleInfo(None, None, entry_file_path, None)
+        self._modules = {}
+        self._order = []
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def __len__(self):
+        return len(self._modules)
+
+    def __contains__(self, name):
+        return name in self._modules
+
+    def get_nth(self, i):
+        """Returns the i-th module discovered."""
+        return self._order[i]
+
+    def get(self, name):
+        """Returns the module with the given escaped name, or None if it isn't in the graph."""
+        return self._modules.get(name)
+
+    def get_module(self, name):
+        """Returns the module with the given escaped name, or the entry file if name is None."""
+        return self.entry if name is None else self._modules[name]
+
+    def add_module(self, name, file_path):
+        """Adds a module whose body hasn't been preprocessed yet and returns it."""
+        module = ModuleInfo(name, f"_HELPER_import_{name}()", file_path, None)
+        self._modules[name] = module
+        self._order.append(module)
+        return module
+
+    def add_import(self, importer_name, imported_name):
+        """Records that the module importer_name (None for the entry file) imports imported_name."""
+        importer = self.get_module(importer_name)
+        if imported_name not in importer.imports:
+            importer.imports.append(imported_name)
+        self._modules[imported_name].importers.add(importer_name)
+
+    def get_dependents(self, name):
+        """Returns the names of all modules that directly or indirectly import the named module.
+
+        The entry file is included as None if it depends on the module.
+        """
+        dependents = set()
+        stack = [name]
+        while stack:
+            for importer_name in self.get_module(stack.pop()).importers:
+                if importer_name not in dependents:
+                    dependents.add(importer_name)
+                    if importer_name is not None:
+                        stack.append(importer_name)
+        return dependents
+
+    def remove_imports(self, name):
+        """Forgets the imports made by a module so they can be recorded again after it changes."""
+        module = self.get_module(name)
+        for imported_name in module.imports:
+            self._modules[imported_name].importers.discard(name)
+        module.imports = []
+
+    def remove_unreachable(self):
+        """Removes and returns the modules the entry file no longer imports, even indirectly."""
+        reachable = set()
+        stack = list(self.entry.imports)
+        while stack:
+            name = stack.pop()
+            if name not in reachable:
+                reachable.add(name)
+                stack.extend(self._modules[name].imports)
+        removed = [module for module in self._order if module.name not in reachable]
+        if removed:
+            self._order = [module for module in self._order if module.name in reachable]
+            for module in removed:
+                del self._modules[module.name]
+            removed_names = {module.name for module in removed}
+            for module in self._order:
+                module.importers -= removed_names
+        return removed
+
+    def get_file_paths(self):
+        """Returns the file paths of all transcluded modules."""
+        return [module.file_path for module in self._order]
+
+    def check_acyclic(self):
+        """Raises a RuntimeError naming the modules involved if any imports form a cycle."""
+        # Iterative depth-first search; 1 marks modules on the current path, 2 finished ones.
+        state = {}
+        for root in self._modules:
+            if root in state:
+                continue
+            state[root] = 1
+            path = [root]
+            stack = [iter(self._modules[root].imports)]
+            while stack:
+                next_name = next(stack[-1], None)
+                if next_name is None:
+                    state[path.pop()] = 2
+                    stack.pop()
+                elif state.get(next_name) == 1:
+                    cycle = path[path.index(next_name):] + [next_name]
+                    raise RuntimeError("Detected cyclic import of modules "
+                        f"{' -> '.join(unescape_module_name(name) for name in cycle)}.")
+                elif next_name not in state:
+                    state[next_name] = 1
+                    path.append(next_name)
+                    stack.append(iter(self._modules[next_name].imports))
+
+class BuildCache:
+    """Persistent on-disk store of preprocessed module bodies.
+
+    Entries are keyed by module name, the SHA-256 hash of the module's source and the options that
+    affect its preprocessed text. Each entry holds the module's transcluded body and the imports it
+    resolved, so unchanged modules can skip scanning entirely. The whole cache is discarded if it
+    was written by a different version of the preprocessor.
+    """
+
+    def __init__(self, path):
+        """Creates a BuildCache, loading existing entries from path if possible.
+
+        Positional arguments:
+        path -- the file to load the cache from and save it to
+        """
+        self._path = path
+        self._version = self._get_version()
+        self._entries = {}
+        self._used_keys = set()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+            if data.get("version") == self._version:
+                self._entries = data["entries"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    @staticmethod
+    def _get_version():
+        # Changes to this script invalidate the cache even if PREPROCESSOR_VERSION isn't bumped:
+        with open(__file__, "rb") as file:
+            script_hash = hashlib.sha256(file.read()).hexdigest()[:16]
+        return f"{PREPROCESSOR_VERSION}-{script_hash}"
+
+    @staticmethod
+    def make_key(module_name, source_hash, options):
+        """Returns the cache key of a module with the given source hash and processing options."""
+        return f"{module_name}:{source_hash}:{options}"
+
+    def lookup(self, key):
+        """Returns the entry stored under key, or None if there is none."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._used_keys.add(key)
+        return entry
+
+    def store(self, key, entry):
+        """Stores a JSON-serializable entry under key."""
+        self._entries[key] = entry
+        self._used_keys.add(key)
+        self._dirty = True
+
+    def save(self):
+        """Writes the cache back to its file if any entries changed.
+
+        Entries that weren't looked up or stored since the cache was loaded belong to old versions
+        of modules and are dropped.
+        """
+        if not self._dirty and len(self._used_keys) == len(self._entries):
+            return
+        entries = {key: self._entries[key] for key in self._used_keys}
+        temp_path = self._path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump({"version": self._version, "entries": entries}, file)
+        os.replace(temp_path, self._path)
+        self._dirty = False
 
 def file_path_from_basename(file_path, rel_file_path):
     if os.path.isfile(file_path + ".py"):
@@ -26,173 +265,1553 @@ def escape_module_name(name):
 def unescape_module_name(name):
     return '_'.join(segment.replace("_", ".") for segment in name.split("__"))
 
-def trim_common_module_segments(module, compare_against):
-    common_strlen = 0
-    for segments in zip(unescape_module_name(module).split("_"),
-        unescape_module_name(compare_against).split("_")):
-        if segments[0] == segments[1]:
-            common_strlen += 1 + len(segments[0])
+def wrap_module_body(module, body_text, indent):
+    """Returns the text of the function that runs a transcluded module's body."""
+    module_exports = f"_HELPER_module_export_dict['{module.name}']"
+    imported_module_buffer = [
+        f"def {module.func_call}:",
+        f"{indent}if '{module.name}' in _HELPER_module_export_dict:",
+        f"{indent * 2}return",
+        "",
+        f"{indent}# Begin imported file."
+    ]
+    imported_module_buffer.extend([indent + line for line in body_text.splitlines()])
+    imported_module_buffer.append(
+        f"\n{indent}# End imported file.\n"
+        f"{indent}{module_exports} = locals()\n\n\n"
+    )
+    return "\n".join(imported_module_buffer)
+
+def resolve_import(imported_module_name, import_basename, importer_name, graph):
+    """Returns the module an import refers to, adding it to the graph if it wasn't already.
+
+    Returns None if the module can't be found, in which case it's assumed to be built in.
+    """
+    module = graph.get(imported_module_name)
+    if not module:
+        import_file_path = file_path_from_basename(import_basename, importer_name)
+        if not import_file_path:
+            return None
+        module = graph.add_module(imported_module_name, import_file_path)
+    graph.add_import(importer_name, imported_module_name)
+    return module
+
+def replay_cached_imports(imports, module_name, graph):
+    """Adds the imports recorded in a cache entry to the graph.
+
+    Returns False if an import no longer resolves to the same file as when the entry was stored, in
+    which case the importing module must be scanned again.
+    """
+    for edge in imports:
+        module = graph.get(edge["name"])
+        if module:
+            import_file_path = module.file_path
         else:
-            break
-    return module[common_strlen:]
+            import_file_path = file_path_from_basename(edge["basename"], module_name)
+        if import_file_path != edge["path"]:
+            return False
+    for edge in imports:
+        if edge["path"]:
+            resolve_import(edge["name"], edge["basename"], module_name, graph)
+    return True
 
-def process_file(file_path, indent=" " * 4, module_name=None, module_list=None, import_cursor=0,
-        auto_detect_entry_points=True):
-    """Preprocesses a python script by recursively transcluding imported files."""
+"""Fields of AST nodes that hold nested statements."""
+_NESTED_STATEMENT_FIELDS = "body", "orelse", "finalbody", "handlers", "cases"
 
-    if module_list == None:
-        module_list = []
-        is_top_level = True
-        entry_point_line_nums = []
-    else:
-        is_top_level = False
-        if any(module_info.name == module_name for module_info in module_list):
-            raise RuntimeError(f"Detected cyclic import of module {module_name}.")
-    with open(file_path, "r", encoding="utf-8") as file:
-        module_buffer = []
+"""Maximum number of lines a statement found by the lexical scan may span before giving up."""
+_MAX_STATEMENT_LINES = 32
+
+class _AmbiguousSourceError(Exception):
+    """Raised by the lexical scan when it can't be sure of a module's structure."""
+
+def iter_statements(statements):
+    """Yields the given statements and every statement nested in them, in no particular order."""
+    stack = list(statements)
+    while stack:
+        node = stack.pop()
+        yield node
+        for field in _NESTED_STATEMENT_FIELDS:
+            nested = getattr(node, field, None)
+            if nested:
+                stack.extend(nested)
+
+def find_all(source, substring):
+    """Yields the offset of every occurrence of substring in source."""
+    pos = source.find(substring)
+    while pos != -1:
+        yield pos
+        pos = source.find(substring, pos + 1)
+
+def is_identifier_char(char):
+    return char.isalnum() or char == "_"
+
+def get_line_start(source, pos):
+    """Returns the offset of the start of the line containing pos."""
+    return source.rfind("\n", 0, pos) + 1
+
+def get_line_end(source, pos):
+    """Returns the offset of the newline ending the line containing pos, or the source's length."""
+    end = source.find("\n", pos)
+    return len(source) if end == -1 else end
+
+def get_char_offset(line, col_offset):
+    """Converts a column offset reported by ast, which counts UTF-8 bytes, to an index into line."""
+    if line.isascii():
+        return col_offset
+    return len(line.encode("utf-8")[:col_offset].decode("utf-8"))
+
+def get_statement_spans(tree, text, text_start):
+    """Returns (node, start, end) for every statement in a tree parsed from text.
+
+    The offsets are relative to the source text was taken from, text beginning at text_start.
+    """
+    line_starts = [0, *itertools.accumulate(len(line) + 1 for line in text.split("\n"))]
+    def get_offset(lineno, col_offset):
+        line_start = line_starts[lineno - 1]
+        return text_start + line_start + get_char_offset(text[line_start:line_starts[lineno]],
+            col_offset)
+    return [(node, get_offset(node.lineno, node.col_offset),
+        get_offset(node.end_lineno, node.end_col_offset)) for node in iter_statements(tree.body)]
+
+def find_multiline_strings(source):
+    """Returns the sorted (start, end) offsets of the triple-quoted strings in source.
+
+    Raises _AmbiguousSourceError if a triple quote might be inside a comment or another string.
+    """
+    spans = []
+    pos = 0
+    double_start = source.find('"""')
+    single_start = source.find("'''")
+    while True:
+        # Each kind of quote is only searched for again once the last one found has been passed:
+        if -1 < double_start < pos:
+            double_start = source.find('"""', pos)
+        if -1 < single_start < pos:
+            single_start = source.find("'''", pos)
+        if double_start == -1 and single_start == -1:
+            return spans
+        if single_start == -1 or (double_start != -1 and double_start < single_start):
+            start = double_start
+        else:
+            start = single_start
+        quote = source[start:start + 3]
+        before = source[max(get_line_start(source, start), pos):start]
+        if "#" in before or before.count('"') % 2 or before.count("'") % 2:
+            raise _AmbiguousSourceError()
+        end = start + 3
         while True:
-            line = file.readline()
-            if not line:
+            end = source.find(quote, end)
+            if end == -1:
+                raise _AmbiguousSourceError()
+            backslashes = 0
+            while source[end - backslashes - 1] == "\\":
+                backslashes += 1
+            if backslashes % 2 == 0:
+                break
+            end += 1
+        spans.append((start, end + 3))
+        pos = end + 3
+
+def parse_statement_at(source, line_start):
+    """Parses the statement starting on the line at line_start, which may span several lines.
+
+    Returns the statement spans in the format of get_statement_spans, or raises
+    _AmbiguousSourceError if no statement starting on the line can be parsed.
+    """
+    end = get_line_end(source, line_start)
+    text_start = end - len(source[line_start:end].lstrip(" \t"))
+    for _ in range(_MAX_STATEMENT_LINES):
+        text = source[text_start:end]
+        try:
+            tree = ast.parse(text)
+        except SyntaxError:
+            if end == len(source):
                 break
-            words = line.strip().split(" ")
-            if not len(words):
-              module_buffer.append(line)  
-            elif words[0] == "import" or words[0] == "from":
-                path_segments = words[1].split(".")
-                imported_module_name = words[1].replace("_", "__").replace(".", "_")
-                prev_imported_module = next((module for module in module_list
-                    if module.name == imported_module_name
-                    or (module_name and trim_common_module_segments(module.name, module_name) ==
-                    imported_module_name)), None)
-                module_exports = f"_HELPER_module_export_dict['{imported_module_name}']"
-                import_file_path = file_path_from_basename(os.path.join(*path_segments), module_name)
-                if prev_imported_module:
-                    func_call = prev_imported_module.func_call
-                elif not import_file_path:
-                    # module not found. assume it's built in and leave the import statement intact
-                    module_buffer.append(line)
-                    continue
-                else:
-                    imported_body_text = process_file(import_file_path,
-                        indent=indent, module_name=imported_module_name, module_list=module_list,
-                        import_cursor=import_cursor + 1)
-                    func_call = f"_HELPER_import_{imported_module_name}()"
-                    imported_module_buffer = [
-                        f"def {func_call}:",
-                        f"{indent}if '{imported_module_name}' in _HELPER_module_export_dict:",
-                        f"{indent * 2}return",
-                        "",
-                        f"{indent}# Begin imported file."
-                    ]
-                    imported_module_buffer.extend([indent + line for line in imported_body_text.splitlines()])
-                    imported_module_buffer.append(
-                        f"\n{indent}# End imported file.\n"
-                        f"{indent}{module_exports} = locals()\n\n\n"
-                    )
-                if words[0] == "import" and (len(words) < 3 or words[2] != "as"):
-                    import_mode = "import"
-                    after_import_word_idx = 2
-                elif words[0] == "import":
-                    import_mode = "import as"
-                    after_import_word_idx = 4
-                elif words[0] == "from" and (len(words) < 5 or words[4] != "as"):
-                    import_mode = "from import"
-                    after_import_word_idx = 4
-                elif words[0] == "from":
-                    import_mode = "from import as"
-                    after_import_word_idx = 6
-                else:
-                    raise RuntimeError("Typo?")
-                #import_only_line = " ".join(line.strip().split(" ")[:after_import_word_idx])
-                import_line = f"{func_call}; "
-                if import_mode == "import":
-                    import_line += f"{imported_module_name} = _HELPER_Module('{imported_module_name}')"
-                elif import_mode == "import as":
-                    import_line += f"{words[3]} = _HELPER_Module('{imported_module_name}')"
-                elif import_mode == "from import":
-                    if words[3] == "*":
-                        import_line += f"exec(\"for k, v in {module_exports}.items(): exec(k + \\\" = v\\\")\")"
-                    else:
-                        import_line += f"{words[3]} = {module_exports}[\"{words[3]}\"]"
-                elif import_mode == "from import as":
-                    import_line += f"{words[5]} = {module_exports}[\"{words[3]}\"]"
-                else:
-                    raise RuntimeError("Typo?")
-                import_line += " # " + line.strip() + "\n"
-                module_buffer.append(import_line)
-
-                if not prev_imported_module:
-                    module_list.insert(import_cursor, ModuleInfo(imported_module_name, func_call,
-                        import_file_path, "\n".join(imported_module_buffer)))
-            elif not auto_detect_entry_points and words[0] == "@_PREP_ENTRY_POINT":
-                module_buffer.append(line[:line.find("@")] + "@_HELPER_entry_point\n")
-                entry_point_line_nums.append(len(module_buffer))
+            end = get_line_end(source, end + 1)
+            continue
+        return get_statement_spans(tree, text, text_start)
+    raise _AmbiguousSourceError()
+
+def parse_statements_at(source, line_starts):
+    """Parses the statements starting on the lines at the given sorted offsets.
+
+    The statements are parsed together if they each fit on one line, otherwise one at a time.
+    Returns the statement spans in the format of get_statement_spans.
+    """
+    texts = []
+    text_starts = []
+    for line_start in line_starts:
+        end = get_line_end(source, line_start)
+        text = source[line_start:end].lstrip(" \t")
+        texts.append(text)
+        text_starts.append(end - len(text))
+    try:
+        tree = ast.parse("\n".join(texts))
+    except SyntaxError:
+        spans = []
+        for line_start in line_starts:
+            if not spans or line_start > spans[-1][2]:
+                spans.extend(parse_statement_at(source, line_start))
+        return spans
+    return [(node, text_starts[node.lineno - 1]
+        + get_char_offset(texts[node.lineno - 1], node.col_offset), text_starts[node.lineno - 1]
+        + get_char_offset(texts[node.lineno - 1], node.end_col_offset))
+        for node in iter_statements(tree.body)]
+
+def locate_statements_lexically(source, is_top_level):
+    """Finds import statements, entry point markers and top-level functions without parsing.
+
+    The module is searched for the keywords involved, skipping occurrences inside triple-quoted
+    strings, and only the statements containing them are parsed. Returns the same values as
+    locate_statements, or raises _AmbiguousSourceError if the module must be parsed completely.
+    """
+    string_spans = find_multiline_strings(source)
+    string_starts = [span[0] for span in string_spans]
+    def is_in_string(offset):
+        i = bisect.bisect_right(string_starts, offset) - 1
+        return i >= 0 and offset < string_spans[i][1]
+
+    import_line_starts = []
+    for pos in find_all(source, "import"):
+        if ((pos and is_identifier_char(source[pos - 1]))
+                or is_identifier_char(source[pos + 6:pos + 7])):
+            continue
+        line_start = get_line_start(source, pos)
+        if (import_line_starts and import_line_starts[-1] == line_start) or is_in_string(pos):
+            continue
+        before = source[line_start:pos]
+        if not before.lstrip(" \t").startswith("from") and (before.strip(" \t")
+                and ";" not in before and ":" not in before):
+            continue # only a statement can start with import, and statements start lines
+        if "#" in before:
+            continue # probably a comment
+        if source[get_line_start(source, line_start - 1):line_start].rstrip().endswith("\\"):
+            raise _AmbiguousSourceError() # this line continues another
+        import_line_starts.append(line_start)
+    import_spans = [span for span in parse_statements_at(source, import_line_starts)
+        if isinstance(span[0], (ast.Import, ast.ImportFrom))] if import_line_starts else []
+
+    markers = []
+    marker_line_starts = set()
+    for pos in find_all(source, "@_PREP_ENTRY_POINT"):
+        line_start = get_line_start(source, pos)
+        end = pos + len("@_PREP_ENTRY_POINT")
+        if (source[line_start:pos].strip(" \t") or is_identifier_char(source[end:end + 1])
+                or is_in_string(pos)):
+            continue
+        markers.append((pos + 1, end))
+        marker_line_starts.add(line_start)
+    function_starts = []
+    if is_top_level:
+        for pos in itertools.chain(find_all(source, "def "), find_all(source, "async def ")):
+            if (pos and source[pos - 1] != "\n") or is_in_string(pos):
+                continue # not at the top level
+            decorator_start = pos
+            while decorator_start:
+                decorator_start = get_line_start(source, decorator_start - 1)
+                if source[decorator_start] != "@" or decorator_start in marker_line_starts:
+                    break
+            if decorator_start not in marker_line_starts:
+                function_starts.append(pos)
+        function_starts.sort()
+    return sorted(import_spans, key=lambda span: span[1]), markers, function_starts
+
+def locate_statements(source, is_top_level, module_name):
+    """Finds the statements in a module that the preprocessor rewrites.
+
+    Returns (node, start, end) for each import statement in source order, the (start, end)
+    offsets of entry point marker names, and the offsets of top-level function definitions not
+    marked as entry points.
+    """
+    try:
+        return locate_statements_lexically(source, is_top_level)
+    except _AmbiguousSourceError:
+        pass
+    tree = ast.parse(source, unescape_module_name(module_name or "__main__"))
+    spans = get_statement_spans(tree, source, 0)
+    import_spans = [span for span in spans if isinstance(span[0], (ast.Import, ast.ImportFrom))]
+    markers = []
+    function_starts = []
+    for node, start, end in spans:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        marker = next((decorator for decorator in node.decorator_list
+            if isinstance(decorator, ast.Name) and decorator.id == "_PREP_ENTRY_POINT"), None)
+        if marker:
+            marker_start = get_line_start(source, start)
+            for _ in range(node.lineno - marker.lineno):
+                marker_start = get_line_start(source, marker_start - 1)
+            marker_start += get_char_offset(source[marker_start:get_line_end(source,
+                marker_start)], marker.col_offset)
+            markers.append((marker_start, marker_start + len("_PREP_ENTRY_POINT")))
+        elif is_top_level and node in tree.body:
+            function_starts.append(get_line_start(source, start))
+    import_spans.sort(key=lambda span: span[1])
+    markers.sort()
+    function_starts.sort()
+    return import_spans, markers, function_starts
+
+def record_import(dotted_name, module_name, graph, imports):
+    """Resolves an imported module name, recording it in imports in the format of cache entries."""
+    imported_module_name = escape_module_name(dotted_name)
+    import_basename = os.path.join(*dotted_name.split("."))
+    imported_module = resolve_import(imported_module_name, import_basename, module_name, graph)
+    imports.append({"name": imported_module_name, "basename": import_basename,
+        "path": imported_module and imported_module.file_path})
+    return imported_module
+
+def find_uncalled_exception_names(source):
+    """Returns the names a module may use as exception classes without calling them.
+
+    These are the identifiers in except clauses and bare raise statements, found without parsing, so
+    the result may include other names too.
+    """
+    names = set()
+    for keyword in ("except", "raise"):
+        for pos in find_all(source, keyword):
+            end = pos + len(keyword)
+            if (pos and is_identifier_char(source[pos - 1])) or is_identifier_char(
+                    source[end:end + 1]):
+                continue
+            clause = source[end:get_line_end(source, end)].split("#")[0]
+            if keyword == "except":
+                clause = "".join(char if is_identifier_char(char) else " "
+                    for char in clause.split(":")[0])
+                names.update(clause.split())
+            elif clause.split(" from ")[0].strip().isidentifier():
+                names.add(clause.split(" from ")[0].strip())
+    return names
+
+def rewrite_import(node, module_name, graph, imports, eager_names=None):
+    """Returns the statements replacing an import statement, or None to leave it intact.
+
+    Imported modules that can't be found are assumed to be built in and are imported normally.
+
+    Positional arguments:
+    node -- the import statement
+    module_name -- the name of the module containing the statement, or None for the entry file
+    graph -- the ImportGraph to add imported modules to
+    imports -- the list to record imports in, in the format stored in cache entries
+    eager_names -- if given, imported modules are only run when first used, except that importing
+        these names runs the module immediately
+    """
+    statements = []
+    if isinstance(node, ast.Import):
+        transcluded = False
+        for alias in node.names:
+            imported_module = record_import(alias.name, module_name, graph, imports)
+            if not imported_module:
+                statements.append(f"import {alias.name}"
+                    + (f" as {alias.asname}" if alias.asname else ""))
+                continue
+            transcluded = True
+            if eager_names is None:
+                statements.append(imported_module.func_call)
+                statements.append(f"{alias.asname or imported_module.name} = "
+                    f"_HELPER_Module('{imported_module.name}')")
+            else:
+                statements.append(f"{alias.asname or imported_module.name} = "
+                    f"_HELPER_LazyModule('{imported_module.name}', "
+                    f"_HELPER_import_{imported_module.name})")
+        if not transcluded:
+            return None
+    else:
+        imported_module = record_import(node.module, module_name, graph, imports)
+        if not imported_module:
+            return None
+        module_exports = f"_HELPER_module_export_dict['{imported_module.name}']"
+        for alias in node.names:
+            if eager_names is not None and alias.name not in eager_names and alias.name != "*":
+                statements.append(f"{alias.asname or alias.name} = "
+                    f"_HELPER_LazyName('{imported_module.name}', "
+                    f"_HELPER_import_{imported_module.name}, '{alias.name}')")
+                continue
+            if imported_module.func_call not in statements:
+                statements.insert(0, imported_module.func_call)
+            if alias.name == "*":
+                statements.append(f"locals().update({module_exports})")
+            else:
+                statements.append(f"{alias.asname or alias.name} = "
+                    f"{module_exports}[\"{alias.name}\"]")
+    return "; ".join(statements)
+
+def scan_module(source, module_name, graph, auto_detect_entry_points, lazy_imports=False):
+    """Rewrites the import statements of a module's source, adding imported modules to the graph.
+
+    Only the statements found by locate_statements are rewritten; the text between them is copied to
+    the output unchanged without being split into lines. Import statements spanning several lines
+    are collapsed onto their first line and followed by blank lines, so line numbers in the body
+    match the source except where entry point decorators are inserted.
+
+    Returns the rewritten body, a list of the imports encountered (in the format stored in cache
+    entries) and the sorted line numbers in the body of inserted entry point decorators.
+    """
+    is_top_level = module_name is None
+    if "\r" in source:
+        source = source.replace("\r\n", "\n").replace("\r", "\n")
+    imports = []
+    inserted_line_nums = []
+    if not is_top_level and "import" not in source and "_PREP_ENTRY_POINT" not in source:
+        return source, imports, inserted_line_nums
+    import_spans, markers, function_starts = locate_statements(source, is_top_level, module_name)
+    eager_names = find_uncalled_exception_names(source) if lazy_imports else None
+
+    # Edits are (start offset, end offset, replacement, blank lines to add after the line):
+    edits = []
+    for node, start, end in import_spans:
+        if isinstance(node, ast.ImportFrom) and node.level:
+            raise RuntimeError(f"Relative import on line {source.count(chr(10), 0, start) + 1} "
+                f"of module {unescape_module_name(module_name or '__main__')} is not supported.")
+        replacement = rewrite_import(node, module_name, graph, imports, eager_names)
+        if replacement is None:
+            continue
+        rest_of_line = source[end:get_line_end(source, end)]
+        if not rest_of_line.strip() or rest_of_line.lstrip().startswith("#"):
+            # Keep the original statement visible in the output:
+            replacement += " # " + " ".join(source[start:end].split())
+        edits.append((start, end, replacement, source.count("\n", start, end)))
+    for start, end in markers:
+        edits.append((start, end, "_HELPER_entry_point", 0))
+    if auto_detect_entry_points:
+        line_num = 1
+        pos = 0
+        for start in function_starts:
+            edits.append((start, start, "@_HELPER_entry_point\n", 0))
+            line_num += source.count("\n", pos, start)
+            pos = start
+            inserted_line_nums.append(line_num)
+            line_num += 1
+    if not edits:
+        return source, imports, inserted_line_nums
+
+    edits.sort(key=lambda edit: edit[0])
+    module_buffer = []
+    pos = 0
+    pending_blank_lines = 0
+    for start, end, replacement, blank_lines in edits:
+        unchanged = source[pos:start]
+        if pending_blank_lines:
+            line_end = unchanged.find("\n")
+            if line_end != -1:
+                unchanged = (unchanged[:line_end] + "\n" * pending_blank_lines
+                    + unchanged[line_end:])
+                pending_blank_lines = 0
+        module_buffer.append(unchanged)
+        module_buffer.append(replacement)
+        pending_blank_lines += blank_lines
+        pos = end
+    unchanged = source[pos:]
+    if pending_blank_lines:
+        line_end = unchanged.find("\n")
+        if line_end == -1:
+            unchanged += "\n"
+            line_end = len(unchanged) - 1
+        unchanged = unchanged[:line_end] + "\n" * pending_blank_lines + unchanged[line_end:]
+    module_buffer.append(unchanged)
+    return "".join(module_buffer), imports, inserted_line_nums
+
+def preprocess_module(module, graph, auto_detect_entry_points, cache, lazy_imports=False):
+    """Fills in the body of a module in the graph, adding the modules it imports to the graph."""
+    with open(module.file_path, "rb") as file:
+        source = file.read()
+    if cache:
+        cache_key = BuildCache.make_key(module.name or "", hashlib.sha256(source).hexdigest(),
+            f"{module.name is None},{auto_detect_entry_points},{lazy_imports}")
+        cache_entry = cache.lookup(cache_key)
+        if cache_entry and replay_cached_imports(cache_entry["imports"], module.name, graph):
+            module.body_text = cache_entry["body"]
+            module.inserted_line_nums = cache_entry["inserted_lines"]
+            return
+    module.body_text, imports, module.inserted_line_nums = scan_module(source.decode("utf-8"),
+        module.name, graph, auto_detect_entry_points, lazy_imports)
+    if cache:
+        cache.store(cache_key, {"body": module.body_text, "imports": imports,
+            "inserted_lines": module.inserted_line_nums})
+
+def preprocess_new_modules(graph, first_index, auto_detect_entry_points, cache, lazy_imports):
+    """Preprocesses the modules in the graph from first_index on, including any they import."""
+    # Modules are appended to the graph as they're discovered, so walking it by index visits each
+    # module exactly once even as more are added:
+    i = first_index
+    while i < len(graph):
+        preprocess_module(graph.get_nth(i), graph, auto_detect_entry_points, cache, lazy_imports)
+        i += 1
+
+def build_import_graph(file_path, auto_detect_entry_points=True, cache=None, lazy_imports=False):
+    """Preprocesses an entry file and every module it transitively imports.
+
+    Returns an ImportGraph whose modules (and entry) have their bodies filled in.
+    """
+    graph = ImportGraph(file_path)
+    preprocess_module(graph.entry, graph, auto_detect_entry_points, cache, lazy_imports)
+    preprocess_new_modules(graph, 0, auto_detect_entry_points, cache, lazy_imports)
+    graph.check_acyclic()
+    return graph
+
+def update_import_graph(graph, changed_names, auto_detect_entry_points=True, cache=None,
+        lazy_imports=False):
+    """Preprocesses changed modules in a graph again, along with any modules they newly import.
+
+    Modules no longer imported are removed from the graph.
+
+    Positional arguments:
+    graph -- the ImportGraph returned by build_import_graph
+    changed_names -- the names of the modules whose files changed, with None for the entry file
+    Returns the modules that were preprocessed and the modules that were removed.
+    """
+    first_new_index = len(graph)
+    for name in changed_names:
+        graph.remove_imports(name)
+        preprocess_module(graph.get_module(name), graph, auto_detect_entry_points, cache,
+            lazy_imports)
+    preprocess_new_modules(graph, first_new_index, auto_detect_entry_points, cache, lazy_imports)
+    preprocessed = [graph.get_module(name) for name in changed_names]
+    preprocessed.extend(graph.get_nth(i) for i in range(first_new_index, len(graph)))
+    removed = graph.remove_unreachable()
+    graph.check_acyclic()
+    return preprocessed, removed
+
+def get_export_reference(node):
+    """Returns (module, name) if node looks up a name in a transcluded module's exports.
+
+    The name is None if node refers to the module's exports as a whole.
+    """
+    if not isinstance(node, ast.Subscript) or not isinstance(node.slice, ast.Constant):
+        return None
+    if isinstance(node.value, ast.Name) and node.value.id == "_HELPER_module_export_dict":
+        return node.slice.value, None
+    inner = get_export_reference(node.value)
+    if inner and inner[1] is None:
+        return inner[0], node.slice.value
+    return None
+
+def get_star_import(node):
+    """Returns the module whose exports node copies into the local namespace, if it does."""
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+            and node.func.attr == "update" and isinstance(node.func.value, ast.Call)
+            and isinstance(node.func.value.func, ast.Name) and node.func.value.func.id == "locals"
+            and len(node.args) == 1):
+        export = get_export_reference(node.args[0])
+        if export and export[1] is None:
+            return export[0]
+    return None
+
+def find_references(node):
+    """Returns the references made by a preprocessed statement and everything nested in it.
+
+    Returns (names, attributes, exports): the names loaded that aren't the base of an attribute
+    access, the (base, attribute) pairs of attribute accesses on names, and the (module, name)
+    pairs of names imported from transcluded modules, with None as the name for references to a
+    module's exports as a whole. Star imports are left out; see find_star_imports.
+    """
+    names = set()
+    attributes = set()
+    exports = set()
+    attribute_bases = set() # ids of names accessed as attribute bases
+    export_dict_lookups = set() # ids of the inner halves of name lookups in exports
+    # ast.walk visits parents before their children:
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name):
+            if not isinstance(child.ctx, ast.Store) and id(child) not in attribute_bases:
+                names.add(child.id)
+        elif isinstance(child, ast.Attribute):
+            if isinstance(child.value, ast.Name):
+                attributes.add((child.value.id, child.attr))
+                attribute_bases.add(id(child.value))
+        elif isinstance(child, ast.Subscript) and id(child) not in export_dict_lookups:
+            export = get_export_reference(child)
+            if export:
+                exports.add(export)
+                export_dict_lookups.add(id(child.value))
+        elif isinstance(child, ast.Call):
+            if get_star_import(child):
+                export_dict_lookups.add(id(child.args[0]))
+            elif (isinstance(child.func, ast.Name) and child.func.id == "_HELPER_LazyName"
+                    and len(child.args) == 3 and isinstance(child.args[0], ast.Constant)
+                    and isinstance(child.args[2], ast.Constant)):
+                exports.add((child.args[0].value, child.args[2].value))
+    return names, attributes, exports
+
+def find_star_imports(node):
+    """Returns the names of the transcluded modules star imported in a preprocessed statement."""
+    return [module_name for module_name in map(get_star_import, ast.walk(node)) if module_name]
+
+class ModuleSymbols:
+    """The top-level definitions of a preprocessed module and the names its statements refer to."""
+
+    def __init__(self, body_text, module_name):
+        """Parses a preprocessed module body.
+
+        Positional arguments:
+        body_text -- the preprocessed body of the module
+        module_name -- the escaped name of the module, or None for the entry file
+        """
+        tree = ast.parse(body_text, unescape_module_name(module_name or "__main__"))
+        self.definitions = {} # maps names to (first line, last line, references) of definitions
+        self.root_references = [] # references of statements run when the module is imported
+        self.aliases = {} # maps names bound to transcluded modules to the module names
+        self.star_imports = []
+        for node in tree.body:
+            references = find_references(node)
+            self.star_imports.extend(find_star_imports(node))
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                first_line = min([node.lineno] + [decorator.lineno
+                    for decorator in node.decorator_list])
+                self.definitions.setdefault(node.name, []).append(
+                    (first_line, node.end_lineno, references))
+                continue
+            self.root_references.append(references)
+            if (isinstance(node, ast.Assign) and isinstance(node.value, ast.Call)
+                    and isinstance(node.value.func, ast.Name)
+                    and node.value.func.id in ("_HELPER_Module", "_HELPER_LazyModule")):
+                for target in node.targets:
+                    if isinstance(target, ast.Name):
+                        self.aliases[target.id] = node.value.args[0].value
+
+def find_unreachable_definitions(graph, symbols):
+    """Returns the line spans of the top-level definitions no entry point can reach.
+
+    Everything in the entry file and every statement run when a module is imported is assumed to be
+    reachable, along with any definition referred to by name from reachable code. Names looked up
+    dynamically (with getattr or through a module's exports dict) are not followed.
+
+    Positional arguments:
+    graph -- the ImportGraph of the build
+    symbols -- a dict mapping module names (None for the entry file) to ModuleSymbols
+    Returns a dict mapping module names to sorted lists of (first line, last line) spans.
+    """
+    reachable = set()
+    worklist = [(module_name, references) for module_name, module_symbols in symbols.items()
+        for references in module_symbols.root_references]
+
+    def mark(module_name, name):
+        module_symbols = symbols.get(module_name)
+        if not module_symbols:
+            return
+        if name is None:
+            for defined_name in module_symbols.definitions:
+                mark(module_name, defined_name)
+        elif name in module_symbols.definitions:
+            if (module_name, name) not in reachable:
+                reachable.add((module_name, name))
+                worklist.extend((module_name, references)
+                    for _, _, references in module_symbols.definitions[name])
+        else:
+            for star_import in module_symbols.star_imports:
+                mark(star_import, name)
+
+    mark(None, None)
+    while worklist:
+        module_name, (names, attributes, exports) = worklist.pop()
+        aliases = symbols[module_name].aliases
+        for name in names:
+            mark(*((aliases[name], None) if name in aliases else (module_name, name)))
+        for base, attribute in attributes:
+            mark(*((aliases[base], attribute) if base in aliases else (module_name, base)))
+        for export in exports:
+            mark(*export)
+
+    unreachable = {}
+    for module in graph:
+        unreachable[module.name] = sorted((first_line, last_line)
+            for name, spans in symbols[module.name].definitions.items()
+            if (module.name, name) not in reachable for first_line, last_line, _ in spans)
+    return unreachable
+
+def remove_lines(text, spans):
+    """Removes sorted, inclusive (first line, last line) spans of 1-based line numbers from text.
+
+    Blank lines following a removed span are removed with it. Returns the remaining text and a list
+    of (line number in remaining text, line number in text) pairs marking the start of each run of
+    lines kept together.
+    """
+    lines = text.splitlines(keepends=True)
+    kept = []
+    segments = [(1, 1)]
+    pos = 0
+    for first_line, last_line in spans:
+        kept.extend(lines[pos:first_line - 1])
+        pos = max(pos, last_line)
+        while pos < len(lines) and not lines[pos].strip():
+            pos += 1
+        if segments[-1][0] == len(kept) + 1:
+            segments.pop()
+        segments.append((len(kept) + 1, pos + 1))
+    kept.extend(lines[pos:])
+    return "".join(kept), segments
+
+def shake_import_graph(graph, symbols_cache=None):
+    """Removes the top-level functions and classes no entry point can reach from a build.
+
+    The graph's modules are left intact. Returns a dict mapping module names to the shaken body text
+    and the line segments of the text, as returned by remove_lines.
+
+    Positional arguments:
+    graph -- the ImportGraph of the build
+    symbols_cache -- a dict to keep each module's body text and ModuleSymbols in between calls, so
+        only modules whose bodies changed are parsed again
+    """
+    if symbols_cache is None:
+        symbols_cache = {}
+    symbols = {}
+    for module in itertools.chain([graph.entry], graph):
+        cached = symbols_cache.get(module.name)
+        if not cached or cached[0] != module.body_text:
+            cached = symbols_cache[module.name] = (module.body_text,
+                ModuleSymbols(module.body_text, module.name))
+        symbols[module.name] = cached[1]
+    unreachable = find_unreachable_definitions(graph, symbols)
+    return {module.name: remove_lines(module.body_text, unreachable[module.name])
+        for module in graph}
+
+def find_top_level_names(tree):
+    """Returns the names bound when a module's top level runs and those bound only by def or class.
+
+    Names bound in the bodies of compound statements such as if and try count, but not names local
+    to functions, classes, lambdas or comprehensions.
+    """
+    definitions = set()
+    other_names = set()
+    stack = list(tree.body)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            definitions.add(node.name)
+            stack.extend(node.decorator_list)
+            continue
+        if isinstance(node, (ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp,
+                ast.GeneratorExp)):
+            continue
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            other_names.update((alias.asname or alias.name).split(".")[0]
+                for alias in node.names if alias.name != "*")
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            other_names.add(node.id)
+        elif isinstance(node, (ast.ExceptHandler, ast.MatchAs, ast.MatchStar)) and node.name:
+            other_names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            other_names.add(node.rest)
+        stack.extend(ast.iter_child_nodes(node))
+    return definitions | other_names, definitions - other_names
+
+"""Matches the stand-ins --lazy-imports binds names imported with from to."""
+_LAZY_NAME_PATTERN = re.compile(
+    r"(\w+) = _HELPER_LazyName\('(\w+)', _HELPER_import_\2, '(\w+)'\)")
+
+def resolve_lazy_names(graph, module_bodies):
+    """Binds names imported lazily directly unless they're top-level functions or classes.
+
+    Stand-ins only behave like what they stand in for when called, subclassed or looked into, so
+    names bound to any other value, such as a number or a sentinel, have their module run on import
+    instead. Returns a dict mapping module names to body texts and segments like module_bodies.
+
+    Positional arguments:
+    graph -- the ImportGraph of the build
+    module_bodies -- a dict mapping module names (None for the entry file) to (body text, segments)
+    """
+    definitions = {}
+
+    def replace(match):
+        name, module_name, imported_name = match.groups()
+        if module_name not in definitions:
+            definitions[module_name] = find_top_level_names(ast.parse(
+                module_bodies[module_name][0], unescape_module_name(module_name)))[1]
+        if imported_name in definitions[module_name]:
+            return match[0]
+        return (f"{graph.get(module_name).func_call}; {name} = "
+            f"_HELPER_module_export_dict['{module_name}'][\"{imported_name}\"]")
+
+    return {module_name: (_LAZY_NAME_PATTERN.sub(replace, body_text), segments)
+        for module_name, (body_text, segments) in module_bodies.items()}
+
+"""Matches the statements star imports of transcluded modules are rewritten to."""
+_STAR_IMPORT_PATTERN = re.compile(r"locals\(\)\.update\(_HELPER_module_export_dict\['(\w+)'\]\)")
+
+def expand_star_imports(module_bodies):
+    """Replaces star imports of transcluded modules with assignments of the names they import.
+
+    Modules run inside functions, where updating locals() doesn't bind any names, so each star
+    import is expanded into the names in the imported module's __all__, if it's a literal, or else
+    the names bound at its top level that don't start with an underscore. Returns a dict mapping
+    module names to body texts and segments like module_bodies.
+
+    Positional arguments:
+    module_bodies -- a dict mapping module names (None for the entry file) to (body text, segments)
+    """
+    expanded_bodies = {}
+    public_names = {}
+
+    def get_public_names(module_name):
+        if module_name not in public_names:
+            tree = ast.parse(expand(module_name), unescape_module_name(module_name))
+            names = sorted(name for name in find_top_level_names(tree)[0]
+                if not name.startswith("_"))
+            for node in tree.body:
+                if (isinstance(node, ast.Assign) and len(node.targets) == 1
+                        and isinstance(node.targets[0], ast.Name)
+                        and node.targets[0].id == "__all__"):
+                    try:
+                        names = list(ast.literal_eval(node.value))
+                    except ValueError:
+                        pass
+            public_names[module_name] = names
+        return public_names[module_name]
+
+    def replace(match):
+        return "; ".join(f"{name} = _HELPER_module_export_dict['{match[1]}'][\"{name}\"]"
+            for name in get_public_names(match[1])) or "pass"
+
+    def expand(module_name):
+        # Star imports in the imported module are expanded first, so the names they bind count:
+        if module_name not in expanded_bodies:
+            expanded_bodies[module_name] = _STAR_IMPORT_PATTERN.sub(replace,
+                module_bodies[module_name][0])
+        return expanded_bodies[module_name]
+
+    return {module_name: (expand(module_name), segments)
+        for module_name, (_, segments) in module_bodies.items()}
+
+"""Operators --fold-constants evaluates when both operands are numbers."""
+_FOLDABLE_UNARY_OPERATORS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+_FOLDABLE_BINARY_OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub,
+    ast.Mult: operator.mul, ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod}
+
+class _NotConstantError(Exception):
+    """Raised when an expression can't be evaluated at build time."""
+
+def is_foldable_value(value):
+    """Returns whether a value can be written into a build as a literal."""
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return value is None or isinstance(value, (int, str))
+
+def load_foldable_functions(graph):
+    """Imports the transcluded modules defining FOLDABLE_FUNCTIONS into the preprocessor.
+
+    Modules that aren't in the build are skipped, as are modules that fail to import, with a
+    warning. Returns a dict mapping (escaped module name, function name) pairs to functions.
+    """
+    functions = {}
+    for dotted_name, function_names in FOLDABLE_FUNCTIONS.items():
+        module = graph.get(escape_module_name(dotted_name))
+        if not module:
+            continue
+        spec = importlib.util.spec_from_file_location(f"_HELPER_fold_{module.name}",
+            module.file_path)
+        loaded_module = importlib.util.module_from_spec(spec)
+        try:
+            spec.loader.exec_module(loaded_module)
+        except Exception as e:
+            print(f"Not folding calls to functions in {dotted_name}, which failed to import: "
+                f"{type(e).__name__}: {e}", file=sys.stderr)
+            continue
+        for function_name in function_names:
+            if callable(getattr(loaded_module, function_name, None)):
+                functions[module.name, function_name] = getattr(loaded_module, function_name)
+    return functions
+
+def find_frozen_dataclasses(tree):
+    """Returns the names of a module's frozen dataclasses whose constructors only store fields.
+
+    These are top-level classes decorated with nothing but dataclass(frozen=True), with no base
+    classes and no __init__, __new__ or __post_init__ methods of their own. Their instances can't be
+    modified, so one instance can be shared by every use of the expression that built it.
+    """
+    names = set()
+    for node in tree.body:
+        if (not isinstance(node, ast.ClassDef) or node.bases or node.keywords
+                or len(node.decorator_list) != 1
+                or not isinstance(node.decorator_list[0], ast.Call)):
+            continue
+        decorator = node.decorator_list[0]
+        if not ((isinstance(decorator.func, ast.Name) and decorator.func.id == "dataclass")
+                or (isinstance(decorator.func, ast.Attribute)
+                and decorator.func.attr == "dataclass")):
+            continue
+        if not any(keyword.arg == "frozen" and isinstance(keyword.value, ast.Constant)
+                and keyword.value.value is True for keyword in decorator.keywords):
+            continue
+        if not any(isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef))
+                and statement.name in ("__init__", "__new__", "__post_init__")
+                for statement in node.body):
+            names.add(node.name)
+    return names
+
+def get_import_bindings(tree):
+    """Returns what the names bound at the top level of a preprocessed module were imported as.
+
+    Returns a dict mapping names to (module, name) pairs for names imported from transcluded
+    modules, with None as the name for names bound to a module as a whole. Names bound more than
+    once at the top level are left out.
+    """
+    bindings = {}
+    rebound = set()
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            rebound.add(node.name)
+            continue
+        if not isinstance(node, ast.Assign):
+            continue
+        value = node.value
+        binding = get_export_reference(value)
+        if (not binding and isinstance(value, ast.Call) and isinstance(value.func, ast.Name)
+                and value.args and isinstance(value.args[0], ast.Constant)):
+            if value.func.id in ("_HELPER_Module", "_HELPER_LazyModule"):
+                binding = value.args[0].value, None
+            elif (value.func.id == "_HELPER_LazyName" and len(value.args) == 3
+                    and isinstance(value.args[2], ast.Constant)):
+                binding = value.args[0].value, value.args[2].value
+        for target in node.targets:
+            if not isinstance(target, ast.Name):
+                continue
+            if binding and target.id not in bindings:
+                bindings[target.id] = binding
             else:
-                if auto_detect_entry_points and words[0] == "def" and is_top_level:
-                    module_buffer.append(line[:line.find("d")] + "@_HELPER_entry_point\n")
-                    entry_point_line_nums.append(len(module_buffer))
-                module_buffer.append(line)
-        if is_top_level:
-            strings = [
-                f"_HELPER_module_export_dict = {{}}",
-                f"_HELPER_entry_point_line_nums = [{', '.join(str(num) for num in entry_point_line_nums)}]",
-                f"class _HELPER_Module:",
-                f"{indent}def __init__(self, module_name):",
-                f"{indent * 2}self.__dict__ = _HELPER_module_export_dict[module_name]",
-                f"{indent}def __getitem__(self, key):",
-                f"{indent * 2}return self.__dict__[key]",
-                f"{indent}def __setitem__(self, key, value):",
-                f"{indent * 2}self.__dict__[key] = value",
-                f"def _HELPER_entry_point(func):",
-                f"{indent}import functools",
-                f"{indent}@functools.wraps(func)",
-                f"{indent}def wrapped(*args, **kwargs):",
-                f"{indent * 2}try:",
-                f"{indent * 3}return func(*args, **kwargs)",
-                f"{indent * 2}except Exception as e:",
-                f"{indent * 3}print('Source traceback (most recent call last):')",
-                f"{indent * 3}frame_lines = []",
-                f"{indent * 3}tb = e.__traceback__",
-                f"{indent * 3}while tb:",
-                f"{indent * 4}translation_result = _HELPER_translate_line_no(tb.tb_lineno)",
-                f"{indent * 4}if not translation_result:",
-                f"{indent * 5}tb = tb.tb_next",
-                f"{indent * 5}continue",
-                f"{indent * 4}module_name, line_no = translation_result",
-                f"{indent * 4}frame_lines.append(f'  File \"{{module_name + \".py\"}}\", line {{line_no}}, in {{tb.tb_frame.f_code.co_name}}')",
-                f"{indent * 4}tb = tb.tb_next",
-                f"{indent * 3}print('\\n'.join(frame_lines))",
-                f"{indent * 3}print(type(e).__name__ + (': ' if str(e) else '') + str(e))",
-                f"{indent * 3}exit(1)",
-                f"{indent}return wrapped",
-                f"def _HELPER_translate_line_no(line_no):",
-            ]
-            strings = [string + "\n" for string in strings]
-            running_line_num = len(strings) + 8 + 2 * len(module_list) # two lines added per module
-            module_line_entries = []
-            for module in module_list:
-                module_line_entries.append(
-                    f"{indent}elif line_no >= {running_line_num}:\n"
-                    f"{indent * 2}return '{module.name}', line_no - {running_line_num + 5}\n"
-                )
-                running_line_num += module.body_text.count("\n")
-            module_line_entries.append(
-                f"{indent}if line_no >= {running_line_num}:\n"
-                f"{indent * 2}skipped_lines = 0\n"
-                f"{indent * 2}for entry_point_line_num in _HELPER_entry_point_line_nums:\n"
-                f"{indent * 3}if entry_point_line_num + {running_line_num} <= line_no:\n"
-                f"{indent * 4}skipped_lines += 1\n"
-                f"{indent * 3}else:\n"
-                f"{indent * 4}break\n"
-                f"{indent * 2}return '{''.join(os.path.basename(file_path).split('.')[:-1])}', line_no - {running_line_num} - skipped_lines\n"
-            )
-            strings.extend(reversed(module_line_entries))
-            strings.extend(module.body_text for module in module_list)
-            strings.append("# End imports.\n")
-            strings.extend(module_buffer)
-            return ("".join(strings), module_list)
+                rebound.add(target.id)
+    return {name: binding for name, binding in bindings.items() if name not in rebound}
+
+def insert_generated_lines(segments, line_num, count):
+    """Returns body segments with count generated lines inserted before a line of the body.
+
+    The segments are in the format taken by LineTable.add_body.
+    """
+    i = bisect.bisect_right([body_line_num for body_line_num, _ in segments], line_num) - 1
+    body_line_num, source_line_num = segments[i]
+    resumed_line_num = source_line_num and source_line_num + line_num - body_line_num
+    return (segments[:i] + ([segments[i]] if body_line_num < line_num else [])
+        + [(line_num, None), (line_num + count, resumed_line_num)]
+        + [(later_line_num + count, source_line_num)
+            for later_line_num, source_line_num in segments[i + 1:]])
+
+def fold_module_constants(body_text, module_name, functions, dataclasses, constant_names):
+    """Evaluates the constant expressions in a preprocessed module body.
+
+    Calls to foldable functions with constant arguments are replaced with their results, followed
+    by a comment showing the original call where the line allows one. Lists of calls to frozen
+    dataclasses with constant arguments, passed straight to a call inside a function body, are
+    built once as a tuple when the module is imported and the tuple is passed instead. Sums of
+    such lists and conditional expressions choosing between them are built as one tuple for each
+    list they can evaluate to. Lines assigning the tuples are inserted after the imports or class
+    definitions they need; all other lines keep their line numbers.
+
+    Positional arguments:
+    body_text -- the preprocessed body of the module
+    module_name -- the escaped name of the module, or None for the entry file
+    functions -- the dict returned by load_foldable_functions
+    dataclasses -- the (module name, class name) pairs of dataclasses found by
+        find_frozen_dataclasses
+    constant_names -- an iterator yielding unused names to assign tuples to
+    Returns the folded body and a list of (line number, line count) pairs of the lines inserted, in
+    the body before they were inserted, or None if nothing was folded.
+    """
+    tree = ast.parse(body_text, unescape_module_name(module_name or "__main__"))
+    bindings = get_import_bindings(tree)
+    binding_line_nums = {} # maps names to the last line of the statement last binding them
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            binding_line_nums[node.name] = node.end_lineno
+        elif isinstance(node, ast.Assign):
+            binding_line_nums.update((target.id, node.end_lineno) for target in node.targets
+                if isinstance(target, ast.Name))
+    for name in find_frozen_dataclasses(tree):
+        bindings.setdefault(name, (module_name, name))
+
+    def get_callee(node):
+        if isinstance(node, ast.Name):
+            return bindings.get(node.id)
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+            binding = bindings.get(node.value.id)
+            if binding and binding[1] is None:
+                return binding[0], node.attr
+        return None
+
+    def evaluate(node):
+        if isinstance(node, ast.Constant) and is_foldable_value(node.value):
+            return node.value
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _FOLDABLE_UNARY_OPERATORS:
+            operand = evaluate(node.operand)
+            if isinstance(operand, (int, float)):
+                return _FOLDABLE_UNARY_OPERATORS[type(node.op)](operand)
+        elif isinstance(node, ast.BinOp) and type(node.op) in _FOLDABLE_BINARY_OPERATORS:
+            left = evaluate(node.left)
+            right = evaluate(node.right)
+            if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+                try:
+                    return _FOLDABLE_BINARY_OPERATORS[type(node.op)](left, right)
+                except ArithmeticError:
+                    pass
+        elif isinstance(node, ast.Call) and get_callee(node.func) in functions:
+            args = [evaluate(arg) for arg in node.args]
+            if any(keyword.arg is None for keyword in node.keywords):
+                raise _NotConstantError()
+            kwargs = {keyword.arg: evaluate(keyword.value) for keyword in node.keywords}
+            try:
+                value = functions[get_callee(node.func)](*args, **kwargs)
+            except Exception:
+                # Leave the call to raise the error when the build runs:
+                raise _NotConstantError()
+            if is_foldable_value(value):
+                return value
+        raise _NotConstantError()
+
+    def get_element_texts(node):
+        """Returns the texts of the elements of a constant list of dataclasses."""
+        if not isinstance(node, ast.List) or not node.elts:
+            raise _NotConstantError()
+        texts = []
+        for element in node.elts:
+            if (not isinstance(element, ast.Call) or get_callee(element.func) not in dataclasses
+                    or any(keyword.arg is None for keyword in element.keywords)):
+                raise _NotConstantError()
+            args = [repr(evaluate(arg)) for arg in element.args]
+            args.extend(f"{keyword.arg}={evaluate(keyword.value)!r}"
+                for keyword in element.keywords)
+            texts.append(f"{ast.get_source_segment(body_text, element.func)}({', '.join(args)})")
+        return texts
+
+    def get_needed_names(node):
+        """Returns the top-level names a constant list of dataclasses refers to."""
+        return {(element.func if isinstance(element.func, ast.Name) else element.func.value).id
+            for element in ast.walk(node) if isinstance(element, ast.Call)}
+
+    def expand(node):
+        """Returns the constant lists of dataclasses an expression can evaluate to.
+
+        A list is returned as ("list", element texts, needed names) and a choice between lists as
+        ("if", test text, body, orelse). Lists added together are concatenated, with additions to
+        a choice distributed over its branches: (A if c else B) + C becomes
+        (A + C) if c else (B + C).
+        """
+        if isinstance(node, ast.IfExp):
+            test_text = ast.get_source_segment(body_text, node.test)
+            if "\n" in test_text:
+                # The test replaces the expression's first line, so it must fit on one:
+                raise _NotConstantError()
+            return ("if", test_text, expand(node.body), expand(node.orelse))
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+            return concatenate(expand(node.left), expand(node.right))
+        return ("list", get_element_texts(node), get_needed_names(node))
+
+    def concatenate(left, right):
+        if left[0] == "if":
+            return ("if", left[1], concatenate(left[2], right), concatenate(left[3], right))
+        if right[0] == "if":
+            return ("if", right[1], concatenate(left, right[2]), concatenate(left, right[3]))
+        return ("list", left[1] + right[1], left[2] | right[2])
+
+    line_starts = [0, *itertools.accumulate(len(line) + 1 for line in body_text.split("\n"))]
+    def get_offset(lineno, col_offset):
+        line_start = line_starts[lineno - 1]
+        return line_start + get_char_offset(body_text[line_start:line_starts[lineno]],
+            col_offset)
+
+    edits = [] # (start offset, end offset, replacement)
+    comments = {} # maps line numbers to the original text of calls folded on them
+    tuple_lines = {} # maps line numbers to the lines assigning tuples to insert before them
+    replaced = set() # ids of nodes already replaced
+
+    def replace(node, replacement):
+        replaced.add(id(node))
+        start = get_offset(node.lineno, node.col_offset)
+        end = get_offset(node.end_lineno, node.end_col_offset)
+        # Keep the lines after the node where they were:
+        edits.append((start, end, replacement + "\n" * body_text.count("\n", start, end)))
+
+    def make_tuple(node):
+        new_tuple_lines = [] # (line number, line) pairs, added to tuple_lines once all are made
+        def make_text(expansion):
+            if expansion[0] == "if":
+                return (f"({make_text(expansion[2])} if {expansion[1]} else "
+                    f"{make_text(expansion[3])})")
+            _, element_texts, needed_names = expansion
+            line_num = max(binding_line_nums[name] for name in needed_names) + 1
+            name = next(constant_names)
+            new_tuple_lines.append((line_num, f"{name} = ({', '.join(element_texts)}"
+                f"{',' if len(element_texts) == 1 else ''}) # built from lines {node.lineno}-"
+                f"{node.end_lineno}\n"))
+            return name
+
+        try:
+            replacement = make_text(expand(node))
+        except (_NotConstantError, KeyError):
+            if isinstance(node, ast.IfExp):
+                # One branch may still be constant:
+                make_tuple(node.body)
+                make_tuple(node.orelse)
+            return
+        replace(node, replacement)
+        for line_num, line in new_tuple_lines:
+            tuple_lines.setdefault(line_num, []).append(line)
+
+    def visit(node, in_function):
+        if id(node) in replaced:
+            return
+        if isinstance(node, ast.Call):
+            try:
+                value = evaluate(node)
+            except _NotConstantError:
+                if in_function:
+                    for arg in itertools.chain(node.args,
+                            (keyword.value for keyword in node.keywords)):
+                        make_tuple(arg)
+            else:
+                replace(node, repr(value))
+                comments.setdefault(node.end_lineno, []).append(
+                    " ".join(ast.get_source_segment(body_text, node).split()))
+                return
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            body_ids = set(map(id, node.body))
+        elif isinstance(node, ast.Lambda):
+            body_ids = {id(node.body)}
+        else:
+            body_ids = ()
+        for child in ast.iter_child_nodes(node):
+            visit(child, in_function or id(child) in body_ids)
+
+    visit(tree, False)
+    if not edits:
+        return None
+    if comments:
+        # Comments can only follow lines that don't end inside a string or with a backslash:
+        line_ends = {token.start[0]: token.start for token in tokenize.generate_tokens(
+            io.StringIO(body_text).readline) if token.type in (tokenize.NEWLINE, tokenize.NL)}
+        spans = sorted((start, end) for start, end, _ in edits)
+        for line_num, calls in comments.items():
+            if line_num not in line_ends:
+                continue
+            # Unlike ast, tokenize counts columns in characters:
+            end = line_starts[line_num - 1] + line_ends[line_num][1]
+            i = bisect.bisect_right(spans, (end, end)) - 1
+            if i >= 0 and spans[i][1] > end:
+                continue
+            edits.append((end, end, " # " + "; ".join(calls)))
+
+    edits.sort(key=lambda edit: edit[0])
+    buffer = []
+    pos = 0
+    for start, end, replacement in edits:
+        buffer.append(body_text[pos:start])
+        buffer.append(replacement)
+        pos = end
+    buffer.append(body_text[pos:])
+    lines = "".join(buffer).splitlines(keepends=True)
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+    inserted = []
+    for line_num in sorted(tuple_lines, reverse=True):
+        lines[line_num - 1:line_num - 1] = tuple_lines[line_num]
+        inserted.append((line_num, len(tuple_lines[line_num])))
+    return "".join(lines), inserted[::-1]
+
+def fold_import_graph(graph, module_bodies):
+    """Evaluates the constant expressions in the bodies of a build's modules.
+
+    See fold_module_constants and FOLDABLE_FUNCTIONS.
+
+    Positional arguments:
+    graph -- the ImportGraph of the build
+    module_bodies -- a dict mapping module names, with None for the entry file, to (body text,
+        segments) pairs, the segments in the format taken by LineTable.add_body
+    Returns a dict of the same form with the folded bodies.
+    """
+    functions = load_foldable_functions(graph)
+    dataclasses = set()
+    for module_name, (body_text, _) in module_bodies.items():
+        if "dataclass" in body_text:
+            dataclasses.update((module_name, class_name) for class_name in
+                find_frozen_dataclasses(ast.parse(body_text)))
+    # Modules mentioning none of these names have nothing to fold and aren't parsed:
+    folded_names = {name for _, name in itertools.chain(functions, dataclasses)}
+    constant_names = (f"_HELPER_constant_{i}" for i in itertools.count())
+    folded_bodies = {}
+    for module_name, (body_text, segments) in module_bodies.items():
+        folded = None
+        if any(name in body_text for name in folded_names):
+            folded = fold_module_constants(body_text, module_name, functions, dataclasses,
+                constant_names)
+        if not folded:
+            folded_bodies[module_name] = body_text, segments
+            continue
+        body_text, inserted = folded
+        line_offset = 0
+        for line_num, count in inserted:
+            segments = insert_generated_lines(segments, line_num + line_offset, count)
+            line_offset += count
+        folded_bodies[module_name] = body_text, segments
+    return folded_bodies
+
+def build_bytecode_loader(chunks, indent):
+    """Returns a script that runs chunks of a build from code objects compiled ahead of time.
+
+    Each chunk is compiled as if it were preceded by the chunks before it, so line numbers in
+    tracebacks match the source build and can be translated the same way. The code objects are
+    marshalled together, compressed with zlib and stored in base64, so the script is about as large
+    as the source build. The script checks that the interpreter running it uses the same bytecode
+    format as this one, and otherwise compiles the chunks from source, which it also contains,
+    compressed the same way.
+
+    Positional arguments:
+    chunks -- the texts that concatenate to form the source build
+    indent -- the string to indent lines of the script with
+    """
+    line_offsets = list(itertools.accumulate((chunk.count("\n") for chunk in chunks[:-1]),
+        initial=0))
+    codes = [compile("\n" * line_offset + chunk, BYTECODE_FILE_NAME, "exec", dont_inherit=True)
+        for line_offset, chunk in zip(line_offsets, chunks)]
+
+    def encode(data):
+        return base64.encodebytes(zlib.compress(data, 9)).decode("ascii")
+
+    strings = [
+        f"import binascii as _HELPER_binascii\n",
+        f"import importlib as _HELPER_importlib\n",
+        f"import marshal as _HELPER_marshal\n",
+        f"import zlib as _HELPER_zlib\n",
+        f"def _HELPER_decode_bytecode_payload(payload):\n",
+        f"{indent}return _HELPER_zlib.decompress(_HELPER_binascii.a2b_base64(payload))\n",
+        # Importing importlib.util for its MAGIC_NUMBER costs more than the compiling it saves:
+        f"if (_HELPER_importlib._bootstrap_external.MAGIC_NUMBER\n",
+        f"{indent * 2}== {importlib.util.MAGIC_NUMBER!r}):\n",
+        f"{indent}_HELPER_bytecode_chunks = _HELPER_marshal.loads("
+        f"_HELPER_decode_bytecode_payload(\n",
+        f"\"\"\"\n{encode(marshal.dumps(codes))}\"\"\"))\n",
+        f"else:\n",
+        f"{indent}_HELPER_bytecode_chunks = [compile('\\n' * _HELPER_line_offset + _HELPER_source, "
+        f"'{BYTECODE_FILE_NAME}', 'exec')\n",
+        f"{indent * 2}for _HELPER_line_offset, _HELPER_source in zip({line_offsets!r}, "
+        f"_HELPER_decode_bytecode_payload(\n",
+        # Source can't contain null characters, so they separate the chunks:
+        f"\"\"\"\n{encode(chr(0).join(chunks).encode('utf-8'))}\"\"\").decode('utf-8')"
+        f".split(chr(0)))]\n",
+        f"for _HELPER_code in _HELPER_bytecode_chunks:\n",
+        f"{indent}exec(_HELPER_code)\n",
+    ]
+    return "".join(strings)
+
+class LineTable:
+    """Maps line numbers in a build to the files and line numbers they came from.
+
+    The build is divided into runs of consecutive lines copied from the same file, each stored as
+    the build line number it starts on and the (file path, line offset) subtracted to translate
+    lines in it, or None for runs of lines generated by the preprocessor. Looking up a line is a
+    binary search of the run starts.
+    """
+
+    def __init__(self, line_starts=None, line_sources=None):
+        """Creates a LineTable, empty unless given the runs of an existing one."""
+        self.line_starts = line_starts or []
+        self.line_sources = line_sources or []
+
+    @classmethod
+    def load(cls, path):
+        """Returns a LineTable read from a source map written by save and the file names saved."""
+        with open(path, encoding="utf-8") as file:
+            source_map = json.load(file)
+        return cls(source_map["line_starts"], [source and tuple(source)
+            for source in source_map["line_sources"]]), source_map["file_names"]
+
+    def save(self, path, file_names):
+        """Writes the table to a source map, with the file names the build's code may run under."""
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"file_names": file_names, "line_starts": self.line_starts,
+                "line_sources": self.line_sources}, file)
+
+    def add_run(self, build_line_num, file_path=None, source_line_num=None):
+        """Starts a run of lines copied from a file at a build line, or of generated lines."""
+        if self.line_starts and self.line_starts[-1] == build_line_num:
+            # The previous run is empty:
+            self.line_starts.pop()
+            self.line_sources.pop()
+        self.line_starts.append(build_line_num)
+        self.line_sources.append(file_path and (file_path, build_line_num - source_line_num))
+
+    def add_body(self, build_line_num, file_path, segments):
+        """Adds the runs of a preprocessed body, starting at a build line.
+
+        Positional arguments:
+        build_line_num -- the line number in the build of the first line of the body
+        file_path -- the path of the file the body came from
+        segments -- (line number in the body, line number in the file) pairs marking the start of
+            each run of lines copied together, with None as the file line number for lines the
+            preprocessor inserted
+        """
+        for body_line_num, source_line_num in segments:
+            self.add_run(build_line_num + body_line_num - 1,
+                source_line_num and file_path, source_line_num)
+
+    def translate(self, line_num):
+        """Returns the (file path, line number) a build line came from, or None if generated."""
+        i = bisect.bisect_right(self.line_starts, line_num) - 1
+        if i < 0 or not self.line_sources[i]:
+            return None
+        file_path, line_offset = self.line_sources[i]
+        return file_path, line_num - line_offset
+
+def get_inserted_line_segments(inserted_line_nums):
+    """Returns the segments of a body with lines inserted at the given sorted line numbers.
+
+    The segments are in the format taken by LineTable.add_body.
+    """
+    segments = [(1, 1)]
+    for i, line_num in enumerate(inserted_line_nums):
+        if segments[-1][0] == line_num:
+            segments.pop()
+        segments.append((line_num, None))
+        segments.append((line_num + 1, line_num - i))
+    return segments
+
+def process_file(file_path, indent=" " * 4, auto_detect_entry_points=True, cache=None,
+        tree_shake=False, bytecode=False, translate_tracebacks=True, lazy_imports=False,
+        fold_constants=False):
+    """Preprocesses a python script by recursively transcluding imported files."""
+
+    graph = build_import_graph(file_path, auto_detect_entry_points, cache, lazy_imports)
+    return (*assemble_build(graph, indent, tree_shake, bytecode, translate_tracebacks,
+        lazy_imports, fold_constants=fold_constants), graph)
+
+def assemble_build(graph, indent=" " * 4, tree_shake=False, bytecode=False,
+        translate_tracebacks=True, lazy_imports=False, symbols_cache=None, fold_constants=False):
+    """Returns the text of the build of a preprocessed ImportGraph and its LineTable."""
+    if tree_shake:
+        module_bodies = shake_import_graph(graph, symbols_cache)
+    else:
+        module_bodies = {module.name: (module.body_text, [(1, 1)]) for module in graph}
+    module_bodies[None] = (graph.entry.body_text,
+        get_inserted_line_segments(graph.entry.inserted_line_nums))
+    module_bodies = expand_star_imports(module_bodies)
+    if lazy_imports:
+        module_bodies = resolve_lazy_names(graph, module_bodies)
+    if fold_constants:
+        module_bodies = fold_import_graph(graph, module_bodies)
+    module_texts = [wrap_module_body(module, module_bodies[module.name][0], indent)
+        for module in graph]
+    strings = [
+        f"_HELPER_module_export_dict = {{}}",
+        f"class _HELPER_Module:",
+        f"{indent}def __init__(self, module_name):",
+        f"{indent * 2}self.__dict__ = _HELPER_module_export_dict[module_name]",
+        f"{indent}def __getitem__(self, key):",
+        f"{indent * 2}return self.__dict__[key]",
+        f"{indent}def __setitem__(self, key, value):",
+        f"{indent * 2}self.__dict__[key] = value",
+    ]
+    if lazy_imports:
+        strings.extend([
+            # Runs a module on first attribute access, then becomes a _HELPER_Module:
+            f"class _HELPER_LazyModule(_HELPER_Module):",
+            f"{indent}def __init__(self, module_name, import_func):",
+            f"{indent * 2}self._HELPER_module_name = module_name",
+            f"{indent * 2}self._HELPER_import_func = import_func",
+            f"{indent}def __getattr__(self, key):",
+            f"{indent * 2}if '_HELPER_import_func' not in self.__dict__:",
+            f"{indent * 3}raise AttributeError(key)",
+            f"{indent * 2}self._HELPER_import_func()",
+            f"{indent * 2}self.__dict__ = _HELPER_module_export_dict[self._HELPER_module_name]",
+            f"{indent * 2}return getattr(self, key)",
+            f"{indent}def __getitem__(self, key):",
+            f"{indent * 2}return getattr(self, key)",
+            # Stands in for a name imported from a module, running the module on first use:
+            f"class _HELPER_LazyName:",
+            f"{indent}__slots__ = '_HELPER_module_name', '_HELPER_import_func', '_HELPER_name', "
+            f"'_HELPER_value'",
+            f"{indent}def __init__(self, module_name, import_func, name):",
+            f"{indent * 2}self._HELPER_module_name = module_name",
+            f"{indent * 2}self._HELPER_import_func = import_func",
+            f"{indent * 2}self._HELPER_name = name",
+            f"{indent}def _HELPER_resolve(self):",
+            f"{indent * 2}try:",
+            f"{indent * 3}return self._HELPER_value",
+            f"{indent * 2}except AttributeError:",
+            f"{indent * 3}self._HELPER_import_func()",
+            f"{indent * 3}self._HELPER_value = "
+            f"_HELPER_module_export_dict[self._HELPER_module_name][self._HELPER_name]",
+            f"{indent * 3}return self._HELPER_value",
+            f"{indent}def __getattr__(self, key):",
+            f"{indent * 2}if key.startswith('_HELPER_'):",
+            f"{indent * 3}raise AttributeError(key)",
+            f"{indent * 2}return getattr(self._HELPER_resolve(), key)",
+            f"{indent}def __call__(self, *args, **kwargs):",
+            f"{indent * 2}return self._HELPER_resolve()(*args, **kwargs)",
+            f"{indent}def __mro_entries__(self, bases):",
+            f"{indent * 2}return (self._HELPER_resolve(),)",
+            f"{indent}def __instancecheck__(self, instance):",
+            f"{indent * 2}return isinstance(instance, self._HELPER_resolve())",
+            f"{indent}def __subclasscheck__(self, subclass):",
+            f"{indent * 2}if type(subclass) is _HELPER_LazyName:",
+            f"{indent * 3}subclass = subclass._HELPER_resolve()",
+            f"{indent * 2}return issubclass(subclass, self._HELPER_resolve())",
+            f"{indent}def __eq__(self, other):",
+            f"{indent * 2}if type(other) is _HELPER_LazyName:",
+            f"{indent * 3}other = other._HELPER_resolve()",
+            f"{indent * 2}return self._HELPER_resolve() == other",
+            f"{indent}def __hash__(self):",
+            f"{indent * 2}return hash(self._HELPER_resolve())",
+            f"{indent}def __repr__(self):",
+            f"{indent * 2}return repr(self._HELPER_resolve())",
+        ])
+    if translate_tracebacks:
+        strings.extend([
+            f"def _HELPER_entry_point(func):",
+            f"{indent}import functools",
+            f"{indent}@functools.wraps(func)",
+            f"{indent}def wrapped(*args, **kwargs):",
+            f"{indent * 2}try:",
+            f"{indent * 3}return func(*args, **kwargs)",
+            f"{indent * 2}except Exception as e:",
+            f"{indent * 3}print('Source traceback (most recent call last):')",
+            f"{indent * 3}frame_lines = []",
+            f"{indent * 3}tb = e.__traceback__",
+            f"{indent * 3}while tb:",
+            f"{indent * 4}translation_result = _HELPER_translate_line_no(tb.tb_lineno)",
+            # Frames outside the build, such as in the standard library, aren't translated:
+            f"{indent * 4}if (not translation_result or tb.tb_frame.f_code.co_filename",
+            f"{indent * 5}!= _HELPER_translate_line_no.__code__.co_filename):",
+            f"{indent * 5}tb = tb.tb_next",
+            f"{indent * 5}continue",
+            f"{indent * 4}source_path, line_no = translation_result",
+            f"{indent * 4}frame_lines.append(f'  File \"{{source_path}}\", line {{line_no}}, in {{tb.tb_frame.f_code.co_name}}')",
+            f"{indent * 4}tb = tb.tb_next",
+            f"{indent * 3}print('\\n'.join(frame_lines))",
+            f"{indent * 3}print(type(e).__name__ + (': ' if str(e) else '') + str(e))",
+            f"{indent * 3}exit(1)",
+            f"{indent}return wrapped",
+            f"def _HELPER_translate_line_no(line_no):",
+            f"{indent}import bisect",
+            f"{indent}i = bisect.bisect_right(_HELPER_line_starts, line_no) - 1",
+            f"{indent}if i < 0 or not _HELPER_line_sources[i]:",
+            f"{indent * 2}return None",
+            f"{indent}source_path, line_offset = _HELPER_line_sources[i]",
+            f"{indent}return source_path, line_no - line_offset",
+            None, # replaced with the line table once the lines it describes are laid out
+        ])
+    else:
+        # Tracebacks are translated with the source map instead:
+        strings.extend([
+            f"def _HELPER_entry_point(func):",
+            f"{indent}return func",
+        ])
+    strings = [string + "\n" if string else string for string in strings]
+
+    line_table = LineTable()
+    line_table.add_run(1)
+    build_line_num = len(strings) + 1
+    for module, module_text in zip(graph, module_texts):
+        # Bodies start after the header lines of their function:
+        line_table.add_body(build_line_num + 5, module.file_path, module_bodies[module.name][1])
+        line_table.add_run(build_line_num + 5 + len(module_bodies[module.name][0].splitlines()))
+        build_line_num += module_text.count("\n")
+    # The entry file's body starts after the end of imports comment:
+    line_table.add_body(build_line_num + 1, graph.entry.file_path, module_bodies[None][1])
+    if translate_tracebacks:
+        strings[-1] = (f"_HELPER_line_starts = {line_table.line_starts!r}; "
+            f"_HELPER_line_sources = {line_table.line_sources!r}\n")
+
+    chunks = ["".join(strings), *module_texts, "# End imports.\n" + module_bodies[None][0]]
+    if bytecode:
+        return (build_bytecode_loader(chunks, indent), line_table)
+    return ("".join(chunks), line_table)
+
+def write_build(output, line_table, build_fn, source_map_fn=None, bytecode=False):
+    """Writes a build to build_fn (or standard output if None) and its source map if requested."""
+    if source_map_fn:
+        if bytecode:
+            file_names = [BYTECODE_FILE_NAME]
         else:
-            return "".join(module_buffer)
+            # exec reports code as coming from <string>:
+            file_names = [os.path.basename(build_fn or "-"), "<string>"]
+        line_table.save(source_map_fn, file_names)
+    try:
+        build_file = open(build_fn, "w") if build_fn else sys.stdout
+        print(output, file=build_file)
+    finally:
+        if build_fn:
+            build_file.close()
+
+def write_dependency_file(dep_fn, build_fn, graph, preprocessor_path, build_opts=()):
+    """Writes Makefile rules that rebuild a build and the dependency file when their inputs change.
+
+    Positional arguments:
+    dep_fn -- the dependency file to write
+    build_fn -- the build file the rules make
+    graph -- the ImportGraph of the build
+    preprocessor_path -- the path of this script, which the rules run
+    build_opts -- the other options the rules pass to the preprocessor
+    """
+    # Include both entry file and this preprocessor as dependencies:
+    dep_paths = graph.get_file_paths() + [preprocessor_path, graph.entry.file_path]
+    deps = '\\\n  '.join(f"./{path} " for path in dep_paths)
+    command = f"python {preprocessor_path} {graph.entry.file_path}"
+    opts = "".join(f" {opt}" for opt in build_opts)
+    with open(dep_fn, "w") as output_file:
+        print(f"{build_fn}: {deps}", file=output_file)
+        print(f"\t{command} --build-file={build_fn}{opts}", file=output_file)
+        print(f"{dep_fn}: $(filter $(shell find -name '*.py' -not -path './.*'),{deps})",
+            file=output_file)
+        print(f"\t{command} --dependency-file={dep_fn} --build-file={build_fn}{opts}",
+            file=output_file)
+
+def get_file_mtimes(graph):
+    """Returns a dict mapping the names of the modules in a graph (and None) to file mtimes."""
+    mtimes = {}
+    for module in itertools.chain([graph.entry], graph):
+        try:
+            mtimes[module.name] = os.stat(module.file_path).st_mtime_ns
+        except FileNotFoundError:
+            mtimes[module.name] = None
+    return mtimes
+
+def watch(file_path, build_fn, source_map_fn=None, indent=" " * 4, auto_detect_entry_points=True,
+        cache=None, tree_shake=False, bytecode=False, lazy_imports=False, fold_constants=False,
+        poll_interval=DEFAULT_POLL_INTERVAL):
+    """Builds a script, then rebuilds it whenever a file in the build changes until interrupted.
+
+    The import graph is kept in memory between rebuilds, so only changed modules (and modules they
+    newly import) are preprocessed again. The time each rebuild takes is reported on standard error.
+    Errors while rebuilding are reported and leave the last build in place.
+    """
+    graph = build_import_graph(file_path, auto_detect_entry_points, cache, lazy_imports)
+    symbols_cache = {}
+    write_build(*assemble_build(graph, indent, tree_shake, bytecode, not source_map_fn,
+        lazy_imports, symbols_cache, fold_constants), build_fn, source_map_fn, bytecode)
+    if cache:
+        cache.save()
+    mtimes = get_file_mtimes(graph)
+    failed_names = set() # modules to preprocess again after the last rebuild failed
+    print(f"Built {build_fn} from {len(graph) + 1} files; watching for changes.", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(poll_interval)
+            new_mtimes = get_file_mtimes(graph)
+            changed_names = [name for name, mtime in new_mtimes.items()
+                if mtime != mtimes.get(name)]
+            if not changed_names:
+                continue
+            mtimes = new_mtimes
+            changed_names.extend(failed_names.difference(changed_names))
+            start = time.perf_counter()
+            changed_paths = [graph.get_module(name).file_path for name in changed_names]
+            try:
+                preprocessed, removed = update_import_graph(graph, changed_names,
+                    auto_detect_entry_points, cache, lazy_imports)
+                write_build(*assemble_build(graph, indent, tree_shake, bytecode,
+                    not source_map_fn, lazy_imports, symbols_cache, fold_constants), build_fn,
+                    source_map_fn, bytecode)
+            except (OSError, SyntaxError, UnicodeDecodeError, RuntimeError) as e:
+                print(f"Failed to rebuild {build_fn} after changes to {', '.join(changed_paths)}: "
+                    f"{type(e).__name__}: {e}", file=sys.stderr)
+                failed_names.update(name for name in changed_names if name in graph
+                    or name is None)
+                continue
+            failed_names.clear()
+            if cache:
+                cache.save()
+            mtimes = get_file_mtimes(graph)
+            print(f"Rebuilt {build_fn} in {(time.perf_counter() - start) * 1e3:.1f} ms after "
+                f"changes to {', '.join(changed_paths)} ({len(preprocessed)} modules "
+                f"preprocessed, {len(removed)} removed).", file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == "__main__":
     if "--help" in sys.argv:
@@ -205,11 +1824,19 @@ if __name__ == "__main__":
         print("Synopsis:", file=sys.stderr)
         print(
             f"  {bd}{sys.argv[0]}{es} {ul}entryfile{es} "
-            f"[{bd}--build-file={es}{ul}buildfile{es}] [{bd}--auto-detect-entry-points{es}]",
+            f"[{bd}--build-file={es}{ul}buildfile{es}] [{bd}--auto-detect-entry-points{es}] "
+            f"[{bd}--cache-file={es}{ul}cachefile{es} | {bd}--no-cache{es}] "
+            f"[{bd}--tree-shake{es}] [{bd}--bytecode{es}] [{bd}--lazy-imports{es}] "
+            f"[{bd}--fold-constants{es}] [{bd}--source-map={es}{ul}mapfile{es}]",
+            file=sys.stderr)
+        print(
+            f"  {bd}{sys.argv[0]}{es} {ul}entryfile{es} {bd}--watch{es} "
+            f"{bd}--build-file={es}{ul}buildfile{es} [{ul}options{es}]",
             file=sys.stderr)
         print(
             f"  {bd}{sys.argv[0]}{es} {ul}entryfile{es} "
-            f"{bd}--dependency-file={es}{ul}depfile{es} {bd}--build-file={es}{ul}buildfile{es}",
+            f"{bd}--dependency-file={es}{ul}depfile{es} {bd}--build-file={es}{ul}buildfile{es} "
+            f"[{ul}options{es}]",
             file=sys.stderr)
         print(
             f"  {bd}{sys.argv[0]} --help{es}",
@@ -230,15 +1857,71 @@ if __name__ == "__main__":
             f"If {bd}--dependency-file{es} is specified, the preprocessed file is not output. "
             f"Instead, Makefile rules are written to {ul}depfile{es} that rebuild "
             f"{ul}buildfile{es} (which must be specified in this form of the command) and "
-            f"{ul}depfile{es} when imported files are changed."),
+            f"{ul}depfile{es} when imported files are changed. Any other {ul}options{es} are "
+            f"passed on to the rules' commands."),
             file=sys.stderr)
         print(file=sys.stderr)
         print(textwrap.fill(
             f"If an imported file cannot be found, it is treated as a builtin Python module and "
             f"the import statement is left intact in the preprocessed output and omitted from "
-            f"the Makefile rule dependencies. Importing comma-separated names from modules using "
-            f"the '{bd}from{es} {ul}module{es} {bd}import{es} {ul}name{es}, ... ' syntax is not "
-            f"supported."),
+            f"the Makefile rule dependencies. Import statements are found by parsing each "
+            f"module, so they may be nested in blocks, span several lines or import several "
+            f"comma-separated names."),
+            file=sys.stderr)
+        print(file=sys.stderr)
+        print(textwrap.fill(
+            f"Preprocessed modules are cached in {ul}cachefile{es} (default "
+            f"'{DEFAULT_CACHE_FILE}'), keyed by a hash of their contents, so only modules that "
+            f"changed since the last run are scanned again. {bd}--no-cache{es} disables the "
+            f"cache."),
+            file=sys.stderr)
+        print(file=sys.stderr)
+        print(textwrap.fill(
+            f"With {bd}--watch{es}, {ul}buildfile{es} is built and then rebuilt whenever a file "
+            f"it was built from changes, until interrupted. Imports are kept in memory between "
+            f"rebuilds so only changed modules are preprocessed again, and the time each rebuild "
+            f"takes is reported. Other {ul}options{es} apply to every rebuild."),
+            file=sys.stderr)
+        print(file=sys.stderr)
+        print(textwrap.fill(
+            f"If {bd}--tree-shake{es} is set, top-level functions and classes in imported "
+            f"modules that can't be reached by name from {ul}entryfile{es} or from code run when "
+            f"a module is imported are left out of the build. Names looked up dynamically, such "
+            f"as with getattr, are not followed."),
+            file=sys.stderr)
+        print(file=sys.stderr)
+        print(textwrap.fill(
+            f"If {bd}--bytecode{es} is set, the build is compiled ahead of time and "
+            f"{ul}buildfile{es} holds the compiled code alongside a small loader, so the robot "
+            f"doesn't have to compile it on startup. If the robot's Python version uses a "
+            f"different bytecode format, the loader compiles the build's source instead, which "
+            f"is stored in {ul}buildfile{es} as well. Both are compressed, so {ul}buildfile{es} "
+            f"is about as large as without {bd}--bytecode{es}."),
+            file=sys.stderr)
+        print(file=sys.stderr)
+        print(textwrap.fill(
+            f"If {bd}--lazy-imports{es} is set, imported modules are only run when they're "
+            f"first used. A module imported whole runs on first attribute access. A function or "
+            f"class defined at the top level of a module and imported by name is bound to a "
+            f"proxy that runs the module when the name is first called, subclassed or has an "
+            f"attribute looked up. Importing any other name, a star import or a name used in "
+            f"except clauses and bare raise statements runs the module immediately."),
+            file=sys.stderr)
+        print(file=sys.stderr)
+        print(textwrap.fill(
+            f"If {bd}--fold-constants{es} is set, calls to pure functions such as units.convert "
+            f"with constant arguments are replaced with their results, followed by a comment "
+            f"showing the call. Lists of frozen dataclass instances built from constants that are "
+            f"passed to a call inside a function are built once, as a tuple, when their module "
+            f"is imported, so the function they're passed to must not modify them."),
+            file=sys.stderr)
+        print(file=sys.stderr)
+        print(textwrap.fill(
+            f"If {bd}--source-map{es} is specified, the table mapping lines of "
+            f"{ul}buildfile{es} to the files they came from is written to {ul}mapfile{es} "
+            f"instead of being included in {ul}buildfile{es}, and entry points are left "
+            f"unwrapped. Tracebacks printed by the build can then be translated with "
+            f"translate_traceback.py."),
             file=sys.stderr)
         print(file=sys.stderr)
         print(textwrap.fill(
@@ -246,35 +1929,50 @@ if __name__ == "__main__":
             f"current directory; relative imports are not supported."),
             file=sys.stderr)
         exit(0)
-    output, modules = process_file(sys.argv[1],
-        auto_detect_entry_points="--auto-detect-entry-points" in sys.argv)
-    depfile_opt = "--dependency-file="
-    # Use last duplicate option:
-    dep_fn = next((arg[len(depfile_opt):] for arg in reversed(sys.argv)
-        if arg.startswith(depfile_opt)), None)
+    cache_fn_opt = "--cache-file="
+    cache_fn = next((arg[len(cache_fn_opt):] for arg in reversed(sys.argv)
+        if arg.startswith(cache_fn_opt)), DEFAULT_CACHE_FILE)
+    cache = None if "--no-cache" in sys.argv else BuildCache(cache_fn)
+    source_map_opt = "--source-map="
+    source_map_fn = next((arg[len(source_map_opt):] for arg in reversed(sys.argv)
+        if arg.startswith(source_map_opt)), None)
     build_fn_opt = "--build-file="
+    # Use last duplicate option:
     build_fn = next((arg[len(build_fn_opt):] for arg in reversed(sys.argv)
         if arg.startswith(build_fn_opt)), None)
+    if "--watch" in sys.argv:
+        if not build_fn:
+            print("--build-file must be specified in watch mode.", file=sys.stderr)
+            exit(1)
+        watch(sys.argv[1], build_fn, source_map_fn,
+            auto_detect_entry_points="--auto-detect-entry-points" in sys.argv, cache=cache,
+            tree_shake="--tree-shake" in sys.argv, bytecode="--bytecode" in sys.argv,
+            lazy_imports="--lazy-imports" in sys.argv,
+            fold_constants="--fold-constants" in sys.argv)
+        exit(0)
+    depfile_opt = "--dependency-file="
+    dep_fn = next((arg[len(depfile_opt):] for arg in reversed(sys.argv)
+        if arg.startswith(depfile_opt)), None)
     if dep_fn:
         if not build_fn:
             print("--build-file must be specified if writing dependencies.", file=sys.stderr)
             exit(1)
-        # Include both entry file and this preprocessor as dependencies:
-        dep_paths = [module.file_path for module in modules] + sys.argv[:2]
-        deps = '\\\n  '.join(f"./{path} " for path in dep_paths)
-        with open(dep_fn, "w") as output_file:
-            print(f"{build_fn}: {deps}", file=output_file)
-            print(f"\tpython {sys.argv[0]} {sys.argv[1]} --build-file={build_fn}",
-                file=output_file)
-            print(f"{dep_fn}: $(filter $(shell find -name '*.py' -not -path './.*'),{deps})",
-                file=output_file)
-            print((f"\tpython {sys.argv[0]} {sys.argv[1]} --dependency-file={dep_fn} "
-                f"--build-file={build_fn}"),
-                file=output_file)
-    else:
-        try:
-            build_file = open(build_fn, "w") if build_fn else sys.stdout
-            print(output, file=build_file)
-        except Exception as e:
-            build_file.close()
-            raise e
+        # Only the import graph is needed, not the build itself:
+        graph = build_import_graph(sys.argv[1],
+            auto_detect_entry_points="--auto-detect-entry-points" in sys.argv, cache=cache,
+            lazy_imports="--lazy-imports" in sys.argv)
+        if cache:
+            cache.save()
+        # Pass the remaining options on so the build file is rebuilt the same way:
+        build_opts = [arg for arg in sys.argv[2:]
+            if not arg.startswith((depfile_opt, build_fn_opt, "--watch"))]
+        write_dependency_file(dep_fn, build_fn, graph, sys.argv[0], build_opts)
+        exit(0)
+    output, line_table, modules = process_file(sys.argv[1],
+        auto_detect_entry_points="--auto-detect-entry-points" in sys.argv, cache=cache,
+        tree_shake="--tree-shake" in sys.argv, bytecode="--bytecode" in sys.argv,
+        translate_tracebacks=not source_map_fn, lazy_imports="--lazy-imports" in sys.argv,
+        fold_constants="--fold-constants" in sys.argv)
+    if cache:
+        cache.save()
+    write_build(output, line_table, build_fn, source_map_fn, "--bytecode" in sys.argv)
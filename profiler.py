@@ -0,0 +1,125 @@
+import csv
+import json
+import math
+import time
+from ringbuffer import RingBuffer
+
+"""Number of recent durations kept for each timed function."""
+DEFAULT_RECENT_COUNT = 1024
+
+"""Exponents of two bounding the histogram buckets, in seconds.
+
+The first bucket holds durations up to 2 ** MIN_BUCKET_EXPONENT seconds (about 60 nanoseconds) and
+each next bucket doubles the bound, the last holding everything longer.
+"""
+MIN_BUCKET_EXPONENT = -24
+MAX_BUCKET_EXPONENT = 2
+
+
+class LogHistogram:
+    """Counts durations in buckets whose bounds are successive powers of two."""
+
+    def __init__(self):
+        self.counts = [0] * (MAX_BUCKET_EXPONENT - MIN_BUCKET_EXPONENT + 1)
+
+    def add(self, seconds):
+        # frexp returns the exponent e for which seconds is in [2 ** (e - 1), 2 ** e):
+        exponent = math.frexp(seconds)[1] if seconds > 0 else MIN_BUCKET_EXPONENT
+        self.counts[min(max(exponent - MIN_BUCKET_EXPONENT, 0), len(self.counts) - 1)] += 1
+
+    def get_bucket_bounds(self):
+        """Returns the upper bound of each bucket in seconds, with None for the last."""
+        return [2.0 ** exponent
+            for exponent in range(MIN_BUCKET_EXPONENT, MAX_BUCKET_EXPONENT)] + [None]
+
+
+class FunctionTiming:
+    """The durations of calls to one function."""
+
+    def __init__(self, recent_count):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = RingBuffer(recent_count)
+        self.histogram = LogHistogram()
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.recent.append(seconds)
+        self.histogram.add(seconds)
+
+    def get_recent_percentile(self, percentile):
+        """Returns the given percentile of the recent durations, or None if there are none."""
+        recent = sorted(self.recent)
+        if not recent:
+            return None
+        return recent[min(len(recent) - 1, int(len(recent) * percentile / 100))]
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "max": self.max,
+            "recent_p50": self.get_recent_percentile(50),
+            "recent_p99": self.get_recent_percentile(99),
+            "recent": list(self.recent),
+            "histogram": {"bucket_bounds": self.histogram.get_bucket_bounds(),
+                "counts": self.histogram.counts},
+        }
+
+
+class LayerProfiler:
+    """Times calls to the functions a RobotController makes each tick.
+
+    Functions are timed by replacing them with wrappers, so nothing is timed (or slowed down) until
+    RobotController.enable_profiling is called. Durations are measured with time.perf_counter and
+    kept in seconds.
+    """
+
+    def __init__(self, recent_count=DEFAULT_RECENT_COUNT):
+        """Creates a LayerProfiler with no timings.
+
+        Positional arguments:
+        recent_count -- the number of recent durations to keep for each function
+        """
+        self._recent_count = recent_count
+        self.timings = {}
+
+    def wrap(self, name, func):
+        """Returns a function that calls func and records its duration under name."""
+        timing = self.timings.get(name)
+        if not timing:
+            timing = self.timings[name] = FunctionTiming(self._recent_count)
+        record = timing.record
+        perf_counter = time.perf_counter
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(perf_counter() - start)
+        timed.__wrapped__ = func
+        return timed
+
+    def save(self, path):
+        """Writes the timings to a file, as CSV if its name ends in .csv and as JSON otherwise.
+
+        CSV files hold one row of summary statistics per function; JSON files also hold each
+        function's recent durations and histogram.
+        """
+        with open(path, "w", newline="") as file:
+            if not path.endswith(".csv"):
+                json.dump({name: timing.to_dict() for name, timing in self.timings.items()}, file,
+                    indent=2)
+                return
+            writer = csv.writer(file)
+            writer.writerow(["name", "count", "total", "mean", "max", "recent_p50",
+                "recent_p99"])
+            for name, timing in self.timings.items():
+                summary = timing.to_dict()
+                writer.writerow([name] + [summary[column] for column in ("count", "total", "mean",
+                    "max", "recent_p50", "recent_p99")])
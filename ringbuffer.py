@@ -0,0 +1,131 @@
+from array import array
+
+
+class RingBuffer:
+    """A fixed-size buffer of floats that overwrites its oldest values once full.
+
+    Appending never allocates, so buffers can record values every tick for as long as the robot
+    runs.
+    """
+
+    def __init__(self, size):
+        """Creates an empty RingBuffer.
+
+        Positional arguments:
+        size -- the number of values kept
+        """
+        self._values = array("d", bytes(8 * size))
+        self._size = size
+        self._next_index = 0
+        self._is_full = False
+
+    def __len__(self):
+        return self._size if self._is_full else self._next_index
+
+    def __getitem__(self, index):
+        """Returns a value kept, index 0 being the oldest."""
+        if not 0 <= index < len(self):
+            raise IndexError("RingBuffer index out of range")
+        if self._is_full:
+            index = (self._next_index + index) % self._size
+        return self._values[index]
+
+    def __iter__(self):
+        """Yields the values kept, oldest first."""
+        if self._is_full:
+            yield from self._values[self._next_index:]
+        yield from self._values[:self._next_index]
+
+    def clear(self):
+        """Removes every value kept."""
+        self._next_index = 0
+        self._is_full = False
+
+    def append(self, value):
+        """Adds a value, overwriting the oldest value kept if the buffer is full."""
+        self._values[self._next_index] = value
+        self._next_index += 1
+        if self._next_index == self._size:
+            self._next_index = 0
+            self._is_full = True
+
+
+class TimeSeriesBuffer:
+    """A fixed-size buffer of timestamped floats that overwrites its oldest values once full.
+
+    Timestamps must never decrease, as with those of a monotonic clock. get_value_at keeps a
+    pointer to the sample it last found, which only moves forward while the times asked for don't
+    go back, so asking for the value a fixed interval ago every tick takes amortized constant time.
+    """
+
+    def __init__(self, size):
+        """Creates an empty TimeSeriesBuffer.
+
+        Positional arguments:
+        size -- the number of samples kept
+        """
+        self._times = array("d", bytes(8 * size))
+        self._values = array("d", bytes(8 * size))
+        self._size = size
+        self._count = 0 # number of samples appended, so sample i is kept at index i % size
+        self._trail = 0 # number of the sample get_value_at last found
+
+    def __len__(self):
+        return min(self._count, self._size)
+
+    def clear(self):
+        """Removes every sample kept."""
+        self._count = 0
+        self._trail = 0
+
+    def append(self, time, value):
+        """Adds a sample, overwriting the oldest sample kept if the buffer is full."""
+        if self._count and time < self._times[(self._count - 1) % self._size]:
+            raise ValueError("TimeSeriesBuffer timestamps must not decrease.")
+        index = self._count % self._size
+        self._times[index] = time
+        self._values[index] = value
+        self._count += 1
+
+    def get_time(self, index):
+        """Returns the time of a sample kept, index 0 being the oldest and -1 the newest."""
+        return self._times[self._get_sample(index) % self._size]
+
+    def get_value(self, index):
+        """Returns the value of a sample kept, index 0 being the oldest and -1 the newest."""
+        return self._values[self._get_sample(index) % self._size]
+
+    def get_value_at(self, time):
+        """Returns the value of the newest sample taken at or before time.
+
+        Returns None if every sample kept was taken after time.
+        """
+        times = self._times
+        size = self._size
+        first = max(self._count - size, 0)
+        if not self._count or times[first % size] > time:
+            return None
+        trail = max(self._trail, first)
+        if times[trail % size] > time:
+            # The time asked for went back, so binary search between the oldest sample and the
+            # last one found:
+            low, high = first, trail
+            while high - low > 1:
+                middle = (low + high) // 2
+                if times[middle % size] <= time:
+                    low = middle
+                else:
+                    high = middle
+            trail = low
+        else:
+            while trail + 1 < self._count and times[(trail + 1) % size] <= time:
+                trail += 1
+        self._trail = trail
+        return self._values[trail % size]
+
+    def _get_sample(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("TimeSeriesBuffer index out of range")
+        return max(self._count - self._size, 0) + index
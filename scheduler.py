@@ -0,0 +1,100 @@
+import time
+
+
+class TickStats:
+    """Timing statistics of the ticks run by a TickScheduler.
+
+    Jitter is how late a tick started after its deadline. A tick overruns when it finishes after the
+    next tick's deadline, in which case the ticks it made the scheduler miss are skipped rather
+    than run back to back to catch up.
+    """
+
+    def __init__(self):
+        self.tick_count = 0
+        self.overrun_count = 0
+        self.skipped_tick_count = 0
+        self.total_jitter = 0.0
+        self.max_jitter = 0.0
+        self.total_cpu_time = 0.0
+        self.max_cpu_time = 0.0
+
+    def record(self, jitter, cpu_time, skipped_ticks):
+        """Records a tick's jitter and CPU time in seconds and how many ticks it made overrun."""
+        self.tick_count += 1
+        self.total_jitter += jitter
+        self.max_jitter = max(self.max_jitter, jitter)
+        self.total_cpu_time += cpu_time
+        self.max_cpu_time = max(self.max_cpu_time, cpu_time)
+        if skipped_ticks:
+            self.overrun_count += 1
+            self.skipped_tick_count += skipped_ticks
+
+    def __str__(self):
+        if not self.tick_count:
+            return "0 ticks"
+        return (f"{self.tick_count} ticks, {self.overrun_count} overruns "
+            f"({self.skipped_tick_count} ticks skipped), jitter mean "
+            f"{self.total_jitter / self.tick_count * 1e3:.3f} ms max "
+            f"{self.max_jitter * 1e3:.3f} ms, CPU time mean "
+            f"{self.total_cpu_time / self.tick_count * 1e3:.3f} ms max "
+            f"{self.max_cpu_time * 1e3:.3f} ms")
+
+
+class TickScheduler:
+    """Runs a function at a fixed rate, such as RobotController.update.
+
+    Deadlines are kept on the monotonic clock, each one period after the last, so ticks don't drift
+    when some run late. Between ticks the scheduler sleeps for whatever is left of the period
+    instead of spinning.
+    """
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        """Creates a TickScheduler.
+
+        Positional arguments:
+        rate -- the number of ticks to run per second
+        clock -- the function returning the time in seconds to schedule ticks by
+        sleep -- the function to wait with, given a number of seconds
+        """
+        self._period = 1 / rate
+        self._clock = clock
+        self._sleep = sleep
+        self.reset()
+
+    def reset(self):
+        """Clears the statistics and makes the next tick run immediately, as the first one does."""
+        self._deadline = None
+        self.stats = TickStats()
+
+    def run_tick(self, func):
+        """Waits until the next tick's deadline, then calls func and returns its result.
+
+        The first tick runs immediately. Call this in a loop, or from a function the robot's
+        runtime calls repeatedly, such as autonomous_main.
+        """
+        now = self._clock()
+        if self._deadline is None:
+            self._deadline = now
+        elif now < self._deadline:
+            self._sleep(self._deadline - now)
+            now = self._clock()
+        jitter = max(0.0, now - self._deadline)
+        cpu_start = time.process_time()
+        result = func()
+        cpu_time = time.process_time() - cpu_start
+        self._deadline += self._period
+        end = self._clock()
+        skipped_ticks = 0
+        if end > self._deadline:
+            # Skip the deadlines already missed rather than running late ticks back to back:
+            skipped_ticks = int((end - self._deadline) / self._period) + 1
+            self._deadline += skipped_ticks * self._period
+        self.stats.record(jitter, cpu_time, skipped_ticks)
+        return result
+
+    def run(self, func):
+        """Calls func once per tick until it returns a truthy value, and returns that value."""
+        while True:
+            result = self.run_tick(func)
+            if result:
+                return result
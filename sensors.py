@@ -0,0 +1,139 @@
+"""Value a subscription's last notified value has before its first notification."""
+_UNREAD = object()
+
+
+class SensorSubscription:
+    """A listener's interest in one property of one device."""
+    __slots__ = ("device_id", "value_name", "listener", "threshold", "predicate", "value")
+    def __init__(self, device_id, value_name, listener, threshold, predicate):
+        self.device_id = device_id
+        self.value_name = value_name
+        self.listener = listener
+        self.threshold = threshold
+        self.predicate = predicate
+        self.value = _UNREAD # the value the listener was last called with
+
+    def is_changed(self, value):
+        """Returns whether the listener should be called for a newly read value."""
+        if self.value is _UNREAD:
+            return True
+        if self.predicate:
+            return self.predicate(self.value, value)
+        if self.threshold:
+            return abs(value - self.value) >= self.threshold
+        return value != self.value
+
+
+class SensorSubscriptions:
+    """Reads subscribed device properties once per poll and calls the listeners of changed ones.
+
+    However many listeners subscribe to a property, it's read from the robot once per poll, and
+    listeners are only called when its value changed enough to interest them.
+    """
+
+    def __init__(self, robot):
+        """Creates a SensorSubscriptions with no subscriptions.
+
+        Positional arguments:
+        robot -- the Robot or Robot-like object to read properties from
+        """
+        self._robot = robot
+        # Maps (device id, property) pairs to [value last read, subscriptions]:
+        self._subscriptions = {}
+
+    def subscribe(self, device_id, value_name, listener, threshold=0, predicate=None):
+        """Calls listener with a property's value on the next poll and whenever it changes after.
+
+        Positional arguments:
+        device_id -- the id of the device to read
+        value_name -- the name of the property to read, such as "enc_a"
+        listener -- the function to call with the new value
+        threshold -- if nonzero, the listener is only called once the value differs from the one it
+            was last called with by at least this much
+        predicate -- if given, a function called with the value the listener was last called with
+            and the new value, which returns whether to call the listener; overrides threshold
+        Returns the SensorSubscription, which can be passed to unsubscribe.
+        """
+        subscription = SensorSubscription(device_id, value_name, listener, threshold, predicate)
+        entry = self._subscriptions.setdefault((device_id, value_name), [_UNREAD, []])
+        entry[1].append(subscription)
+        # Make the next poll dispatch the value to the new listener even if it hasn't changed:
+        entry[0] = _UNREAD
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stops calling a subscription's listener."""
+        key = (subscription.device_id, subscription.value_name)
+        subscriptions = self._subscriptions[key][1]
+        subscriptions.remove(subscription)
+        if not subscriptions:
+            del self._subscriptions[key]
+
+    def poll(self):
+        """Reads every subscribed property and calls the listeners interested in its change."""
+        # Listeners may subscribe or unsubscribe, so iterate over a copy:
+        for (device_id, value_name), entry in list(self._subscriptions.items()):
+            value = self._robot.get_value(device_id, value_name)
+            if value == entry[0]:
+                continue
+            entry[0] = value
+            for subscription in list(entry[1]):
+                if subscription.is_changed(value):
+                    subscription.value = value
+                    subscription.listener(value)
+
+
+class SensorFrame:
+    """A Robot-like object that reads each property at most once per frame.
+
+    Between begin and end, the first read of a property goes to the robot and later reads of it are
+    served from the frame, until the property is set. Outside a frame, reads go straight to the
+    robot. Attributes other than get_value and set_value are the robot's own.
+    """
+
+    def __init__(self, robot):
+        """Creates a SensorFrame reading from robot, outside a frame.
+
+        Positional arguments:
+        robot -- the Robot or Robot-like object to read properties from
+        """
+        self._robot = robot
+        self._values = None # maps (device id, property) pairs to values read this frame
+        self.frame_count = 0
+        self.hit_count = 0 # reads served from a frame
+        self.miss_count = 0 # reads in a frame that went to the robot
+
+    def __getattr__(self, name):
+        return getattr(self._robot, name)
+
+    def begin(self):
+        """Starts a frame, so properties are read from the robot again."""
+        self._values = {}
+        self.frame_count += 1
+
+    def end(self):
+        """Ends the frame, so reads go straight to the robot until the next one begins."""
+        self._values = None
+
+    def get_value(self, device_id, value_name):
+        if self._values is None:
+            return self._robot.get_value(device_id, value_name)
+        key = (device_id, value_name)
+        if key in self._values:
+            self.hit_count += 1
+            return self._values[key]
+        self.miss_count += 1
+        value = self._values[key] = self._robot.get_value(device_id, value_name)
+        return value
+
+    def set_value(self, device_id, value_name, value):
+        self._robot.set_value(device_id, value_name, value)
+        if self._values is not None:
+            # The robot may convert the value or change it itself, so read it again if needed:
+            self._values.pop((device_id, value_name), None)
+
+    def __str__(self):
+        read_count = self.hit_count + self.miss_count
+        return (f"{read_count} reads in {self.frame_count} frames, {self.miss_count} from the "
+            f"robot ({self.hit_count / read_count * 100 if read_count else 0:.1f}% served from "
+            f"frames)")
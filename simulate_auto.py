@@ -1,8 +1,19 @@
 import time
 import importlib
 import sys
+startup_start = time.perf_counter()
 build = importlib.import_module(sys.argv[1])
+profile_opt = "--profile="
+profile_fn = next((arg[len(profile_opt):] for arg in reversed(sys.argv)
+    if arg.startswith(profile_opt)), None)
+if profile_fn:
+    # Times each layer, saving the timings when the strategy finishes:
+    build.PROFILE_FILE = profile_fn
 build.autonomous_setup()
+if "--startup-time" in sys.argv:
+    # Report how long it took to get to the first tick, for bench_startup.py:
+    print(time.perf_counter() - startup_start)
+    exit(0)
 while True:
-    #time.sleep(1 / 1000)
+    # autonomous_main waits for its tick itself:
     build.autonomous_main()
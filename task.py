@@ -9,7 +9,7 @@ class UnsupportedTaskError(TypeError):
             f" '{type(task).__name__}'.")
 
 
-@dataclass
+@dataclass(frozen=True)
 class AxialMovementTask:
     """Moves the robot forwards or backwards by a distance."""
 
@@ -20,7 +20,7 @@ class AxialMovementTask:
     distance: float
 
 
-@dataclass
+@dataclass(frozen=True)
 class TurnTask:
     """Turn the robot in place."""
 
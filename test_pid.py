@@ -0,0 +1,67 @@
+"""Checks the integral, derivative and output clamping of PidController and its reset.
+
+Usage: python test_pid.py
+
+Each test steps a controller on a simulated clock. The tests can also be collected by pytest.
+"""
+import math
+from clock import SimulatedClock
+from pid import PidController
+
+
+def step_at(controller, clock, seconds, setpoint, measurement):
+    """Advances the clock by seconds, then steps the controller."""
+    clock.sleep(seconds)
+    return controller.step(setpoint, measurement)
+
+
+def test_integral_clamped():
+    clock = SimulatedClock()
+    controller = PidController(0, 2.0, 0, output_limit=None, integral_limit=0.5, clock=clock)
+    controller.step(10, 0)
+    for _ in range(100):
+        output = step_at(controller, clock, 1.0, 10, 0)
+    assert math.isclose(output, 0.5)
+    # The integral didn't wind up past its limit, so it unwinds as soon as the error reverses:
+    assert math.isclose(step_at(controller, clock, 0.05, 0, 1), 0.4)
+    assert math.isclose(step_at(controller, clock, 1.0, 0, 10), -0.5)
+
+
+def test_output_clamped():
+    clock = SimulatedClock()
+    controller = PidController(1.0, 0, 0, output_limit=0.75, clock=clock)
+    assert controller.step(10, 0) == 0.75
+    assert controller.step(-10, 0) == -0.75
+    assert controller.step(0.5, 0) == 0.5
+
+
+def test_derivative_of_measurement():
+    clock = SimulatedClock()
+    controller = PidController(0, 0, 1.0, output_limit=None, derivative_samples=4, clock=clock)
+    controller.step(0, 0)
+    # Jumping the setpoint doesn't kick the output:
+    assert step_at(controller, clock, 0.5, 100, 0) == 0
+    # The derivative is the slope over the last derivative_samples steps, opposing the motion:
+    for i in range(1, 10):
+        output = step_at(controller, clock, 0.5, 100, i)
+    assert math.isclose(output, -2.0)
+    # A spike in one measurement is spread over the samples:
+    assert math.isclose(step_at(controller, clock, 0.5, 100, 20), -(20 - 6) / 2.0)
+
+
+def test_reset():
+    clock = SimulatedClock()
+    controller = PidController(1.0, 1.0, 1.0, output_limit=None, clock=clock)
+    controller.step(1, 0)
+    step_at(controller, clock, 1.0, 1, 0.5)
+    controller.reset()
+    # With no integral or past measurements, only the proportional term is left:
+    assert step_at(controller, clock, 1.0, 2, 0.5) == 1.5
+    assert math.isclose(step_at(controller, clock, 1.0, 2, 1.0), 1.0 + 1.0 - 0.5)
+
+
+if __name__ == "__main__":
+    tests = [(name, test) for name, test in globals().items() if name.startswith("test_")]
+    for name, test in tests:
+        test()
+        print(f"{name}: ok")
@@ -0,0 +1,289 @@
+"""Checks that builds made by the preprocessor behave like the source they were made from.
+
+Usage: python test_preprocessor.py
+
+Each test preprocesses an entry file using the modules of this directory and runs the build. The
+tests can also be collected by pytest.
+"""
+import os
+import re
+import tempfile
+import itertools
+import importlib.util
+import preprocessor
+
+"""Directory of the modules imported by the test entry files, which imports are resolved from."""
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+"""Entry file running a CoroutineLayer over a bottom layer that rejects anything but ints."""
+COROUTINE_ENTRY = '''
+from controller import RobotController
+from layer import Layer
+from layer.coroutine import CoroutineLayer
+
+class RecordingLayer(Layer):
+    def __init__(self, init_info):
+        self.tasks = []
+    def is_task_done(self):
+        return True
+    def update(self):
+        return None
+    def accept_task(self, task):
+        if not isinstance(task, int):
+            raise TypeError(f"RecordingLayer accepted {task!r}")
+        self.tasks.append(task)
+
+class CountingLayer(CoroutineLayer):
+    def __init__(self, init_info):
+        super().__init__(init_info)
+        self._start(3)
+    async def run(self, count):
+        for i in range(count):
+            await self.submit_subtask(i)
+
+robot_controller = RobotController(None)
+robot_controller.setup([RecordingLayer, CountingLayer])
+while not robot_controller.update():
+    pass
+accepted_tasks = robot_controller.get_stack("main").layers[0].tasks
+'''
+
+"""Module imported by LAZY_VALUES_ENTRY, defining names of every kind."""
+VALUES_MODULE = '''
+NAME = "drive"
+SPEED = 0.5
+SENTINEL = object()
+def double(x):
+    return 2 * x
+class Thing:
+    pass
+'''
+
+"""Entry file using names imported by name from VALUES_MODULE."""
+LAZY_VALUES_ENTRY = '''
+import values
+from values import NAME
+from values import SPEED
+from values import SENTINEL
+from values import double
+from values import Thing
+
+results = [f"{NAME}_a", SPEED * 2, SENTINEL is values.SENTINEL, double(SPEED),
+    isinstance(Thing(), Thing), type(Thing()).__name__]
+'''
+
+"""Modules imported by STAR_IMPORT_ENTRY, which star import each other inside module bodies."""
+STAR_IMPORT_MODULES = {
+    "consts.py": "A = 1\n_PRIVATE = 2\ndef get_a():\n    return A\n",
+    "listed.py": "__all__ = ['B']\nB = 3\nC = 4\n",
+    "mid.py": "from consts import *\nfrom listed import *\nVAL = A + B + get_a()\n",
+    "outer.py": "from mid import *\nOUTER = VAL + A\n",
+}
+
+"""Entry file reading the names bound by star imports in STAR_IMPORT_MODULES."""
+STAR_IMPORT_ENTRY = '''
+import outer
+import mid
+
+results = [outer.OUTER, mid.VAL, hasattr(mid, "_PRIVATE"), hasattr(mid, "C")]
+'''
+
+"""Module imported by SCANNED_MODULE."""
+CONSTS_MODULE = "A = 1\nB = 2\nC = 3\nD = 4\n"
+
+"""Module with imports written every way the import scanner has to handle, and import statements
+inside strings it must leave alone."""
+SCANNED_MODULE = '''
+import os; from consts import C
+from consts import (
+    A,
+    B as BEE,
+)
+DOC = """
+import consts
+from consts import A
+"""
+QUOTED = 'import consts'
+NAME = "x"
+TEXT = f"{NAME} {'from consts import A'}"
+LONG_TEXT = f"""{NAME}
+import consts
+"""
+X = 1; import consts
+def get_d():
+    from consts import D
+    return D
+if NAME:
+    import consts as consts_alias
+results = [A, BEE, C, get_d(), consts.A, consts_alias.B, os.sep, QUOTED, TEXT, DOC.split(),
+    LONG_TEXT.split()]
+'''
+
+"""Entry file reading the results of SCANNED_MODULE."""
+SCANNED_ENTRY = '''
+from scanned import results
+'''
+
+"""Module defining a frozen and a mutable dataclass, imported by DATACLASS_LISTS_ENTRY."""
+DATACLASSES_MODULE = '''
+from dataclasses import dataclass
+
+@dataclass(frozen=True)
+class Frozen:
+    value: int
+
+@dataclass
+class Mutable:
+    value: int
+'''
+
+"""Entry file passing constant lists of each dataclass of DATACLASSES_MODULE to a call."""
+DATACLASS_LISTS_ENTRY = '''
+from dataclasses import FrozenInstanceError
+from shapes import Frozen
+from shapes import Mutable
+
+def make_lists():
+    return list([Frozen(1), Frozen(2)]), list([Mutable(1), Mutable(2)])
+
+frozen, mutable = make_lists()
+mutable[0].value = 3
+results = [make_lists()[1][0].value, make_lists()[0] is not frozen]
+try:
+    frozen[0].value = 3
+except FrozenInstanceError:
+    results.append("frozen")
+'''
+
+"""Entry file recording the subtask queue of each queued strategy from each starting position."""
+STRATEGY_ENTRY = '''
+from mock_robot import MockRobot
+from controller import RobotController
+from layer.strategy import CubeDropStrategy
+from layer.strategy import CubePlateStrategy
+
+queues = {}
+for start_pos in ("left", "right"):
+    for Strategy in (CubeDropStrategy, CubePlateStrategy):
+        robot_controller = RobotController(MockRobot({}, start_pos=start_pos))
+        robot_controller.setup([Strategy])
+        strategy = robot_controller.get_stack("main").layers[0]
+        queue = []
+        while not strategy.is_task_done():
+            queue.append(strategy.update())
+        queues[start_pos, Strategy.__name__] = queue
+'''
+
+
+def build(entry_source, modules=None, **options):
+    """Preprocesses an entry file with the given source, returning the build's text and graph.
+
+    If modules is given, it maps module file names to their sources, which are written beside the
+    entry file and imported instead of the modules of this directory.
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        entry_path = os.path.join(directory, "entry.py")
+        with open(entry_path, "w") as file:
+            file.write(entry_source)
+        for file_name, source in (modules or {}).items():
+            with open(os.path.join(directory, file_name), "w") as file:
+                file.write(source)
+        os.chdir(directory if modules else SOURCE_DIR)
+        try:
+            output, _, graph = preprocessor.process_file(entry_path,
+                auto_detect_entry_points=False, **options)
+        finally:
+            os.chdir(cwd)
+    return output, graph
+
+
+def run_build(output):
+    """Runs the text of a build, returning its global variables."""
+    build_globals = {"__name__": "build"}
+    exec(compile(output, "build", "exec"), build_globals)
+    return build_globals
+
+
+def test_coroutine_layer_stack():
+    for lazy_imports, tree_shake, bytecode in itertools.product([False, True], repeat=3):
+        output, _ = build(COROUTINE_ENTRY, lazy_imports=lazy_imports, tree_shake=tree_shake,
+            bytecode=bytecode)
+        assert run_build(output)["accepted_tasks"] == [0, 1, 2], (
+            f"lazy_imports={lazy_imports}, tree_shake={tree_shake}, bytecode={bytecode}")
+
+
+def test_bytecode_source_fallback():
+    output, _ = build(COROUTINE_ENTRY, bytecode=True)
+    magic_number = repr(importlib.util.MAGIC_NUMBER)
+    assert output.count(magic_number) == 1
+    # An interpreter with another bytecode format compiles the build from its source:
+    output = output.replace(magic_number, repr(b"\0" * 4))
+    assert run_build(output)["accepted_tasks"] == [0, 1, 2]
+
+
+def test_lazy_imported_values():
+    expected = ["drive_a", 1.0, True, 1.0, True, "Thing"]
+    for lazy_imports in (False, True):
+        output, _ = build(LAZY_VALUES_ENTRY, {"values.py": VALUES_MODULE},
+            lazy_imports=lazy_imports)
+        assert run_build(output)["results"] == expected, f"lazy_imports={lazy_imports}"
+    # Only the function and class are left to proxies:
+    assert output.count("_HELPER_LazyName('values'") == 2, output
+
+
+def test_star_imports():
+    for lazy_imports, tree_shake in itertools.product([False, True], repeat=2):
+        output, _ = build(STAR_IMPORT_ENTRY, STAR_IMPORT_MODULES, lazy_imports=lazy_imports,
+            tree_shake=tree_shake)
+        assert run_build(output)["results"] == [6, 5, False, False], (
+            f"lazy_imports={lazy_imports}, tree_shake={tree_shake}")
+
+
+def test_fold_only_frozen_dataclasses():
+    output, _ = build(DATACLASS_LISTS_ENTRY, {"shapes.py": DATACLASSES_MODULE},
+        fold_constants=True)
+    assert "list(_HELPER_constant_0)" in output and "_HELPER_constant_1" not in output, output
+    assert run_build(output)["results"] == [1, True, "frozen"]
+
+
+def test_import_scanner():
+    expected = [1, 2, 3, 4, 1, 2, os.sep, "import consts", "x from consts import A",
+        "import consts from consts import A".split(),
+        ["x", "import", "consts"]]
+    # A triple quote in a comment makes the scanner parse the whole module instead:
+    for source, is_lexical in [(SCANNED_MODULE, True), ('# """\n' + SCANNED_MODULE, False)]:
+        try:
+            preprocessor.locate_statements_lexically(source, False)
+            assert is_lexical
+        except preprocessor._AmbiguousSourceError:
+            assert not is_lexical
+        output, graph = build(SCANNED_ENTRY, {"scanned.py": source, "consts.py": CONSTS_MODULE})
+        assert [module.name for module in graph] == ["scanned", "consts"]
+        assert run_build(output)["results"] == expected, f"is_lexical={is_lexical}"
+        # Multi-line imports are collapsed onto their first line, keeping later lines in place:
+        lines = output.splitlines()
+        scanned_start = lines.index("    # Begin imported file.") + 1
+        assert lines[scanned_start + source.splitlines().index("NAME = \"x\"")] == (
+            '    NAME = "x"')
+
+
+def test_strategy_queues_fold():
+    output, _ = build(STRATEGY_ENTRY)
+    folded_output, _ = build(STRATEGY_ENTRY, fold_constants=True)
+    # Each strategy's queue, whichever way it starts, is built as a tuple on import:
+    queue_args = re.findall(r"self\._submit_subtask_queue\((.*)", folded_output)
+    assert len(queue_args) == 2 and all(re.fullmatch(
+        r"\(_HELPER_constant_\d+ if .* else _HELPER_constant_\d+\)", arg) for arg in queue_args), (
+        queue_args)
+    # Each build defines its own task classes, so compare the tasks' reprs:
+    queues = repr(run_build(output)["queues"])
+    assert repr(run_build(folded_output)["queues"]) == queues
+    assert "AxialMovementTask" in queues
+
+
+if __name__ == "__main__":
+    tests = [(name, test) for name, test in globals().items() if name.startswith("test_")]
+    for name, test in tests:
+        test()
+        print(f"{name}: ok")
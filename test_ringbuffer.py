@@ -0,0 +1,98 @@
+"""Checks that TimeSeriesBuffer finds the sample taken at or before a time among those it keeps.
+
+Usage: python test_ringbuffer.py
+
+The tests can also be collected by pytest.
+"""
+import random
+from ringbuffer import TimeSeriesBuffer
+
+
+def find_value_at(samples, size, time):
+    """Returns what TimeSeriesBuffer.get_value_at should, given every (time, value) appended."""
+    kept = samples[-size:]
+    if not kept or kept[0][0] > time:
+        return None
+    return next(value for sample_time, value in reversed(kept) if sample_time <= time)
+
+
+def test_empty_buffer():
+    buffer = TimeSeriesBuffer(4)
+    assert len(buffer) == 0
+    assert buffer.get_value_at(0.0) is None
+    buffer.append(1.0, 10.0)
+    buffer.clear()
+    assert buffer.get_value_at(2.0) is None
+
+
+def test_exact_timestamps():
+    buffer = TimeSeriesBuffer(8)
+    for i in range(5):
+        buffer.append(float(i), i * 10.0)
+    assert buffer.get_value_at(2.0) == 20.0
+    assert buffer.get_value_at(2.5) == 20.0
+    assert buffer.get_value_at(0.0) == 0.0
+    assert buffer.get_value_at(-0.5) is None
+    assert buffer.get_value_at(4.0) == 40.0
+    assert buffer.get_value_at(100.0) == 40.0
+    # The newest of several samples taken at the same time is found:
+    buffer.append(4.0, 41.0)
+    assert buffer.get_value_at(4.0) == 41.0
+
+
+def test_wraparound():
+    buffer = TimeSeriesBuffer(4)
+    for i in range(10):
+        buffer.append(float(i), i * 10.0)
+    assert len(buffer) == 4
+    assert buffer.get_time(0) == 6.0 and buffer.get_value(-1) == 90.0
+    # Samples older than the oldest kept have been overwritten:
+    assert buffer.get_value_at(5.5) is None
+    assert buffer.get_value_at(6.0) == 60.0
+    assert buffer.get_value_at(8.5) == 80.0
+
+
+def test_queries_going_back():
+    buffer = TimeSeriesBuffer(16)
+    for i in range(12):
+        buffer.append(float(i), i * 10.0)
+    assert buffer.get_value_at(10.0) == 100.0
+    assert buffer.get_value_at(3.0) == 30.0
+    assert buffer.get_value_at(7.5) == 70.0
+    assert buffer.get_value_at(0.0) == 0.0
+    assert buffer.get_value_at(11.0) == 110.0
+
+
+def test_random_against_search():
+    rng = random.Random(0)
+    for size in (1, 2, 5, 16):
+        buffer = TimeSeriesBuffer(size)
+        samples = []
+        time = 0.0
+        for _ in range(500):
+            if rng.random() < 0.6:
+                # Repeated timestamps are allowed:
+                time += rng.choice([0.0, 0.25, 1.0])
+                samples.append((time, rng.random()))
+                buffer.append(*samples[-1])
+            else:
+                query = time - rng.uniform(-1.0, 2.0 * size)
+                assert buffer.get_value_at(query) == find_value_at(samples, size, query), (
+                    size, query)
+
+
+def test_decreasing_timestamps_rejected():
+    buffer = TimeSeriesBuffer(4)
+    buffer.append(2.0, 0.0)
+    try:
+        buffer.append(1.0, 0.0)
+    except ValueError:
+        return
+    assert False, "TimeSeriesBuffer accepted a decreasing timestamp"
+
+
+if __name__ == "__main__":
+    tests = [(name, test) for name, test in globals().items() if name.startswith("test_")]
+    for name, test in tests:
+        test()
+        print(f"{name}: ok")
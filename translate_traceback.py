@@ -0,0 +1,42 @@
+"""Translates line numbers in tracebacks printed by a build to the files they came from.
+
+Usage: python translate_traceback.py mapfile [tracebackfile]
+
+mapfile is a source map written by preprocessor.py --source-map. The traceback is read from
+tracebackfile, or standard input if unspecified, and printed with each frame in the build replaced
+by the file and line it came from. Frames in lines generated by the preprocessor are left as is.
+"""
+import os
+import re
+import sys
+import preprocessor
+
+FRAME_PATTERN = re.compile(r'^(\s*File ")([^"]*)(", line )(\d+)(.*)$')
+
+
+def translate_traceback(lines, line_table, build_file_names):
+    """Yields the lines of a traceback with frames in the build translated.
+
+    Positional arguments:
+    lines -- the lines of the traceback
+    line_table -- the LineTable of the build
+    build_file_names -- the file names frames in the build may be reported under
+    """
+    for line in lines:
+        match = FRAME_PATTERN.match(line)
+        if match and os.path.basename(match[2]) in build_file_names:
+            translation_result = line_table.translate(int(match[4]))
+            if translation_result:
+                source_path, line_no = translation_result
+                line = f"{match[1]}{source_path}{match[3]}{line_no}{match[5]}\n"
+        yield line
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__, file=sys.stderr)
+        exit(1)
+    line_table, build_file_names = preprocessor.LineTable.load(sys.argv[1])
+    traceback_file = open(sys.argv[2]) if len(sys.argv) > 2 else sys.stdin
+    with traceback_file:
+        sys.stdout.writelines(translate_traceback(traceback_file, line_table, build_file_names))